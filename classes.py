@@ -9,8 +9,13 @@ A very simple class to hold the temporary decode data for a line of
 6809 assembly code.
 '''
 class LineData:
+    # FROM 1.4.0: A line's data is a fixed set of fields, so do without the per-object dict
+    __slots__ = ("oper", "opnd", "op_type", "branch_op_type", "pseudo_op_type", "pseudo_op_value",
+                 "index_address", "line_number", "comment_start", "is_indirect", "is_indexed",
+                 "expects_8b_opnd", "symbol_refs")
+
     def __init__(self):
-        self.oper = []               # The line elements
+        self.oper = ()               # The op's record, shared (see OP_RECORDS)
         self.opnd = -1
         self.op_type = 0
         self.branch_op_type = 0
@@ -22,6 +27,7 @@ class LineData:
         self.is_indirect = False
         self.is_indexed = False
         self.expects_8b_opnd = False # ADDED 1.2.0
+        self.symbol_refs = None      # ADDED 1.4.0: The symbols in the operand, as (list item, name) pairs
 
 
 '''
@@ -36,7 +42,65 @@ class AppState:
         self.pass_count = 0
         self.show_upper = 0
         self.num_bytes = 256
+        self.use_index = False
+        self.low_memory = False
+        self.parallel = False
+        self.object_mode = False
+        self.link = False
+        self.relocations = None
+        self.public_symbols = None
         self.labels = None
         self.code = None
         self.out_file = None
         self.chunk = None
+        self.line_addresses = None
+        self.op_addresses = None
+        self.source_files = None
+        self.source_map = None
+        self.xref = None
+        self.json_stream = None
+        self.image_stream = None
+        self.out_format = "rom"
+        self.diagnostics = None
+        self.predefined_symbols = []
+        self.label_index = {}
+        self.label_index_of = None
+        self.label_index_count = 0
+        self.macros = {}
+        self.macro_expansions = {}
+        self.macro_count = 0
+        self.macro_depth = 0
+        self.string_pool = None
+        self.run_entry = None
+        self.run_cycles = 0
+        self.run_profile = False
+        self.analyse = False
+        self.loop_bounds = {}
+        self.variants = []
+        self.variant = None
+        self.server = False
+        self.socket_path = None
+        self.workers = 0
+
+
+'''
+FROM 1.4.0: A class to hold the registers, memory and run state of a
+simulated 6809, as used by --run.
+'''
+class CPUState:
+    __slots__ = ("a", "b", "dp", "cc", "x", "y", "u", "s", "pc", "memory", "extra", "depth", "stop")
+
+    def __init__(self, memory=None):
+        self.a = 0
+        self.b = 0
+        self.dp = 0
+        self.cc = 0x50               # F and I are set on reset
+        self.x = 0
+        self.y = 0
+        self.u = 0
+        self.s = 0
+        self.pc = 0
+        self.memory = memory if memory is not None else bytearray(0x10000)
+        self.extra = 0               # The extra cycles taken by the last indexed operand
+        self.depth = 0               # The number of subroutine calls awaiting a return
+        self.stop = None             # Why the simulation stopped, once it has
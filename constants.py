@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 
+import math
+
 ##########################################################################
 # Application-specific constants                                         #
 ##########################################################################
 
-VERSION = "1.3.0"
+VERSION = "1.4.0"
 
 ERRORS = {"0": "No error",
           "1": "Bad mnemonic/opcode",
@@ -16,7 +18,19 @@ ERRORS = {"0": "No error",
           "7": "Bad TFR/EXG operand",
           "8": "Bad PUL/PSH operand",
           "9": "Bad address",
-          "10": "8-bit operand expected"} # ADDED 1.2.0
+          "10": "8-bit operand expected", # ADDED 1.2.0
+          "11": "Value cannot be relocated", # ADDED 1.4.0
+          "12": "EXTERN requires .obj output",
+          "13": "Label conflicts with a predefined symbol",
+          "14": "Cannot read included file",
+          "15": "Bad expression",
+          "16": "ENDR without REPT",
+          "17": "REPT without ENDR",
+          "18": "ENDM without MACRO",
+          "19": "MACRO without ENDM",
+          "20": "Bad macro",
+          "21": "PSTR or POOL after POOL",
+          "22": "PSTR without POOL"}
 
 ADDR_MODE_NONE              = 0 # pylint: disable=C0326;
 ADDR_MODE_IMMEDIATE         = 1 # pylint: disable=C0326;
@@ -38,6 +52,34 @@ PSEUDO_OP_ORG               = 5 # pylint: disable=C0326;
 PSEUDO_OP_SETDP             = 6 # pylint: disable=C0326;
 PSEUDO_OP_FCC               = 7 # pylint: disable=C0326;
 PSEUDO_OP_ZMB               = 8 # pylint: disable=C0326;
+PSEUDO_OP_PUBLIC            = 9 # pylint: disable=C0326;
+PSEUDO_OP_EXTERN            = 10 # pylint: disable=C0326;
+PSEUDO_OP_INCBIN            = 11 # pylint: disable=C0326;
+PSEUDO_OP_TABLE             = 12 # pylint: disable=C0326;
+PSEUDO_OP_REPT              = 13 # pylint: disable=C0326;
+PSEUDO_OP_ENDR              = 14 # pylint: disable=C0326;
+PSEUDO_OP_MACRO             = 15 # pylint: disable=C0326;
+PSEUDO_OP_ENDM              = 16 # pylint: disable=C0326;
+PSEUDO_OP_PSTR              = 17 # pylint: disable=C0326;
+PSEUDO_OP_POOL              = 18 # pylint: disable=C0326;
+
+SYMBOL_KIND_ADDRESS         = "address"
+SYMBOL_KIND_EQU             = "EQU"
+SYMBOL_KIND_EXTERN          = "extern"
+OBJECT_FILE_FORMAT          = "spasm-object"
+OBJECT_FILE_VERSION         = 1
+SYMBOL_FILE_MAGIC           = b"SPSY"
+SYMBOL_FILE_HEADER          = ">4sHI"   # Magic, format version, symbol count
+SYMBOL_FILE_RECORD          = ">HBIIH"  # Value, kind (0 = address, 1 = EQU), line, name offset, name length
+SOURCE_MAP_MAGIC            = b"SPMP"
+SOURCE_MAP_HEADER           = ">4sHHI"  # Magic, format version, file count, range count
+SOURCE_MAP_RECORD           = ">HHHI"   # Start address, byte count, file index, line
+DISASSEMBLY_INDEX_VERSION   = 2         # Bump whenever 'decode_instruction()' changes the length of an instruction
+STDIN_NAME                  = "<stdin>"
+LRU_CACHE_SIZE              = 4096
+PARALLEL_RANGE_LINES        = 4096
+SIM_MAX_CYCLES              = 10000000 # The default cycle budget of a --run simulation
+SIM_MAX_STEPS               = 1 << 62  # More instructions than any run can execute
 
 ##########################################################################
 # The main 6809 instruction set in the form: mnemonic plus               #
@@ -177,4 +219,205 @@ BSA = (
     "BSR", 0x8D, 0x17
 )
 
-POPS = ("EQU", "RMB", "FCB", "FDB", "END", "ORG", "SETDP", "FCC", "ZMB")
+##########################################################################
+# FROM 1.4.0: The 6809's base cycle counts, in the same form as the ISA. #
+# Indexed counts exclude the post-byte's extra cycles (see below), and   #
+# PSH/PUL counts exclude the extra cycle for each byte moved.            #
+##########################################################################
+
+CYCLES = (
+    "ABX", -1, -1, -1, -1, 3,
+    "ADCA", 2, 4, 4, 5, -1,
+    "ADCB", 2, 4, 4, 5, -1,
+    "ADDA", 2, 4, 4, 5, -1,
+    "ADDB", 2, 4, 4, 5, -1,
+    "ADDD", 4, 6, 6, 7, -1,
+    "ANDA", 2, 4, 4, 5, -1,
+    "ANDB", 2, 4, 4, 5, -1,
+    "ANDCC", 3, -1, -1, -1, -1,
+    "ASL", -1, 6, 6, 7, -1,
+    "ASLA", -1, -1, -1, -1, 2,
+    "ASLB", -1, -1, -1, -1, 2,
+    "ASR", -1, 6, 6, 7, -1,
+    "ASRA", -1, -1, -1, -1, 2,
+    "ASRB", -1, -1, -1, -1, 2,
+    "BITA", 2, 4, 4, 5, -1,
+    "BITB", 2, 4, 4, 5, -1,
+    "CLR", -1, 6, 6, 7, -1,
+    "CLRA", -1, -1, -1, -1, 2,
+    "CLRB", -1, -1, -1, -1, 2,
+    "CMPA", 2, 4, 4, 5, -1,
+    "CMPB", 2, 4, 4, 5, -1,
+    "CMPD", 5, 7, 7, 8, -1,
+    "CMPS", 5, 7, 7, 8, -1,
+    "CMPU", 5, 7, 7, 8, -1,
+    "CMPX", 4, 6, 6, 7, -1,
+    "CMPY", 5, 7, 7, 8, -1,
+    "COM", -1, 6, 6, 7, -1,
+    "COMA", -1, -1, -1, -1, 2,
+    "COMB", -1, -1, -1, -1, 2,
+    "CWAIT", 20, -1, -1, -1, -1,
+    "DAA", -1, -1, -1, -1, 2,
+    "DEC", -1, 6, 6, 7, -1,
+    "DECA", -1, -1, -1, -1, 2,
+    "DECB", -1, -1, -1, -1, 2,
+    "EORA", 2, 4, 4, 5, -1,
+    "EORB", 2, 4, 4, 5, -1,
+    "EXG", 8, -1, -1, -1, -1,
+    "INC", -1, 6, 6, 7, -1,
+    "INCA", -1, -1, -1, -1, 2,
+    "INCB", -1, -1, -1, -1, 2,
+    "JMP", -1, 3, 3, 4, -1,
+    "JSR", -1, 7, 7, 8, -1,
+    "LDA", 2, 4, 4, 5, -1,
+    "LDB", 2, 4, 4, 5, -1,
+    "LDD", 3, 5, 5, 6, -1,
+    "LDS", 4, 6, 6, 7, -1,
+    "LDU", 3, 5, 5, 6, -1,
+    "LDX", 3, 5, 5, 6, -1,
+    "LDY", 4, 6, 6, 7, -1,
+    "LEAS", -1, -1, 4, -1, -1,
+    "LEAU", -1, -1, 4, -1, -1,
+    "LEAX", -1, -1, 4, -1, -1,
+    "LEAY", -1, -1, 4, -1, -1,
+    "LSL", -1, 6, 6, 7, -1,
+    "LSLA", -1, -1, -1, -1, 2,
+    "LSLB", -1, -1, -1, -1, 2,
+    "LSR", -1, 6, 6, 7, -1,
+    "LSRA", -1, -1, -1, -1, 2,
+    "LSRB", -1, -1, -1, -1, 2,
+    "MUL", -1, -1, -1, -1, 11,
+    "NEG", -1, 6, 6, 7, -1,
+    "NEGA", -1, -1, -1, -1, 2,
+    "NEGB", -1, -1, -1, -1, 2,
+    "NOP", -1, -1, -1, -1, 2,
+    "ORA", 2, 4, 4, 5, -1,
+    "ORB", 2, 4, 4, 5, -1,
+    "ORCC", 3, -1, -1, -1, -1,
+    "PSHS", 5, -1, -1, -1, -1,
+    "PSHU", 5, -1, -1, -1, -1,
+    "PULS", 5, -1, -1, -1, -1,
+    "PULU", 5, -1, -1, -1, -1,
+    "ROL", -1, 6, 6, 7, -1,
+    "ROLA", -1, -1, -1, -1, 2,
+    "ROLB", -1, -1, -1, -1, 2,
+    "ROR", -1, 6, 6, 7, -1,
+    "RORA", -1, -1, -1, -1, 2,
+    "RORB", -1, -1, -1, -1, 2,
+    "RTI", -1, -1, -1, -1, 6,
+    "RTS", -1, -1, -1, -1, 5,
+    "SBCA", 2, 4, 4, 5, -1,
+    "SBCB", 2, 4, 4, 5, -1,
+    "SEX", -1, -1, -1, -1, 2,
+    "STA", -1, 4, 4, 5, -1,
+    "STB", -1, 4, 4, 5, -1,
+    "STD", -1, 5, 5, 6, -1,
+    "STS", -1, 6, 6, 7, -1,
+    "STU", -1, 5, 5, 6, -1,
+    "STX", -1, 5, 5, 6, -1,
+    "STY", -1, 6, 6, 7, -1,
+    "SUBA", 2, 4, 4, 5, -1,
+    "SUBB", 2, 4, 4, 5, -1,
+    "SUBD", 4, 6, 6, 7, -1,
+    "SYNC", -1, -1, -1, -1, 4,
+    "SWI", -1, -1, -1, -1, 19,
+    "SWI2", -1, -1, -1, -1, 20,
+    "SWI3", -1, -1, -1, -1, 20,
+    "TFR", 6, -1, -1, -1, -1,
+    "TST", -1, 6, 6, 7, -1,
+    "TSTA", -1, -1, -1, -1, 2,
+    "TSTB", -1, -1, -1, -1, 2
+)
+
+##########################################################################
+# FROM 1.4.0: Branch cycle counts, in the same form as the BSA. A long   #
+# conditional branch takes an extra cycle when the branch is taken.      #
+##########################################################################
+
+BRANCH_CYCLES = (
+    "BRA", 3, 5,
+    "BHI", 3, 5,
+    "BLS", 3, 5,
+    "BCC", 3, 5,
+    "BHS", 3, 5,
+    "BLO", 3, 5,
+    "BCS", 3, 5,
+    "BNE", 3, 5,
+    "BEQ", 3, 5,
+    "BVC", 3, 5,
+    "BVS", 3, 5,
+    "BPL", 3, 5,
+    "BMI", 3, 5,
+    "BGE", 3, 5,
+    "BLT", 3, 5,
+    "BGT", 3, 5,
+    "BLE", 3, 5,
+    "BSR", 7, 9
+)
+
+LONG_BRANCH_TAKEN_CYCLES = 1
+
+##########################################################################
+# FROM 1.4.0: The extra cycles taken by each indexed addressing mode,    #
+# keyed by the low nibble of the post-byte (-1 marks an illegal mode).   #
+# A 5-bit offset takes one extra cycle; indirection adds three more.     #
+##########################################################################
+
+INDEXED_CYCLES = (2, 3, 2, 3, 0, 1, 1, -1, 1, 4, -1, 4, 1, 5, -1, 2)
+INDEXED_OFFSET_CYCLES = 1
+INDEXED_INDIRECT_CYCLES = 3
+
+##########################################################################
+# FROM 1.4.0: The simulator's register names: index registers by        #
+# post-byte value, TFR/EXG registers by code, and PSH/PUL registers in   #
+# push order, as (post-byte bit, name, size) -- None marks the 'other'   #
+# stack pointer.                                                         #
+##########################################################################
+
+SIM_INDEX_REGS = ("x", "y", "u", "s")
+SIM_TFR_REGS = ("d", "x", "y", "u", "s", "pc", None, None, "a", "b", "cc", "dp", None, None, None, None)
+SIM_PUSH_ORDER = ((0x80, "pc", 2), (0x40, None, 2), (0x20, "y", 2), (0x10, "x", 2),
+                  (0x08, "dp", 1), (0x04, "b", 1), (0x02, "a", 1), (0x01, "cc", 1))
+
+POPS = ("EQU", "RMB", "FCB", "FDB", "END", "ORG", "SETDP", "FCC", "ZMB", "PUBLIC", "EXTERN", "INCBIN", "TABLE", "REPT", "ENDR", "MACRO", "ENDM",
+        "PSTR", "POOL")
+# FROM 1.4.0: Directives which are taken as labels, as they were before 1.4.0, when followed
+# by an op or, unless they take no operand, when alone on a line
+LABEL_POPS = ("PUBLIC", "EXTERN", "INCBIN", "TABLE", "REPT", "ENDR", "MACRO", "ENDM", "PSTR", "POOL")
+BARE_POPS = ("ENDR", "ENDM", "POOL")
+
+##########################################################################
+# FROM 1.4.0: Lookup tables derived from the above. Each mnemonic maps   #
+# to a single, shared record, so decoding a line copies nothing.         #
+##########################################################################
+
+OP_RECORDS = {ISA[i]: ISA[i:i + 6] for i in range(0, len(ISA), 6)}
+BRANCH_RECORDS = {BSA[i]: BSA[i:i + 3] for i in range(0, len(BSA), 3)}
+PSEUDO_OP_RECORDS = {name: (name,) for name in POPS}
+PSEUDO_OP_TYPES = {name: i + 1 for i, name in enumerate(POPS)}
+MACRO_CALL_TYPE = len(POPS) + 1 # The pseudo-op type of a line which calls a macro
+CYCLE_RECORDS = {CYCLES[i]: CYCLES[i:i + 6] for i in range(0, len(CYCLES), 6)}
+BRANCH_CYCLE_RECORDS = {BRANCH_CYCLES[i]: BRANCH_CYCLES[i:i + 3] for i in range(0, len(BRANCH_CYCLES), 3)}
+NZ_FLAGS = tuple(((value & 0x80) >> 4) | (0 if value else 0x04) for value in range(256))
+RESERVED_WORDS = frozenset(POPS) | frozenset(OP_RECORDS) | frozenset(BRANCH_RECORDS) | \
+                 frozenset("L" + name for name in BRANCH_RECORDS)
+
+##########################################################################
+# FROM 1.4.0: The index variable, functions and constants which may be   #
+# used in TABLE expressions, alongside numbers and symbols.              #
+##########################################################################
+
+TABLE_INDEX_NAME = "I"
+EXPRESSION_POPS = ("TABLE", "REPT")  # Pseudo-ops whose operands may contain spaces and '*'
+EXPRESSION_POWER = "__power__"      # Functions which calculate '**' and '<<'...
+EXPRESSION_SHIFT = "__shift__"
+EXPRESSION_MAX_OPERAND = 1 << 64    # ...provided the left operand is no bigger than this...
+EXPRESSION_MAX_COUNT = 64           # ...and the right operand no bigger than this
+REPT_COUNTER = "\\#"
+MACRO_UNIQUE = "\\@"
+MACRO_MAX_ARGS = 9
+MACRO_MAX_DEPTH = 32
+TABLE_FUNCTIONS = {"sin": math.sin, "cos": math.cos, "tan": math.tan, "atan": math.atan,
+                   "sqrt": math.sqrt, "exp": math.exp, "log": math.log, "log2": math.log2,
+                   "floor": math.floor, "ceil": math.ceil, "round": round, "int": int,
+                   "abs": abs, "min": min, "max": max, "pi": math.pi, "e": math.e}
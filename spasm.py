@@ -4,7 +4,7 @@
 'SPASM' -- Smittytone's Primary 6809 ASeMmbler
 
 Version:
-    1.3.0
+    1.4.0
 
 Copyright:
     2021, Tony Smith (@smittytone)
@@ -18,8 +18,24 @@ License:
 ##########################################################################
 
 import os
+import re
+import ast
+import math
+import io
 import sys
 import json
+import array
+import bisect
+import struct
+import mmap
+import hashlib
+import stat
+import tempfile
+import functools
+import threading
+import socketserver
+import contextlib
+import concurrent.futures
 from constants import *
 from classes import *
 
@@ -33,47 +49,67 @@ from classes import *
     labels and pseudo-ops, etc.
 
     Args:
-        file_path (str): The path to a .asm file.
+        file_path (str): The path to a .asm file, or '-' for standard input.
 '''
 def assemble_file(file_path):
-    # Initialize the storage arrays
-    app_state.labels = []
-    app_state.code = []
     lines = []
-    # Check that the passed file is available to process
-    if not os.path.exists(file_path):
-        print("[ERROR] File " + file_path + " does not exist, skipping")
-        return
-
-    with open(file_path, "r") as file: lines = list(file)
-    show_verbose("Processing file: " + os.path.abspath(file_path))
-
-    # FROM 1.2.0: Create an initial code chunk and add it to the array
-    chunk = {}
-    chunk["address"] = app_state.start_address
-    chunk["code"] = bytearray()
-    app_state.code.append(chunk)
+    if file_path == "-":
+        # FROM 1.4.0: Read standard input as pass 1 consumes it, keeping the lines for pass 2
+        source_path = STDIN_NAME
+        kept_lines = tempfile.TemporaryFile("w+") if app_state.low_memory is True else []
+        lines = functools.partial(get_stream_lines, sys.stdin, kept_lines)
+        show_verbose("Processing standard input")
+    else:
+        # Check that the passed file is available to process
+        if not os.path.exists(file_path):
+            print("[ERROR] File " + file_path + " does not exist, skipping")
+            return
+
+        source_path = os.path.abspath(file_path)
+        if app_state.low_memory is True:
+            # FROM 1.4.0: Read the file afresh on each pass rather than hold it in memory
+            lines = functools.partial(get_file_lines, file_path)
+        else:
+            with open(file_path, "r") as file: lines = list(file)
+        show_verbose("Processing file: " + source_path)
+
+    # FROM 1.4.0: Build each variant, if any, from a single tokenisation of the source
+    line_tokens = None
+    if app_state.variants and app_state.low_memory is False:
+        line_tokens = [tokenise_line(line) for line in (lines(1) if callable(lines) else lines)]
+
+    base_address = app_state.start_address
+    base_symbols = app_state.predefined_symbols
+    for variant in app_state.variants if app_state.variants else [None]:
+        if variant is not None:
+            show_verbose("Building variant: " + variant["name"])
+            app_state.variant = variant["name"]
+            app_state.start_address = variant.get("start", base_address)
+            app_state.predefined_symbols = base_symbols + variant["symbols"]
+
+        if assemble_lines(lines, source_path, line_tokens) != -1:
+            if app_state.json_stream is not None: emit_json({"type": "result", "file": get_source_file(), "ok": False})
+        else:
+            write_output(file_path)
 
-    for asm_pass in range(1, 3):
-        # Start a pass
-        app_state.pass_count = asm_pass
-        show_verbose("Assembly pass #" + str(asm_pass))
+    app_state.variant = None
+    app_state.start_address = base_address
+    app_state.predefined_symbols = base_symbols
 
-        # Set the current code chunk - we will load further chunks, if any,
-        # as ORG directives are encountered in the code
-        app_state.chunk = app_state.code[0]
-        app_state.prog_count = app_state.chunk["address"]
 
-        # Parse the lines one at a time
-        for i in range(0, len(lines)):
-            current_line = lines[i]
+'''
+Output the assembled code: emit or display it, and write it to the output files,
+if any were requested. For a variant build, the variant's name is added to the
+output files' names.
 
-            # Parse the current line
-            if parse_line(current_line, i) is False:
-                # Error in processing: print post
-                print("Processing error in line " + str(i + 1) + " -- halting assembly")
-                print(">>> " + current_line)
-                return
+Args:
+    file_path (str): The path to the source .asm file, or '-' for standard input.
+'''
+def write_output(file_path):
+    # FROM 1.4.0: Emit the machine code as JSON records, if required
+    if app_state.json_stream is not None:
+        for chunk in app_state.code:
+            emit_json({"type": "chunk", "file": get_source_file(), "address": chunk["address"], "code": chunk["code"].hex().upper()})
 
     # Post-assembly, dump the machine code, provided there was no error
     if app_state.verbose is True:
@@ -95,101 +131,600 @@ def assemble_file(file_path):
             print(" ")
 
     # Write out the machine code file
-    if app_state.out_file is not None:
-        if app_state.out_file == "*":
-            app_state.out_file, _ = os.path.splitext(file_path)
-            app_state.out_file += ".rom"
-        write_file(app_state.out_file)
-
-    # Temp section for testing
-    items = 0
-    display_str = ""
-    for chunk in app_state.code:
-        code_bytes = chunk["code"]
-        line_address = chunk["address"]
-        # Add the initial address
-        for i in range(0, len(code_bytes), 8):
-            for j in range(0, 8):
-                if i + j < len(code_bytes):
-                    display_str += "0x{0:02X},".format(code_bytes[i + j])
-                    items += 1
-        print(items, display_str)
+    out_file = app_state.out_file
+    if out_file == "-" or (out_file == "*" and file_path == "-" and app_state.variant is None):
+        # FROM 1.4.0: Write the machine code to standard output
+        write_file("-")
+        if app_state.xref is not None: print("\n".join(get_xref_report()))
+    elif out_file is not None:
+        if out_file == "*":
+            out_file = os.path.splitext(file_path if file_path != "-" else "stdin")[0] + ".rom"
+        out_file_root, out_file_ext = os.path.splitext(out_file)
+        if app_state.variant is not None: out_file_root += "-" + app_state.variant
+        if out_file_ext in (".asm", ".asm6809"):
+            print("[ERROR] Assembled code can only be written to a .6809, .rom or .obj file")
+        elif out_file_ext == ".obj":
+            # FROM 1.4.0: Write a relocatable object file
+            write_object_file(out_file_root + out_file_ext)
+            if app_state.xref is not None: write_xref_files(out_file_root)
+        else:
+            write_file(out_file_root + out_file_ext)
+            write_symbol_files(out_file_root)
+            write_source_map_file(out_file_root + ".map")
+            if app_state.xref is not None: write_xref_files(out_file_root)
+    elif app_state.xref is not None:
+        print("\n".join(get_xref_report()))
+
+    # FROM 1.4.0: Analyse the program's routines and run the program on the simulator, if required
+    if app_state.analyse is True: analyse_assembled_code()
+    if app_state.run_entry is not None: run_assembled_code()
+
+    if app_state.json_stream is not None:
+        emit_json({"type": "result", "file": get_source_file(), "ok": True})
+        app_state.json_stream.flush()
 
 
 '''
-Process a single line of assembly, on a per-pass basis.
+Assemble a program, supplied as a sequence of source lines, using a two-pass process.
+
+Args:
+    lines       (list): The lines of source code, or a function which takes the pass number
+                        and returns the lines to assemble in that pass.
+    source_path (str):  The path of the file the lines came from, if any.
+    line_tokens (list): The lines' tokens, if the lines have already been tokenised.
+
+Returns:
+    int: -1 if the program assembled, otherwise the index of the line which halted assembly.
+'''
+def assemble_lines(lines, source_path="", line_tokens=None):
+    # Initialize the storage arrays
+    app_state.labels = []
+    app_state.code = []
+    app_state.line_addresses = array.array("I")
+    app_state.op_addresses = array.array("I")
+    if line_tokens is None: line_tokens = []
+    range_starts = []
+    has_blocks = False
+    app_state.macro_expansions = {}
+    app_state.source_files = [source_path]
+    app_state.source_map = array.array("I")
+    if app_state.xref is not None: app_state.xref = {}
+    if app_state.object_mode is True:
+        app_state.relocations = []
+        app_state.public_symbols = []
+
+    # FROM 1.4.0: Add any predefined symbols, as constants
+    for name, value in app_state.predefined_symbols:
+        app_state.labels.append({"name": name, "addr": value, "kind": SYMBOL_KIND_EQU, "line": 0})
+
+    # FROM 1.2.0: Create an initial code chunk and add it to the array
+    chunk = {}
+    chunk["address"] = app_state.start_address
+    chunk["code"] = bytearray()
+    app_state.code.append(chunk)
+
+    # FROM 1.4.0: An object file's code is assembled at 0 and placed by the linker
+    if app_state.object_mode is True:
+        chunk["address"] = 0
+        chunk["relocatable"] = True
+
+    for asm_pass in range(1, 3):
+        # Start a pass
+        app_state.pass_count = asm_pass
+        show_verbose("Assembly pass #" + str(asm_pass))
+
+        # Set the current code chunk - we will load further chunks, if any,
+        # as ORG directives are encountered in the code
+        app_state.chunk = app_state.code[0]
+        app_state.prog_count = app_state.chunk["address"]
+
+        # FROM 1.4.0: Encode the lines in parallel on pass 2, if requested and worthwhile.
+        # An initial ORG may have moved the first chunk, so the first range starts afresh
+        if asm_pass == 2 and len(range_starts) > 1 and has_blocks is False:
+            range_starts[0] = (app_state.prog_count, 0)
+            if assemble_in_parallel(line_tokens, range_starts) is True: break
+
+        # Parse the lines one at a time
+        pass_lines = lines(asm_pass) if callable(lines) else lines
+        if asm_pass == 1: app_state.string_pool = {"strings": [], "address": None, "data": b""}
+        block = None
+        app_state.macros = {}
+        app_state.macro_count = 0
+        for i, current_line in enumerate(pass_lines):
+            # FROM 1.4.0: Tokenise the line on pass 1 and, memory permitting, keep the tokens for pass 2
+            if i < len(line_tokens):
+                tokens = line_tokens[i]
+            else:
+                tokens = tokenise_line(current_line)
+                if app_state.low_memory is False: line_tokens.append(tokens)
+
+            # FROM 1.4.0: Note where each range of lines starts, for parallel encoding on pass 2
+            if asm_pass == 1 and app_state.parallel is True and app_state.low_memory is False \
+                and i % PARALLEL_RANGE_LINES == 0:
+                range_starts.append((app_state.prog_count, app_state.code.index(app_state.chunk)))
+
+            # Parse the current line or, FROM 1.4.0, add it to a REPT or MACRO block
+            error_line, block = assemble_or_gather(tokens, i, block)
+            if block is not None: has_blocks = True
+            if error_line != -1:
+                # Error in processing: print post
+                print("Processing error in line " + str(error_line + 1) + " -- halting assembly")
+                if error_line == i: print(">>> " + current_line)
+                return error_line
+
+        if block is not None:
+            # FROM 1.4.0: The source ended within a REPT or MACRO block
+            error_line = block["lines"][0][1]
+            error_message(17 if block["kind"] == "REPT" else 19, error_line) # Unclosed block
+            print("Processing error in line " + str(error_line + 1) + " -- halting assembly")
+            return error_line
+
+        if asm_pass == 1 and app_state.string_pool["strings"] and app_state.string_pool["address"] is None:
+            # FROM 1.4.0: There are pooled strings, but no POOL to place them
+            error_line = app_state.string_pool["strings"][0][2]
+            error_message(22, error_line) # PSTR without POOL
+            print("Processing error in line " + str(error_line + 1) + " -- halting assembly")
+            return error_line
+
+    if app_state.low_memory is False: app_state.line_addresses.append(app_state.prog_count)
+    return -1
+
+
+'''
+Assemble a single, tokenised line or, if the line starts or is part of a REPT or MACRO
+block, gather it into the block. When a REPT block's ENDR is reached, the block is
+assembled the required number of times (see 'assemble_repeat()'); when a MACRO block's
+ENDM is reached, the macro is recorded (see 'define_macro()'). A line which calls a
+macro is replaced by the macro's lines (see 'expand_macro()').
+
+Args:
+    tokens      (tuple): The line's label, op, operand and comment (see 'tokenise_line()').
+    line_number (int):   The current line (starts at 0).
+    block       (dict):  The block being gathered, if any: its kind, its lines' tokens and
+                         numbers, and the depth of REPT blocks nested within it.
+
+Returns:
+    tuple: -1 if the line assembled, otherwise the index of the line which failed; and the
+           block being gathered, if any.
+'''
+def assemble_or_gather(tokens, line_number, block):
+    op_name = tokens[1].upper()
+    if block is not None:
+        block["lines"].append((tokens, line_number))
+        if op_name == block["kind"]: block["depth"] += 1
+        if op_name == ("ENDR" if block["kind"] == "REPT" else "ENDM"): block["depth"] -= 1
+        if block["depth"] > 0: return -1, block
+        if block["kind"] == "REPT": return assemble_repeat(block["lines"]), None
+        return define_macro(block["lines"]), None
+    if op_name in ("REPT", "MACRO"): return -1, {"kind": op_name, "lines": [(tokens, line_number)], "depth": 1}
+    if op_name in ("ENDR", "ENDM"):
+        error_message(16 if op_name == "ENDR" else 18, line_number) # Unopened block
+        return line_number, None
+    if app_state.macros:
+        call = get_macro_call(tokens)
+        if call is not None: return expand_macro(call, tokens, line_number), None
+    return (-1 if assemble_line(tokens, line_number) is not False else line_number), None
+
+
+'''
+Assemble a REPT block, from its already tokenised lines, the number of times set by
+the REPT op's operand. In the block's lines, '\\#' is replaced by the number of the
+repetition, counting from 0, and any expression in braces is replaced by its value,
+eg. 'STD {\\#*2},X'. Blocks nested within the block are repeated in turn.
+
+Args:
+    lines (list): The block's lines, from REPT to ENDR, as (tokens, line number) tuples.
+
+Returns:
+    int: -1 if the block assembled, otherwise the index of the line which failed.
+'''
+def assemble_repeat(lines):
+    rept_tokens, rept_line = lines[0]
+    if assemble_line(rept_tokens, rept_line) is False: return rept_line
+    count_line = LineData()
+    count_line.line_number = rept_line
+    count = evaluate_expression(rept_tokens[2], count_line) if rept_tokens[2] else -1
+    if count is None: return rept_line
+    if count < 0:
+        error_message(5, rept_line) # Bad operand
+        return rept_line
+
+    for counter in range(count):
+        block = None
+        for tokens, line_number in lines[1:-1]:
+            if block is None:
+                # Only substitute in lines at this level: nested blocks have their own counter
+                tokens = substitute_counter(tokens, counter, line_number)
+                if tokens is None: return line_number
+            error_line, block = assemble_or_gather(tokens, line_number, block)
+            if error_line != -1: return error_line
+
+    end_tokens, end_line = lines[-1]
+    return -1 if assemble_line(end_tokens, end_line) is not False else end_line
+
+
+'''
+Record a macro from its MACRO block. The macro's name is the MACRO op's label.
+Its lines are kept as tokens, to be assembled wherever the macro is called.
+
+Args:
+    lines (list): The block's lines, from MACRO to ENDM, as (tokens, line number) tuples.
+
+Returns:
+    int: -1 if the macro was recorded, otherwise the index of the line which failed.
+'''
+def define_macro(lines):
+    macro_tokens, macro_line = lines[0]
+    name = macro_tokens[0].upper()
+    if not name or not check_reserved(name) or name in app_state.macros:
+        error_message(20, macro_line) # Bad macro
+        return macro_line
+    for tokens, line_number in lines[1:-1]:
+        if tokens[1].upper() == "MACRO":
+            # Macros can't be defined within macros
+            error_message(20, line_number) # Bad macro
+            return line_number
+    app_state.macros[name] = lines[1:-1]
+    if app_state.pass_count == 1:
+        show_verbose("Macro " + name + " defined (line " + str(macro_line + 1) + ")")
+
+    # List the MACRO and ENDM lines, with the macro's name as the MACRO op's operand
+    if assemble_line(("", macro_tokens[1], macro_tokens[0], macro_tokens[3]), macro_line) is False: return macro_line
+    end_tokens, end_line = lines[-1]
+    return -1 if assemble_line(end_tokens, end_line) is not False else end_line
+
+
+'''
+Check whether a line calls a macro, either as its op, after a label, or as the
+first item on the line, when it will have been tokenised as a label.
+
+Args:
+    tokens (tuple): The line's label, op, operand and comment (see 'tokenise_line()').
 
-Each line is segmented by space characters, and we remove extra spaces from all
-line parts other than comments. You cannot have a space set using the Ascii indicator, '
+Returns:
+    tuple: The call's label, the macro's name and the call's arguments, or None if
+           the line does not call a macro.
+'''
+def get_macro_call(tokens):
+    label, op_name, operand, _ = tokens
+    if op_name.upper() in app_state.macros: return (label, op_name.upper(), operand)
+    if label.upper() in app_state.macros and not operand and (not op_name or check_reserved(op_name)):
+        return ("", label.upper(), op_name)
+    return None
+
+
+'''
+Assemble a call to a macro. The macro's lines have the call's arguments put in
+place of the parameters '\\1' to '\\9', and each expansion is cached, so later
+calls with the same arguments re-use it. In every call, '\\@' is replaced by a
+suffix unique to the call, to give the call its own labels.
+
+Args:
+    call        (tuple): The call's label, the macro's name and the call's arguments.
+    tokens      (tuple): The calling line's tokens (see 'tokenise_line()').
+    line_number (int):   The calling line (starts at 0).
+
+Returns:
+    int: -1 if the macro assembled, otherwise the index of the line which failed.
+'''
+def expand_macro(call, tokens, line_number):
+    label, name, args = call
+    arg_list = args.split(",") if args else []
+    if len(arg_list) > MACRO_MAX_ARGS or app_state.macro_depth >= MACRO_MAX_DEPTH:
+        error_message(20, line_number) # Bad macro
+        return line_number
+
+    expansion = app_state.macro_expansions.get((name, args))
+    if expansion is None:
+        expansion = []
+        for body_tokens, body_line in app_state.macros[name]:
+            body_tokens = tuple(substitute_args(field, arg_list) for field in body_tokens[:3]) + body_tokens[3:]
+            expansion.append((body_tokens, body_line, MACRO_UNIQUE in body_tokens[0] or MACRO_UNIQUE in body_tokens[2]))
+        app_state.macro_expansions[(name, args)] = expansion
+
+    # Set the call's label, if any, and list the call
+    if assemble_line((label, name, args, tokens[3]), line_number) is False: return line_number
+
+    app_state.macro_count += 1
+    unique = "_" + str(app_state.macro_count).zfill(4)
+    app_state.macro_depth += 1
+    block = None
+    error_line = -1
+    for body_tokens, body_line, has_unique in expansion:
+        if has_unique is True:
+            body_tokens = (body_tokens[0].replace(MACRO_UNIQUE, unique), body_tokens[1],
+                           body_tokens[2].replace(MACRO_UNIQUE, unique), body_tokens[3])
+        error_line, block = assemble_or_gather(body_tokens, body_line, block)
+        if error_line != -1: break
+    app_state.macro_depth -= 1
+    if error_line == -1 and block is not None:
+        # The macro ended within a REPT block
+        error_line = block["lines"][0][1]
+        error_message(17, error_line) # REPT without ENDR
+    return error_line
+
+
+'''
+Put a macro call's arguments in place of the parameters '\\1' to '\\9' in a field
+of a macro's line. Parameters with no argument are removed.
+
+Args:
+    field    (str):  The field.
+    arg_list (list): The call's arguments.
+
+Returns:
+    str: The field with the arguments in place.
+'''
+def substitute_args(field, arg_list):
+    if "\\" not in field: return field
+    return re.sub(r"\\([1-9])", lambda match: arg_list[int(match.group(1)) - 1] if int(match.group(1)) <= len(arg_list) else "", field)
+
+
+'''
+Replace the repetition counter in a line of a REPT block, then evaluate any
+expressions in braces in the line's operand.
+
+Args:
+    tokens      (tuple): The line's label, op, operand and comment (see 'tokenise_line()').
+    counter     (int):   The number of the repetition.
+    line_number (int):   The current line (starts at 0).
+
+Returns:
+    tuple: The line's tokens, or None if an expression could not be evaluated.
+'''
+def substitute_counter(tokens, counter, line_number):
+    label, op_name, operand, comment = tokens
+    if REPT_COUNTER not in label and REPT_COUNTER not in operand and "{" not in operand: return tokens
+    label = label.replace(REPT_COUNTER, str(counter))
+    operand = operand.replace(REPT_COUNTER, str(counter))
+    while "{" in operand:
+        start = operand.index("{")
+        end = operand.find("}", start)
+        if end == -1:
+            error_message(15, line_number) # Bad expression
+            return None
+        line = LineData()
+        line.line_number = line_number
+        value = evaluate_expression(operand[start + 1:end], line)
+        if value is None: return None
+        operand = operand[:start] + str(value) + operand[end + 1:]
+    return (label, op_name, operand, comment)
+
+
+'''
+Assemble a single, tokenised line on the current pass, mapping any bytes it
+generates back to the source on pass 2.
 
 Args:
-    line        (list): A line of program as a raw string.
-    line_number (int):  The current line (starts at 0).
+    tokens      (tuple): The line's label, op, operand and comment (see 'tokenise_line()').
+    line_number (int):   The current line (starts at 0).
 
 Returns:
     bool: False if an error occurred, or True.
 '''
-def parse_line(line, line_number):
-    # Split the line at the line terminator to remove the carriage return
-    line = line.splitlines()[0]
-
-    # Check for comment lines
-    line, comment = find_comments(line, ";", " ")
-    line, comment = find_comments(line, "*", comment)
-    comment_start = 1 if comment != " " else -1
-
-    # FROM 1.2.0: Check for quoted strings (only double-quotes for now)
-    quote = ""
-    quote_start = line.find('"')
-    if quote_start != -1:
-        line_parts = line.split('"', 1)
-        quote = line_parts[len(line_parts) - 1]
-        line = line_parts[0]
-        line_parts = quote.split('"', 1)
-        quote = '"' + line_parts[0] + '"'
-
-    # Segment the remaining line by spaces
-    line_parts = line.split(" ")
-
-    # Remove empty entries (ie. instances of multiple spaces)
-    j = 0
-    while True:
-        if j == len(line_parts): break
-        if not line_parts[j]:
-            line_parts.pop(j)
-        else:
-            j += 1
+def assemble_line(tokens, line_number):
+    # FROM 1.4.0: Record the address at which each line's code starts, unless memory is short:
+    # only source verification and parallel encoding need these, and neither runs with --lowmem
+    if app_state.pass_count == 2 and app_state.low_memory is False:
+        app_state.line_addresses.append(app_state.prog_count)
+
+    line_start = app_state.prog_count
+    line_chunk = app_state.chunk
+    try:
+        result = parse_line(tokens, line_number)
+    except (ValueError, IndexError):
+        # Malformed operands can trip the decoders
+        error_message(5, line_number) # Bad operand
+        result = False
+
+    # FROM 1.4.0: Map the line's bytes, if any, back to the source
+    if result is not False and app_state.pass_count == 2 and app_state.chunk is line_chunk \
+        and app_state.prog_count > line_start:
+        app_state.source_map.extend((line_start, app_state.prog_count - line_start, 0, line_number + 1))
+    return result
+
+
+'''
+Run pass 2 across a pool of worker processes, each encoding a range of lines against
+the symbols and chunk layout fixed by pass 1, then merge the results in line order.
+
+The workers' listings, diagnostics and records are held back until every range has
+been encoded. If any range fails, or does not end where pass 1 said the next range
+would start, the results are discarded and the caller re-runs pass 2 serially, so
+the output is the same as it would be without workers.
+
+Args:
+    line_tokens  (list): The tokens of every line (see 'tokenise_line()').
+    range_starts (list): The program counter and chunk index at the start of each range.
+
+Returns:
+    bool: True if pass 2 was completed, otherwise False.
+'''
+def assemble_in_parallel(line_tokens, range_starts):
+    jobs = []
+    for index, (address, chunk_index) in enumerate(range_starts):
+        first_line = index * PARALLEL_RANGE_LINES
+        jobs.append((line_tokens[first_line:first_line + PARALLEL_RANGE_LINES], first_line, address, chunk_index))
+
+    worker_state = {"labels": app_state.labels, "code": app_state.code, "verbose": app_state.verbose,
+                    "show_upper": app_state.show_upper, "source_files": app_state.source_files,
+                    "xref": app_state.xref is not None, "json": app_state.json_stream is not None,
+                    "string_pool": app_state.string_pool}
+    workers = app_state.workers if app_state.workers > 0 else (os.cpu_count() or 1)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_range_worker,
+                                                initargs=(worker_state,)) as pool:
+        results = list(pool.map(assemble_line_range, jobs))
+
+    # Check that every range succeeded and that each one ends where the next begins
+    for index, result in enumerate(results):
+        next_start = range_starts[index + 1] if index + 1 < len(range_starts) else result["end"]
+        if result["ok"] is False or result["end"] != next_start:
+            show_verbose("Parallel encoding not possible -- continuing in series")
+            return False
+
+    # Merge the ranges, in order
+    for result in results:
+        print(result["output"], end="")
+        if app_state.json_stream is not None: app_state.json_stream.write(result["json"])
+        for chunk_index, address, code in result["spans"]:
+            chunk = app_state.code[chunk_index]
+            offset = address - chunk["address"]
+            chunk["code"][offset:offset + len(code)] = code
+        app_state.line_addresses.extend(result["line_addresses"])
+        app_state.op_addresses.extend(result["op_addresses"])
+        app_state.source_map.extend(result["source_map"])
+        if app_state.xref is not None:
+            for name, references in result["xref"].items():
+                app_state.xref.setdefault(name, []).extend(references)
+
+    app_state.chunk = app_state.code[results[-1]["end"][1]]
+    app_state.prog_count = results[-1]["end"][0]
+    return True
+
+
+'''
+Prepare a worker process to encode ranges of lines: give it a copy of the state
+fixed by pass 1.
+
+Args:
+    worker_state (dict): The symbols, code chunks and output settings.
+'''
+def init_range_worker(worker_state):
+    global app_state
+    app_state = AppState()
+    app_state.pass_count = 2
+    app_state.labels = worker_state["labels"]
+    app_state.code = worker_state["code"]
+    app_state.verbose = worker_state["verbose"]
+    app_state.show_upper = worker_state["show_upper"]
+    app_state.source_files = worker_state["source_files"]
+    app_state.string_pool = worker_state["string_pool"]
+    if worker_state["xref"] is True: app_state.xref = {}
+    if worker_state["json"] is True: app_state.json_stream = io.StringIO()
+
+
+'''
+Encode a range of lines in a worker process (see 'assemble_in_parallel()').
+
+Args:
+    job (tuple): The range's tokens, the number of its first line, and the program
+                 counter and chunk index at its start.
+
+Returns:
+    dict: The outcome: the range's code, address records, listing and other output,
+          and the program counter and chunk index at its end.
+'''
+def assemble_line_range(job):
+    line_tokens, first_line, address, chunk_index = job
+    app_state.chunk = app_state.code[chunk_index]
+    app_state.prog_count = address
+    app_state.line_addresses = array.array("I")
+    app_state.op_addresses = array.array("I")
+    app_state.source_map = array.array("I")
+    if app_state.xref is not None: app_state.xref = {}
+    if app_state.json_stream is not None: app_state.json_stream = io.StringIO()
+
+    result = {"ok": True}
+    chunk_indices = {id(chunk): index for index, chunk in enumerate(app_state.code)}
+    spans = []
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for i, tokens in enumerate(line_tokens):
+            line_start = app_state.prog_count
+            line_chunk = app_state.chunk
+            if assemble_line(tokens, first_line + i) is False:
+                result["ok"] = False
+                break
+
+            # Keep the bytes of the line's code, as written into this worker's copy of the chunk
+            if app_state.chunk is line_chunk and app_state.prog_count > line_start:
+                offset = line_start - line_chunk["address"]
+                spans.append((chunk_indices[id(line_chunk)], line_start,
+                              bytes(line_chunk["code"][offset:offset + app_state.prog_count - line_start])))
+
+    result["spans"] = spans
+    result["end"] = (app_state.prog_count, chunk_indices[id(app_state.chunk)])
+    result["output"] = output.getvalue()
+    result["json"] = app_state.json_stream.getvalue() if app_state.json_stream is not None else ""
+    result["line_addresses"] = app_state.line_addresses
+    result["op_addresses"] = app_state.op_addresses
+    result["source_map"] = app_state.source_map
+    result["xref"] = app_state.xref
+    return result
+
+
+'''
+Provide the lines of a stream for one assembly pass. The stream can only be read once,
+so pass 1 reads it line by line, keeping each line for pass 2.
+
+Args:
+    stream     (file):      The source stream, eg. standard input.
+    kept_lines (list|file): The lines read from the stream so far. In low-memory
+                            mode, this is a temporary file.
+    asm_pass   (int):       The assembly pass.
+
+Returns:
+    iterator: The source lines.
+'''
+def get_stream_lines(stream, kept_lines, asm_pass):
+    # Replay the kept lines on pass 2, or if the stream was read by an earlier assembly
+    if isinstance(kept_lines, list):
+        if asm_pass != 1 or kept_lines: return iter(kept_lines)
+    elif asm_pass != 1 or kept_lines.seek(0, os.SEEK_END) > 0:
+        kept_lines.seek(0)
+        return kept_lines
+    keep_line = kept_lines.append if isinstance(kept_lines, list) else kept_lines.write
+    def read_lines():
+        for line in stream:
+            keep_line(line)
+            yield line
+    return read_lines()
+
+
+'''
+Provide the lines of a source file for one assembly pass, reading them from the
+file one at a time.
+
+Args:
+    file_path (str): The path to a .asm file.
+    asm_pass  (int): The assembly pass.
+
+Returns:
+    iterator: The source lines.
+'''
+def get_file_lines(file_path, asm_pass):
+    with open(file_path, "r") as file:
+        yield from file
 
-    # Add back the quote, if any
-    if quote: line_parts.append(quote)
 
-    # At this point, typical line might be:
-    #   lineParts[0] = "@start_address"
-    #   lineParts[1] = "EQU"
-    #   lineParts[2] = "$FFFF"
-    #   lineParts[3] = ";This is a comment"
-    # Empty lines will be present in the list as empty strings
+'''
+Process a single line of assembly, on a per-pass basis.
+
+Args:
+    tokens      (tuple): The line's label, op, operand and comment (see 'tokenise_line()').
+    line_number (int):   The current line (starts at 0).
 
+Returns:
+    bool: False if an error occurred, or True.
+'''
+def parse_line(tokens, line_number):
     # Begin line decoding: create a line data object
     line_data = LineData()
     line_data.line_number = line_number
+    line_parts = tokens
+    label, op, _, comment = tokens
 
-    if not line_parts:
-        # This is a comment-only line, or empty line,
-        # so assemble a basic empty list
-        if comment_start != -1 and app_state.pass_count == 2:
+    if not label and not op:
+        # This is a comment-only line, or empty line
+        if comment and app_state.pass_count == 2:
             # We have a comment, so just dump it out on pass 2
-            line_data.comment_start = comment_start
-            write_code([comment, " ", " ", " "], line_data)
+            line_data.comment_start = 1
+            write_code((comment, "", "", ""), line_data)
             # And return to go and process the next line
             return True
-        line_parts = [" ", " "]
 
-    # Process the line's components
     # Check for an initial label
-    label = line_parts[0]
-    #if label[0] == "@":
-    if label != " " and check_reserved(label):
+    if label:
         # Found a label - store it if we need to
         got_label = index_of_label(label)
         if got_label != -1:
@@ -197,31 +732,27 @@ def parse_line(line, line_number):
             label = app_state.labels[got_label]
             if app_state.pass_count == 1:
                 if label["addr"] != "!!!!":
-                    error_message(2, line_number) # Duplicate label
+                    # FROM 1.4.0: Distinguish a clash with a symbol loaded from a file or variant
+                    error_message(13 if label["line"] == 0 else 2, line_number) # Duplicate label
                     return False
                 # Set the label address
                 label["addr"] = app_state.prog_count
+                label["line"] = line_number + 1
+                set_label_section(label)
                 # Output the label valuation
                 show_verbose("Label " + label["name"] + " set to 0x" +
                              to_hex(app_state.prog_count, 4) + " (line " + str(line_number + 1) + ")")
         else:
             # Record the newly found label
-            app_state.labels.append({"name": label, "addr": app_state.prog_count})
+            app_state.labels.append({"name": label, "addr": app_state.prog_count,
+                                     "kind": SYMBOL_KIND_ADDRESS, "line": line_number + 1})
+            set_label_section(app_state.labels[-1])
             if app_state.pass_count == 1:
                 show_verbose("Label " + label + " found and set to 0x" + to_hex(app_state.prog_count, 4) +
                              " (line " + str(line_number + 1) + ")")
-    else:
-        # Not a label, so insert a blank - ie. ensure the op will be in lineParts[1]
-        line_parts.insert(0, " ")
-
-    # If there is no third field, add an empty one
-    if len(line_parts) == 2: line_parts.append(" ")
-
-    # Put the comment string, if there is one, into the comment field, lineParts[3]
-    line_parts.append(comment if comment else " ")
 
     # Check the opcode
-    if line_parts[1] != " ":
+    if line_parts[1]:
         result = decode_op(line_parts[1], line_data)
         if result is False: return False
 
@@ -238,13 +769,89 @@ def parse_line(line, line_number):
     return result
 
 
-def find_comments(line, comment_symbol, comment):
-    l = line.find(comment_symbol)
-    if l != -1:
-        # Found a comment line so re-position it
-        comment = comment_symbol + line[l + 1:]
-        line = line[:l]
-    return (line, comment)
+'''
+Split a line of source into its label, op, operand and comment in a single scan.
+
+Fields are separated by spaces or tabs. A field which is not a reserved word is
+only a label if it is the first on the line. A comment starts with a ';' anywhere
+outside a string, or with a '*' at the start of a field, and any text after the
+operand is also taken as a comment. Spaces, ';' and '*' within double-quoted
+strings, or straight after the Ascii literal prefix ', are part of the field.
+FROM 1.4.0, the operand of an op which takes an expression, such as TABLE, runs
+to the next ';' or the end of the line, so it may contain spaces and '*'.
+A directive added in 1.4.0 may still be a label (see 'is_label_pop()').
+
+Args:
+    line (str): A line of program as a raw string.
+
+Returns:
+    tuple: The label, op, operand and comment, each an empty string if not present.
+'''
+def tokenise_line(line):
+    fields = []
+    comment = ""
+    max_fields = 3
+    is_expression = False
+    i = 0
+    length = len(line)
+    while i < length:
+        char = line[i]
+        if char in " \t\r\n":
+            i += 1
+            continue
+        if char in ";*" or len(fields) == max_fields:
+            # The rest of the line is a comment
+            comment = line[i:].rstrip("\r\n")
+            break
+
+        if is_expression:
+            # The operand is an expression: take it all, up to any comment
+            end = line.find(";", i)
+            if end == -1: end = length
+            fields.append(line[i:end].rstrip(" \t\r\n"))
+            i = end
+            continue
+
+        # Scan the field, stepping over quoted strings and Ascii literals
+        start = i
+        while i < length:
+            char = line[i]
+            if char in " \t\r\n;": break
+            if char == '"':
+                end = line.find('"', i + 1)
+                i = length if end == -1 else end + 1
+                continue
+            i += 2 if char == "'" else 1
+        fields.append(line[start:i])
+
+        # An initial reserved word is an op, so there is no label
+        if len(fields) == 1 and not check_reserved(fields[0]) and not is_label_pop(fields[0], line, i): max_fields = 2
+        if len(fields) == max_fields - 1: is_expression = fields[-1].upper() in EXPRESSION_POPS
+
+    if max_fields == 2: fields.insert(0, "")
+    fields += [""] * (3 - len(fields))
+    return (fields[0], fields[1], fields[2], comment)
+
+
+'''
+FROM 1.4.0: Check whether a directive added in 1.4.0 at the start of a line is in fact
+a label, as it would have been before 1.4.0: it is when an op follows it or, if it
+takes an operand, when nothing does.
+
+Args:
+    field (str): The line's first field.
+    line  (str): The line.
+    index (int): The index of the character after the first field.
+
+Returns:
+    bool: True if the field is a label, otherwise False.
+'''
+def is_label_pop(field, line, index):
+    field = field.upper()
+    if field not in LABEL_POPS: return False
+    next_field = line[index:].split(";", 1)[0].split(None, 1)
+    if not next_field or next_field[0][0] == "*": return field not in BARE_POPS
+    return not check_reserved(next_field[0])
 
 
 '''
@@ -257,17 +864,7 @@ Returns:
     True if the label is not a reserved word, or False.
 '''
 def check_reserved(label):
-    label = label.upper()
-    if label in POPS:
-        return False
-    if label in ISA:
-        return False
-    if label in BSA:
-        return False
-    if label[0] == "L":
-        if label[1:] in BSA:
-            return False
-    return True
+    return label.upper() not in RESERVED_WORDS
 
 '''
 Check that the specified op from the listing is a valid mnemonic.
@@ -277,9 +874,10 @@ Args:
     line  (LineData): An object representing the decoded line.
 
 Returns:
-    list: Contains 1 item (pseudo op), 2 items (branch op) or 6 items (op).
-            Each list contains the op name then integers for the opcode's machine
-            code values for each available addressing mode (or -1 for an unknown op)
+    bool: True if the op is valid, otherwise False. The op's record is placed in the line's
+          'oper' field: it contains 1 item (pseudo op), 3 items (branch op) or 6 items (op).
+          Each record contains the op name then integers for the opcode's machine
+          code values for each available addressing mode (or -1 for an unknown op)
 '''
 def decode_op(an_op, line):
 
@@ -287,15 +885,20 @@ def decode_op(an_op, line):
     an_op = an_op.upper()
 
     # Check for pseudo-ops
-    if an_op in POPS:
-        line.oper = [an_op]
-        line.pseudo_op_type = POPS.index(an_op) + 1
+    if an_op in PSEUDO_OP_RECORDS:
+        line.oper = PSEUDO_OP_RECORDS[an_op]
+        line.pseudo_op_type = PSEUDO_OP_TYPES[an_op]
+        return True
+
+    # FROM 1.4.0: Check for macro calls, which are handled as a pseudo-op
+    if an_op in app_state.macros:
+        line.oper = (an_op,)
+        line.pseudo_op_type = MACRO_CALL_TYPE
         return True
 
     # Check for regular instructions
-    if an_op in ISA:
-        op_index = ISA.index(an_op)
-        for i in range(op_index, op_index + 6): line.oper.append(ISA[i])
+    if an_op in OP_RECORDS:
+        line.oper = OP_RECORDS[an_op]
         return True
 
     # Check for branch instructions
@@ -306,9 +909,8 @@ def decode_op(an_op, line):
     else:
         line.branch_op_type = BRANCH_MODE_SHORT
 
-    if an_op in BSA:
-        op_index = BSA.index(an_op)
-        for i in range(op_index, op_index + 3): line.oper.append(BSA[i])
+    if an_op in BRANCH_RECORDS:
+        line.oper = BRANCH_RECORDS[an_op]
         return True
 
     # No instruction found: that's a Bad Op error
@@ -387,13 +989,29 @@ def decode_opnd(an_opnd, line):
                 post_byte |= reg_val
         opnd_str = str(post_byte)
         line.op_type = ADDR_MODE_IMMEDIATE_SPECIAL
+    elif line.pseudo_op_type == 8:
+        # FCC: take the quoted string verbatim
+        opnd_str = an_opnd[1:-1] if an_opnd[:1] == '"' else an_opnd
+    elif line.pseudo_op_type in (10, 11, 12, 13, 14, 16, 18, MACRO_CALL_TYPE):
+        # FROM 1.4.0: PUBLIC/EXTERN: take the list of symbol names verbatim;
+        #             INCBIN: take the file name and any offset and length verbatim;
+        #             TABLE: take the entry count, size and expression verbatim;
+        #             REPT: take the repeat count verbatim; MACRO: take the macro's name;
+        #             PSTR: take the string verbatim; macro call: take the arguments verbatim
+        opnd_str = an_opnd
     else:
         # Calculate the operand for all other instructions
-        if an_opnd == " ": an_opnd = ""
         if an_opnd:
             quote_start = False
+            is_literal = False
             # Operand string is not empty (it could be, eg. SWI) so process it char by char
             for op_char in an_opnd:
+                if is_literal is True:
+                    # FROM 1.4.0: Keep the character after the Ascii literal prefix, whatever it is
+                    opnd_str += op_char
+                    is_literal = False
+                    continue
+                if op_char == "'": is_literal = True
                 if op_char == "<":
                     # Direct addressing
                     line.op_type = ADDR_MODE_DIRECT
@@ -425,10 +1043,11 @@ def decode_opnd(an_opnd, line):
                     if op_char == " " and quote_start is True: opnd_str += op_char
 
     #if opnd_str and opnd_str[0] == "@":
-    if opnd_str and opnd_str[0].isalpha():
+    is_list = line.pseudo_op_type in (3, 4) and "," in opnd_str
+    if opnd_str and opnd_str[0].isalpha() and line.pseudo_op_type not in (8, 10, 11, 12, 13, 14, 16, 18, MACRO_CALL_TYPE) and is_list is False:
         # Operand is a label
         label_index = index_of_label(opnd_str)
-        if label_index == -1:
+        if label_index == -1 or (app_state.pass_count == 2 and app_state.labels[label_index]["addr"] == "!!!!"):
             # Label has not been seen yet
             if app_state.pass_count == 2:
                 # Any new label seen on pass 2 indicates an error
@@ -436,13 +1055,15 @@ def decode_opnd(an_opnd, line):
                 return err
 
             # Make a new label
-            app_state.labels.append({"name": opnd_str, "addr": "!!!!"})
+            app_state.labels.append({"name": opnd_str, "addr": "!!!!", "kind": SYMBOL_KIND_ADDRESS, "line": 0})
             show_verbose("Label " + opnd_str + " found (line " + str(line.line_number + 1) + ")")
             opnd_str = "!!!!"
         else:
             label = app_state.labels[label_index]
             opnd_value = label["addr"]
             opnd_str = str(opnd_value)
+            record_reference(label["name"], line)
+            line.symbol_refs = [(0, label["name"])]
 
     if not opnd_str:
         # No operand found, so this must be an Inherent Addressing op
@@ -452,18 +1073,29 @@ def decode_opnd(an_opnd, line):
             # FCB/FDB - check for value lists
             opnd_parts = opnd_str.split(",")
             if len(opnd_parts) > 1:
-                # We have a list of values. Convert them to hex bytes for internal processing
-                byte_string = ""
-                byte_count = 2 if line.pseudo_op_type == 3 else 4
-                for part in opnd_parts: byte_string += to_hex(get_int_value(part), byte_count)
-                # Preserve the byte string for later then bail
-                line.pseudo_op_value = byte_string
+                # We have a list of values. FROM 1.4.0: Encode them straight to bytes
+                values = []
+                for item, part in enumerate(opnd_parts):
+                    if part[0].isalpha():
+                        # FROM 1.4.0: Check list items' labels, just as for single operands
+                        label_index = index_of_label(part)
+                        if app_state.pass_count == 2 and (label_index == -1 or app_state.labels[label_index]["addr"] == "!!!!"):
+                            error_message(3, line.line_number) # No label defined
+                            return err
+                        record_reference(part, line)
+                        if line.symbol_refs is None: line.symbol_refs = []
+                        line.symbol_refs.append((item, part))
+                    values.append(get_int_value(part))
+                # Preserve the bytes for later then bail
+                line.pseudo_op_value = encode_values(values, 1 if line.pseudo_op_type == 3 else 2)
                 opnd_value = 0
             else:
                 # Not a list, so just get the value of the operand
                 opnd_value = get_int_value(opnd_str)
-        elif line.pseudo_op_type == 8:
-            # FCC - get a string
+        elif line.pseudo_op_type in (8, 10, 11, 12, 13, 14, 16, 18, MACRO_CALL_TYPE):
+            # FCC - get a string; PUBLIC/EXTERN - get the names; INCBIN - get the file;
+            # TABLE - get the expression; REPT - get the count; MACRO - get the name;
+            # PSTR - get the string; macro call - get the arguments
             line.pseudo_op_value = opnd_str
             opnd_value = 0
         elif line.is_indirect is False:
@@ -485,7 +1117,8 @@ def decode_opnd(an_opnd, line):
                         error_message(4, line.line_number) # Bad branch type: out of range offset
                         return err
                 else:
-                    offset = 3 # PC + 1 byte of op + 2 bytes of delta
+                    # FROM 1.4.0: Allow for the page prefix of a long conditional branch
+                    offset = 3 if line.oper[2] < 0x100 else 4 # PC + 1 or 2 bytes of op + 2 bytes of delta
                     line.index_address = opnd_value - (app_state.prog_count + offset)
 
                 if line.index_address >= 0:
@@ -525,7 +1158,6 @@ def process_pseudo_op(line_parts, line):
     result = False
     opnd_value = line.opnd
     label_name = line_parts[0]
-    if label_name == " ": label_name = ""
     label_idx = index_of_label(label_name)
 
     if line.pseudo_op_type == 1:
@@ -535,6 +1167,7 @@ def process_pseudo_op(line_parts, line):
         if app_state.pass_count == 1:
             label = app_state.labels[label_idx]
             label["addr"] = opnd_value
+            label["kind"] = SYMBOL_KIND_EQU
             show_verbose("Label " + label_name + " set to 0x" +
                          to_hex(opnd_value) + " (line " + str(line.line_number + 1) + ")")
         result = write_code(line_parts, line)
@@ -549,80 +1182,40 @@ def process_pseudo_op(line_parts, line):
         if app_state.pass_count == 1:
             show_verbose(str(opnd_value) + " bytes reserved at address 0x" +
                          to_hex(app_state.prog_count, 4) + " (line " + str(line.line_number + 1) + ")")
-        if line.pseudo_op_type == 9:
-            for i in range(app_state.prog_count, app_state.prog_count + opnd_value):
-                poke(i, 0x00)
+        if line.pseudo_op_type == 9: poke_bytes(app_state.prog_count, bytes(opnd_value))
         result = write_code(line_parts, line)
         app_state.prog_count += opnd_value
 
-    if line.pseudo_op_type == 3:
+    if line.pseudo_op_type in (3, 4):
         # FCB: Pokes 'opnd_value' (1 byte) or 'pseudo_op_value' (x bytes) at the
         # current byte. Sets a label, if present, to the address of the first byte
-        if label_idx != -1:
-            label = app_state.labels[label_idx]
-            label["addr"] = app_state.prog_count
-        if line.pseudo_op_value:
-            # Multiple bytes to poke in, in the form of a hex string
-            count = 0
-            for i in range(0, len(line.pseudo_op_value), 2):
-                byte = line.pseudo_op_value[i:i+2]
-                if i == 0:
-                    line.opnd = int(byte, 16)
-                    # Write out the sequence's first byte value
-                    result = write_code(line_parts, line)
-                elif app_state.pass_count == 2:
-                    # Write out the sequence's subsequent bytes
-                    print("          0x" + to_hex(app_state.prog_count, 4) + "    " + byte)
-                poke(app_state.prog_count, int(byte, 16))
-                app_state.prog_count += 1
-                count += 1
-            if app_state.pass_count == 1:
-                show_verbose(str(count) + " bytes written at 0x" +
-                             to_hex(app_state.prog_count - count, 4) +
-                             " (line " + str(line.line_number + 1) + ")")
-        else:
-            # Just a single byte to drop in
-            opnd_value = opnd_value & 0xFF
-            poke(app_state.prog_count, opnd_value)
-            if app_state.pass_count == 1:
-                show_verbose("The byte at 0x" + to_hex(app_state.prog_count, 4) + " set to 0x" +
-                             to_hex(opnd_value) + " (line " + str(line.line_number + 1) + ")")
-            result = write_code(line_parts, line)
-            app_state.prog_count += 1
-
-    if line.pseudo_op_type == 4:
         # FDB: Pokes the MSB of 'opnd_value' into the current byte and the LSB into
-        # the next byte. Sets the label to the address of the first byte.
+        # the next byte, or does the same for each of the values in 'pseudo_op_value'
+        # FROM 1.4.0: The values are encoded as bytes, and poked in one operation
+        size = line.pseudo_op_type - 2
         if label_idx != -1:
             label = app_state.labels[label_idx]
             label["addr"] = app_state.prog_count
-        if line.pseudo_op_value:
-            # Multiple bytes to poke in, in the form of a hex string
-            byte_count = 0
-            for i in range(0, len(line.pseudo_op_value), 4):
-                byte = line.pseudo_op_value[i:i+4]
-                byte_count = i
-                if i == 0:
-                    line.opnd = int(byte, 16)
-                    result = write_code(line_parts, line)
-                elif app_state.pass_count == 2:
-                    print("          0x" + to_hex(app_state.prog_count, 4) + "    " + byte)
-                poke(app_state.prog_count, (int(byte, 16) >> 8) & 0xFF)
-                poke(app_state.prog_count + 1, int(byte, 16) & 0xFF)
-                app_state.prog_count += 2
-            if app_state.pass_count == 1:
-                show_verbose(str(byte_count) + " bytes written at 0x" + to_hex(app_state.prog_count - byte_count, 4) +
+        data = line.pseudo_op_value if line.pseudo_op_value else encode_values([opnd_value], size)
+        line.opnd = int.from_bytes(data[:size], "big")
+        if app_state.pass_count == 1:
+            if line.pseudo_op_value:
+                show_verbose(str(len(data)) + " bytes written at 0x" + to_hex(app_state.prog_count, 4) +
                              " (line " + str(line.line_number + 1) + ")")
-        else:
-            # Just a single 16-bit value to drop in
-            opnd_value = opnd_value & 0xFFFF
-            if app_state.pass_count == 1:
-                show_verbose("The two bytes at 0x" + to_hex(app_state.prog_count, 4) + " set to 0x" +
-                             to_hex(opnd_value, 4) + " (line " + str(line.line_number + 1) + ")")
-            result = write_code(line_parts, line)
-            poke(app_state.prog_count, (opnd_value >> 8) & 0xFF)
-            poke(app_state.prog_count + 1, opnd_value & 0xFF)
-            app_state.prog_count += 2
+            else:
+                show_verbose(("The byte at 0x" if size == 1 else "The two bytes at 0x") + to_hex(app_state.prog_count, 4) +
+                             " set to 0x" + to_hex(line.opnd, size * 2) + " (line " + str(line.line_number + 1) + ")")
+        # Write out the sequence's first value
+        result = write_code(line_parts, line)
+        if line.symbol_refs:
+            for item, _ in line.symbol_refs:
+                if record_relocation(line, app_state.prog_count + item * size, size, item) is False: return False
+        poke_bytes(app_state.prog_count, data)
+        if app_state.pass_count == 2 and app_state.verbose is True:
+            # Write out the sequence's subsequent values
+            for i in range(size, len(data), size):
+                print("          0x" + to_hex(app_state.prog_count + i, 4) + "    " + data[i:i + size].hex().upper())
+        app_state.prog_count += len(data)
 
     if line.pseudo_op_type == 5:
         # END: The end of the program. This is optional, and currently does nothing
@@ -633,17 +1226,22 @@ def process_pseudo_op(line_parts, line):
         if app_state.pass_count == 1:
             show_verbose("Origin set to 0x" + to_hex(opnd_value, 4) + " (line " + str(line.line_number + 1) + ")")
             if app_state.prog_count != app_state.chunk["address"]:
+                # The current chunk is in use, so start a new one
                 new_chunk = {}
                 new_chunk["code"] = bytearray()
-                new_chunk["address"] = 0xFFFF
+                new_chunk["address"] = opnd_value
                 app_state.code.append(new_chunk)
-            app_state.chunk["address"] = opnd_value
+            else:
+                app_state.chunk["address"] = opnd_value
+                # FROM 1.4.0: An ORG fixes the chunk's address, so it can't be relocated
+                app_state.chunk.pop("relocatable", None)
         app_state.chunk = chunk_from_address(opnd_value)
         app_state.prog_count = opnd_value
         result = write_code(line_parts, line)
         if label_name:
             label = app_state.labels[label_idx]
             label["addr"] = opnd_value
+            if app_state.pass_count == 1: set_label_section(label)
             if app_state.pass_count == 1:
                 show_verbose("Label " + label["name"] + " set to 0x" +
                              to_hex(opnd_value, 4) + " (line " + str(line.line_number + 1) + ")")
@@ -654,28 +1252,450 @@ def process_pseudo_op(line_parts, line):
     if line.pseudo_op_type == 8:
         # FCC: Pokes in a string
         result = write_code(line_parts, line)
-        for i in range(0, len(line.pseudo_op_value)):
-            byte = line.pseudo_op_value[i:i+1]
-            poke(app_state.prog_count, ord(byte))
-            app_state.prog_count += 1
+        data = line.pseudo_op_value.encode("latin-1")
+        poke_bytes(app_state.prog_count, data)
+        app_state.prog_count += len(data)
+
+    if line.pseudo_op_type == 10:
+        # FROM 1.4.0: PUBLIC: Export the listed symbols from an object file
+        for name in line.pseudo_op_value.split(","):
+            if app_state.pass_count == 2:
+                symbol_index = index_of_label(name)
+                if symbol_index == -1 or app_state.labels[symbol_index]["addr"] == "!!!!" \
+                    or app_state.labels[symbol_index]["kind"] == SYMBOL_KIND_EXTERN:
+                    error_message(3, line.line_number) # No label defined
+                    return False
+                if app_state.public_symbols is not None and name not in app_state.public_symbols:
+                    app_state.public_symbols.append(name)
+        result = write_code(line_parts, line)
+
+    if line.pseudo_op_type == 11:
+        # FROM 1.4.0: EXTERN: Import the listed symbols, to be resolved at link time
+        if app_state.object_mode is False:
+            error_message(12, line.line_number) # Object file needed
+            return False
+        for name in line.pseudo_op_value.split(","):
+            if app_state.pass_count == 1:
+                symbol_index = index_of_label(name)
+                if symbol_index == -1:
+                    app_state.labels.append({"name": name, "addr": 0, "kind": SYMBOL_KIND_EXTERN, "line": line.line_number + 1})
+                elif app_state.labels[symbol_index]["addr"] == "!!!!":
+                    app_state.labels[symbol_index].update({"addr": 0, "kind": SYMBOL_KIND_EXTERN, "line": line.line_number + 1})
+                else:
+                    error_message(13 if app_state.labels[symbol_index]["line"] == 0 else 2, line.line_number) # Duplicate label
+                    return False
+        result = write_code(line_parts, line)
+
+    if line.pseudo_op_type == 12:
+        # FROM 1.4.0: INCBIN: Copy all or part of a binary file into the code
+        if label_idx != -1:
+            label = app_state.labels[label_idx]
+            label["addr"] = app_state.prog_count
+        result = include_binary(line_parts, line)
+
+    if line.pseudo_op_type == 13:
+        # FROM 1.4.0: TABLE: Generate a table of values from an expression
+        if label_idx != -1:
+            label = app_state.labels[label_idx]
+            label["addr"] = app_state.prog_count
+        result = generate_table(line_parts, line)
+
+    if line.pseudo_op_type == 18:
+        # FROM 1.4.0: PSTR: Add a string to the pool, to be placed by POOL
+        result = pool_string(line_parts, line, label_idx)
+
+    if line.pseudo_op_type == 19:
+        # FROM 1.4.0: POOL: Place the pooled strings
+        result = place_string_pool(line_parts, line)
+
+    if line.pseudo_op_type in (14, 15, 16, 17, MACRO_CALL_TYPE):
+        # FROM 1.4.0: REPT/ENDR: The block is repeated by 'assemble_repeat()';
+        #             MACRO/ENDM: The macro is recorded by 'define_macro()';
+        #             macro call: The macro is assembled by 'expand_macro()',
+        # so there is only the listing to write out
+        result = write_code(line_parts, line)
 
     return result
 
 
 '''
-Get a specific chunk from its address.
+Add a string to the string pool, as directed by a PSTR pseudo-op's operand: a
+quoted string, then any further byte values, eg. a terminating 0. The pooled
+strings are placed by POOL, which must follow every PSTR, so the label of a PSTR
+is set when the pool is placed, to the address at which its string ends up.
 
 Args:
-    an_address (int): The chunk address.
+    line_parts (list):     The program components of the current line (see 'parse_line()').
+    line       (LineData): The decoded line data.
+    label_idx  (int):      The index of the line's label, or -1 if it has none.
 
 Returns:
-    Chunk: The required chunk.
+    bool: False if an error occurred, or True.
 '''
-def chunk_from_address(address):
-    for chunk in app_state.code:
-        if chunk["address"] == address: return chunk
-    print("ERROR -- mis-addressed chunk")
-    sys.exit(1)
+def pool_string(line_parts, line, label_idx):
+    if app_state.pass_count == 1:
+        if app_state.string_pool["address"] is not None:
+            error_message(21, line.line_number) # PSTR after POOL
+            return False
+
+        # Get the string's bytes
+        opnd = line.pseudo_op_value
+        values = ""
+        if opnd[:1] == '"':
+            end = opnd.find('"', 1)
+            if end == -1:
+                error_message(5, line.line_number) # Bad operand
+                return False
+            values = opnd[end + 1:]
+            opnd = opnd[1:end]
+        if values and values[0] != ",":
+            error_message(5, line.line_number) # Bad operand
+            return False
+        data = opnd.encode("latin-1") + encode_values([get_int_value("0x" + value[1:] if value[:1] == "$" else value)
+                                                       for value in values[1:].split(",")] if values else [], 1)
+
+        # The label's value is set when the pool is placed
+        if label_idx != -1: app_state.labels[label_idx]["addr"] = "!!!!"
+        app_state.string_pool["strings"].append((label_idx, data, line.line_number))
+    return write_code(line_parts, line)
+
+
+'''
+Place the pooled strings at the current address. Each string is stored only
+once and, if it ends another string, it is not stored at all: it shares the
+end of the other string. The labels of the strings' PSTR ops are then set.
+
+Args:
+    line_parts (list):     The program components of the current line (see 'parse_line()').
+    line       (LineData): The decoded line data.
+
+Returns:
+    bool: False if an error occurred, or True.
+'''
+def place_string_pool(line_parts, line):
+    pool = app_state.string_pool
+    if app_state.pass_count == 1:
+        if pool["address"] is not None:
+            error_message(21, line.line_number) # PSTR after POOL
+            return False
+        pool["address"] = app_state.prog_count
+        pool["data"], offsets = layout_strings([data for _, data, _ in pool["strings"]])
+        for label_idx, data, _ in pool["strings"]:
+            if label_idx == -1: continue
+            label = app_state.labels[label_idx]
+            label["addr"] = app_state.prog_count + offsets[data]
+            set_label_section(label)
+        total = sum(len(data) for _, data, _ in pool["strings"])
+        show_verbose(str(len(pool["strings"])) + " strings pooled in " + str(len(pool["data"])) + " bytes at 0x" +
+                     to_hex(app_state.prog_count, 4) + ", saving " + str(total - len(pool["data"])) +
+                     " bytes (line " + str(line.line_number + 1) + ")")
+
+    poke_bytes(app_state.prog_count, pool["data"])
+    line.opnd = len(pool["data"])
+    result = write_code(line_parts, line)
+    app_state.prog_count += len(pool["data"])
+    return result
+
+
+'''
+Lay out a set of strings so that each is stored once, and any string which ends
+another string shares that string's bytes. The strings are sorted by their reversed
+bytes, which places a string that ends another just before it, or before a string
+which ends in the same way, so each string need only be compared with the next.
+
+Args:
+    strings (list): The strings, as bytes.
+
+Returns:
+    tuple: The laid out strings, as bytes, and the offset of each string within them.
+'''
+def layout_strings(strings):
+    unique = list(dict.fromkeys(strings))
+    order = sorted(range(len(unique)), key=lambda index: unique[index][::-1])
+
+    # Find the string, if any, whose end each string shares
+    hosts = {}
+    for position in range(len(order) - 2, -1, -1):
+        index, next_index = order[position], order[position + 1]
+        if unique[next_index].endswith(unique[index]): hosts[index] = hosts.get(next_index, next_index)
+
+    # Store the other strings in the order in which they were pooled
+    data = bytearray()
+    offsets = {}
+    for index, string in enumerate(unique):
+        if index not in hosts:
+            offsets[string] = len(data)
+            data += string
+    for index, host_index in hosts.items():
+        host = unique[host_index]
+        offsets[unique[index]] = offsets[host] + len(host) - len(unique[index])
+    return bytes(data), offsets
+
+
+'''
+Generate a lookup table, as directed by a TABLE pseudo-op's operand: the number
+of entries, the size of each entry (1 or 2 bytes), then an expression which is
+evaluated for each entry, with the entry's index as 'I'. The entry count and size
+are fixed on pass 1, but the entries are only calculated on pass 2.
+
+Args:
+    line_parts (list):     The program components of the current line (see 'parse_line()').
+    line       (LineData): The decoded line data.
+
+Returns:
+    bool: False if an error occurred, or True.
+'''
+def generate_table(line_parts, line):
+    parts = line.pseudo_op_value.split(",", 2)
+    if len(parts) != 3:
+        error_message(5, line.line_number) # Bad operand
+        return False
+    count = evaluate_expression(parts[0], line)
+    size = evaluate_expression(parts[1], line)
+    if count is None or size is None: return False
+    if count < 0 or size not in (1, 2):
+        error_message(5, line.line_number) # Bad operand
+        return False
+
+    if app_state.pass_count == 1:
+        # Only the table's size matters on pass 1
+        data = bytes(count * size)
+        show_verbose(str(count) + " table entries written at 0x" + to_hex(app_state.prog_count, 4) +
+                     " (line " + str(line.line_number + 1) + ")")
+    else:
+        values = evaluate_expression(parts[2], line, count)
+        if values is None: return False
+        data = encode_values(values, size)
+    poke_bytes(app_state.prog_count, data)
+    line.opnd = len(data)
+    result = write_code(line_parts, line)
+    app_state.prog_count += len(data)
+    return result
+
+
+'''
+Evaluate an expression written with spasm's number formats, eg. '$FF', '%1010'
+or "'A", and which may include symbols, Python's arithmetic and bitwise operators,
+and the functions listed in TABLE_FUNCTIONS. Results are rounded to integers.
+
+Args:
+    expression (str):      The expression.
+    line       (LineData): The decoded line data.
+    count      (int):      If set, evaluate the expression for each value of the
+                           index 'I' from 0 to 'count' - 1.
+
+Returns:
+    int|list: The value or, if 'count' is set, the list of values, or None on error.
+'''
+def evaluate_expression(expression, line, count=None):
+    compiled = compile_expression(expression)
+    if compiled is None:
+        error_message(15, line.line_number) # Bad expression
+        return None
+
+    # Bind the expression's symbols to their values
+    code, names = compiled
+    namespace = {"__builtins__": {}}
+    namespace.update(TABLE_FUNCTIONS)
+    for name in names:
+        label_index = index_of_label(name)
+        if label_index == -1 or app_state.labels[label_index]["addr"] == "!!!!":
+            error_message(3, line.line_number) # No label defined
+            return None
+        label = app_state.labels[label_index]
+        if get_relocation_kind(label) is not None:
+            error_message(11, line.line_number) # Value cannot be relocated
+            return None
+        record_reference(name, line)
+        namespace[name] = label["addr"]
+
+    namespace[EXPRESSION_POWER] = bounded_power
+    namespace[EXPRESSION_SHIFT] = bounded_shift
+    try:
+        function = eval(code, namespace) # pylint: disable=W0123
+        if count is None: return round_value(function(0))
+        return [round_value(function(index)) for index in range(count)]
+    except (ArithmeticError, ValueError, TypeError, MemoryError, RecursionError):
+        error_message(15, line.line_number) # Bad expression
+        return None
+
+
+'''
+Raise a value to a power, provided the operands are small enough that the result
+can be calculated quickly. FROM 1.4.0.
+
+Args:
+    value (int|float): The value.
+    count (int|float): The power.
+
+Returns:
+    int|float: The result.
+'''
+def bounded_power(value, count):
+    if abs(value) > EXPRESSION_MAX_OPERAND or abs(count) > EXPRESSION_MAX_COUNT: raise ValueError
+    return value ** count
+
+
+'''
+Shift a value left, provided the operands are small enough that the result
+can be calculated quickly. FROM 1.4.0.
+
+Args:
+    value (int): The value.
+    count (int): The number of bits to shift by.
+
+Returns:
+    int: The result.
+'''
+def bounded_shift(value, count):
+    if abs(value) > EXPRESSION_MAX_OPERAND or abs(count) > EXPRESSION_MAX_COUNT: raise ValueError
+    return value << count
+
+
+'''
+Convert an expression written with spasm's number formats to Python, check that
+it uses only arithmetic, and compile it to a function of the index variable.
+Recent expressions are cached, so each is only compiled once.
+
+Args:
+    expression (str): The expression.
+
+Returns:
+    tuple: The compiled function and the names of the symbols it uses, or None
+           if the expression is not valid.
+'''
+@functools.lru_cache(maxsize=LRU_CACHE_SIZE)
+def compile_expression(expression):
+    def convert_literal(match):
+        if match.group(1): return "0x" + match.group(1)
+        if match.group(4) is not None: return match.group(2) + match.group(3) + "0b" + match.group(4)
+        return str(ord(match.group(5)))
+
+    source = re.sub(r"\$([0-9A-Fa-f]+)|(^|[-+*/%&|^~<>(,])(\s*)%([01]+)|'(.)", convert_literal, expression)
+    try:
+        tree = ast.parse("lambda " + TABLE_INDEX_NAME + ": (" + source + ")", mode="eval")
+    except (SyntaxError, ValueError, MemoryError, RecursionError):
+        return None
+    body = tree.body.body
+
+    names = set()
+    for node in ast.walk(body):
+        if isinstance(node, ast.Name):
+            if node.id != TABLE_INDEX_NAME and node.id not in TABLE_FUNCTIONS: names.add(node.id)
+        elif isinstance(node, ast.Call):
+            if not isinstance(node.func, ast.Name) or node.func.id not in TABLE_FUNCTIONS or node.keywords: return None
+        elif isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float): return None
+        elif not isinstance(node, (ast.BinOp, ast.UnaryOp, ast.Load, ast.operator, ast.unaryop)):
+            return None
+
+    # Powers and left shifts can take an age, or all of memory, to calculate, so they are
+    # made by functions which check the size of their operands
+    for node in ast.walk(tree):
+        for field, child in ast.iter_fields(node):
+            if isinstance(child, ast.BinOp) and isinstance(child.op, (ast.Pow, ast.LShift)):
+                name = EXPRESSION_POWER if isinstance(child.op, ast.Pow) else EXPRESSION_SHIFT
+                setattr(node, field, ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[child.left, child.right], keywords=[]))
+            elif isinstance(child, list):
+                for index, item in enumerate(child):
+                    if isinstance(item, ast.BinOp) and isinstance(item.op, (ast.Pow, ast.LShift)):
+                        name = EXPRESSION_POWER if isinstance(item.op, ast.Pow) else EXPRESSION_SHIFT
+                        child[index] = ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[item.left, item.right], keywords=[])
+    try:
+        code = compile(ast.fix_missing_locations(tree), "<expression>", "eval")
+    except (ValueError, MemoryError, RecursionError):
+        return None
+    return (code, tuple(sorted(names)))
+
+
+'''
+Round a value calculated by an expression to the nearest integer.
+
+Args:
+    value (int|float): The value.
+
+Returns:
+    int: The rounded value.
+'''
+def round_value(value):
+    return value if isinstance(value, int) else math.floor(value + 0.5)
+
+
+'''
+Copy all or part of a binary file into the code, as directed by an INCBIN
+pseudo-op's operand: the quoted file name, then an optional offset into the file
+and the number of bytes to copy. The file is mapped into memory and the bytes
+copied in one operation. Relative file names are resolved against the source
+file's directory.
+
+Args:
+    line_parts (list):     The program components of the current line (see 'parse_line()').
+    line       (LineData): The decoded line data.
+
+Returns:
+    bool: False if an error occurred, or True.
+'''
+def include_binary(line_parts, line):
+    # Split the operand into the file name and the offset and length, if present
+    opnd = line.pseudo_op_value
+    if opnd[:1] == '"':
+        name_end = opnd.find('"', 1)
+        if name_end == -1:
+            error_message(5, line.line_number) # Bad operand
+            return False
+        file_name = opnd[1:name_end]
+        values = opnd[name_end + 1:]
+    else:
+        file_name, _, values = opnd.partition(",")
+        values = "," + values if values else ""
+    if values and values[0] != ",":
+        error_message(5, line.line_number) # Bad operand
+        return False
+    values = [get_int_value("0x" + value[1:] if value[:1] == "$" else value) for value in values[1:].split(",")] if values else []
+    if not file_name or len(values) > 2:
+        error_message(5, line.line_number) # Bad operand
+        return False
+
+    source_dir = os.path.dirname(get_source_file())
+    file_path = os.path.join(source_dir, file_name) if source_dir else file_name
+    try:
+        with open(file_path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            offset = values[0] if values else 0
+            length = values[1] if len(values) > 1 else size - offset
+            if offset < 0 or length < 0 or offset + length > size:
+                error_message(5, line.line_number) # Bad operand
+                return False
+            if length > 0:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    poke_bytes(app_state.prog_count, data[offset:offset + length])
+    except (OSError, ValueError):
+        error_message(14, line.line_number) # Unreadable file
+        return False
+
+    if app_state.pass_count == 1:
+        show_verbose(str(length) + " bytes included from " + file_name + " at 0x" +
+                     to_hex(app_state.prog_count, 4) + " (line " + str(line.line_number + 1) + ")")
+    line.opnd = length
+    result = write_code(line_parts, line)
+    app_state.prog_count += length
+    return result
+
+
+'''
+Get a specific chunk from its address.
+
+Args:
+    an_address (int): The chunk address.
+
+Returns:
+    Chunk: The required chunk.
+'''
+def chunk_from_address(address):
+    for chunk in app_state.code:
+        if chunk["address"] == address: return chunk
+    print("ERROR -- mis-addressed chunk")
+    sys.exit(1)
 
 
 '''
@@ -728,17 +1748,21 @@ def decode_indexed(opnd, line):
                 left = "-" + left
             if left[0].isalpha(): #== "@":
                 label_index = index_of_label(left)
-                if label_index == -1:
+                if label_index == -1 or (app_state.pass_count == 2 and app_state.labels[label_index]["addr"] == "!!!!"):
                     if app_state.pass_count == 2:
                         error_message(3, line.line_number) # No label defined
                         return ""
-                    app_state.labels.append({"name": left, "addr": "!!!!"})
+                    app_state.labels.append({"name": left, "addr": "!!!!", "kind": SYMBOL_KIND_ADDRESS, "line": 0})
                     if app_state.pass_count == 1: show_verbose("Label " + left + " found on line " + str(line.line_number + 1))
                     # Set byte value to 129 to make sure we allow a 16-bit max. space
                     byte_value = 129
                 else:
                     label = app_state.labels[label_index]
                     byte_value = label["addr"]
+                    record_reference(label["name"], line)
+                    line.symbol_refs = [(0, label["name"])]
+                    # FROM 1.4.0: A relocatable offset may be any size once linked, so always use 16 bits
+                    if get_relocation_kind(label) is not None: byte_value = 0x8000
             else:
                 byte_value = get_int_value(left)
                 if (byte_value < -32768 or byte_value > 32767):
@@ -863,9 +1887,10 @@ def get_int_value(constant_string, size=8, do_twos=False):
         # Hex value
         value = int(constant_string, 16)
     elif constant_string[0].isalpha():
-        # A label value
-        label = app_state.labels[index_of_label(constant_string)]
-        value = label["addr"]
+        # A label value -- zero if the label has yet to be defined
+        label_index = index_of_label(constant_string)
+        value = app_state.labels[label_index]["addr"] if label_index != -1 else "!!!!"
+        if value == "!!!!": value = 0
     elif constant_string[0] == "%":
         # Binary data
         value = decode_binary(constant_string[1:])
@@ -880,7 +1905,7 @@ def get_int_value(constant_string, size=8, do_twos=False):
     # FROM 1.2.0: Check for negative values - cast to 2's comp
     if value < 0 and do_twos is True:
         if value < -128 or size == 16:
-            value += 32768
+            value += 65536
         else:
             value += 256
     return value
@@ -901,6 +1926,22 @@ def to_hex(value, length=2):
     return format_string.format(value)
 
 
+'''
+Encode a list of 8-bit or 16-bit values as big-endian bytes. Out-of-range values
+keep only their least-significant bits, so negative values are 2's complement.
+
+Args:
+    values (list): The integer values.
+    size   (int):  The number of bytes per value: 1 or 2.
+
+Returns:
+    bytes: The encoded values.
+'''
+def encode_values(values, size):
+    if size == 1: return bytes([value & 0xFF for value in values])
+    return struct.pack(">" + str(len(values)) + "H", *[value & 0xFFFF for value in values])
+
+
 '''
 Decode the supplied binary value (as a string, eg. '0010010') to an integer.
 
@@ -928,13 +1969,162 @@ Returns:
     int: The index of the label in the list, or -1 if it isn't yet recorded.
 '''
 def index_of_label(label_name):
-    if app_state.labels:
-        for label in app_state.labels:
-            if label["name"] == label_name:
-                # Got a match so return the label's index in the list
-                return app_state.labels.index(label)
+    # FROM 1.4.0: Look the label up in an index of the label list, so that large
+    #             symbol tables remain fast. Labels are only ever appended, so
+    #             the index is brought up to date with any newly added labels
+    labels = app_state.labels
+    if app_state.label_index_of is not labels:
+        app_state.label_index = {}
+        app_state.label_index_of = labels
+        app_state.label_index_count = 0
+    index = app_state.label_index
+    for i in range(app_state.label_index_count, len(labels)):
+        index.setdefault(labels[i]["name"], i)
+    app_state.label_index_count = len(labels)
     # Return -1 to indicate 'label_name' is not in the list
-    return -1
+    return index.get(label_name, -1)
+
+
+'''
+Record a reference to a symbol in the cross-reference index. References are
+only recorded on the second pass, and only if the index has been requested.
+
+Args:
+    label_name (str):      The referenced symbol.
+    line       (LineData): The decoded line which references it.
+'''
+def record_reference(label_name, line):
+    if app_state.pass_count != 2 or app_state.xref is None: return
+
+    # Classify the access by the op making it
+    kind = "load"
+    op_name = line.oper[0] if line.oper else ""
+    if line.pseudo_op_type > 0:
+        kind = "data"
+    elif line.branch_op_type > 0:
+        kind = "branch"
+    elif op_name in ("JMP", "JSR"):
+        kind = "jump"
+    elif op_name[:2] == "ST":
+        kind = "store"
+    elif op_name in ("NEG", "COM", "LSR", "ROR", "ASR", "ASL", "LSL", "ROL", "DEC", "INC", "CLR"):
+        # Read-modify-write ops: the 6809's CLR also reads the location before clearing it
+        kind = "modify"
+
+    if label_name not in app_state.xref: app_state.xref[label_name] = []
+    app_state.xref[label_name].append((line.line_number + 1, app_state.prog_count, kind))
+
+
+'''
+Note which code chunk holds an address label, if the label will be relocated
+at link time, ie. if the chunk is relocatable. Only applies to object files.
+
+Args:
+    label (dict): The label.
+'''
+def set_label_section(label):
+    if app_state.object_mode is False: return
+    if app_state.chunk.get("relocatable", False) is True:
+        label["section"] = app_state.code.index(app_state.chunk)
+    else:
+        label.pop("section", None)
+
+
+'''
+Determine how a symbol's value must be adjusted at link time.
+
+Args:
+    label (dict): The symbol's label.
+
+Returns:
+    str: 'extern' for an imported symbol, 'section' for an address in a relocatable
+         chunk, or None if the value is absolute.
+'''
+def get_relocation_kind(label):
+    if app_state.object_mode is False: return None
+    if label["kind"] == SYMBOL_KIND_EXTERN: return "extern"
+    if label["kind"] == SYMBOL_KIND_ADDRESS and "section" in label: return "section"
+    return None
+
+
+'''
+Record a relocation for a value written into the code, if the value derives from a
+symbol that will change at link time, or is the offset of a branch from a relocatable
+chunk to a fixed address. Only applies to object files, on pass 2.
+
+Args:
+    line    (LineData): The decoded line data.
+    address (int):      The address at which the value will be written.
+    size    (int):      The size of the value in bytes.
+    item    (int):      The value's position in an FCB/FDB list.
+
+Returns:
+    bool: False if the value cannot be relocated, otherwise True.
+'''
+def record_relocation(line, address, size, item=0):
+    if app_state.object_mode is False or app_state.pass_count != 2: return True
+    names = [name for index, name in line.symbol_refs if index == item] if line.symbol_refs else []
+    label = app_state.labels[index_of_label(names[0])] if names else None
+    kind = get_relocation_kind(label) if label is not None else None
+    if kind is None and line.branch_op_type > 0 and app_state.chunk.get("relocatable", False) is True:
+        # A branch from a relocatable chunk to a fixed address must change when the chunk moves
+        kind = "address"
+    if kind is None: return True
+    if line.branch_op_type > 0 and kind == "section":
+        # Branches within a relocatable chunk move with it
+        if label["section"] == app_state.code.index(app_state.chunk): return True
+    if size != 2 or line.branch_op_type == BRANCH_MODE_SHORT:
+        error_message(11, line.line_number) # Value cannot be relocated
+        return False
+
+    relocation = {"section": app_state.code.index(app_state.chunk), "offset": address - app_state.chunk["address"],
+                  "type": "rel16" if line.branch_op_type > 0 else "abs16"}
+    if kind == "extern":
+        relocation["symbol"] = label["name"]
+    elif kind == "address":
+        # The branch's target is the address that follows its offset, plus the offset
+        relocation["address"] = (address + size + line.opnd) & 0xFFFF
+    else:
+        relocation["target"] = label["section"]
+    app_state.relocations.append(relocation)
+    return True
+
+
+'''
+Build the cross-reference report: every symbol, in name order, followed by
+the lines which reference it.
+
+Returns:
+    list: The lines of the report.
+'''
+def get_xref_report():
+    report = ["Symbol              Value     Line      Address   Access",
+              "--------------------------------------------------------"]
+    for symbol in sorted(get_symbols(app_state.labels), key=lambda symbol: symbol["name"]):
+        name = symbol["name"]
+        report.append(name + set_spacer(20, len(name)) + "0x" + to_hex(symbol["value"] & 0xFFFF, 4) + "    "
+                      + str(symbol["line"]).zfill(6) + "    " + ("EQU" if symbol["kind"] == SYMBOL_KIND_EQU else "(defined)"))
+        for line_number, address, kind in app_state.xref.get(name, []):
+            report.append(set_spacer(30) + str(line_number).zfill(6) + "    0x" + to_hex(address, 4) + "    " + kind)
+    return report
+
+
+'''
+Write the cross-reference index to a text report and a .xref.json file.
+
+Args:
+    file_root (str): The path of the output files, minus the file extension.
+'''
+def write_xref_files(file_root):
+    with open(file_root + ".xref", "w") as file: file.write("\n".join(get_xref_report()) + "\n")
+
+    xref_data = {}
+    for symbol in get_symbols(app_state.labels):
+        xref_data[symbol["name"]] = {"value": symbol["value"], "line": symbol["line"],
+                                     "references": [{"line": line_number, "address": address, "kind": kind}
+                                                    for line_number, address, kind in app_state.xref.get(symbol["name"], [])]}
+    with open(file_root + ".xref.json", "w") as file: json.dump(xref_data, file, ensure_ascii=False, sort_keys=True)
+    show_verbose("Cross-reference files " + os.path.abspath(file_root) + ".xref(.json) written")
 
 
 '''
@@ -960,6 +2150,9 @@ def write_code(line_parts, line):
             error_message(6, line.line_number) # Bad opcode
             return False
 
+        # FROM 1.4.0: Record the address of each instruction, for analysis
+        if app_state.pass_count == 2: app_state.op_addresses.append(app_state.prog_count)
+
         # Poke in the opcode
         if op_value < 256:
             poke(app_state.prog_count, op_value)
@@ -991,13 +2184,14 @@ def write_code(line_parts, line):
             # Inherent addressing
             line.op_type = ADDR_MODE_NONE
         if line.is_indexed is True:
+            post_byte = line.opnd
             poke(app_state.prog_count, line.opnd)
             if app_state.pass_count == 2: byte_str += to_hex(line.opnd)
             app_state.prog_count += 1
             if line.index_address != ADDRESSING_NONE:
                 line.opnd = line.index_address
-                # By this point, all values should be unsigned
-                if line.opnd > 255:
+                # FROM 1.4.0: The post byte sets the size of the offset
+                if post_byte & 0x8F in (0x89, 0x8D):
                     # Do 16-bit address
                     line.op_type = ADDR_MODE_EXTENDED
                 else:
@@ -1007,11 +2201,13 @@ def write_code(line_parts, line):
                 line.op_type = ADDR_MODE_NONE
         if line.op_type > ADDR_MODE_NONE and line.op_type < ADDR_MODE_EXTENDED:
             # Immediate, direct and indexed addressing
+            if record_relocation(line, app_state.prog_count, 1) is False: return False
             poke(app_state.prog_count, line.opnd)
             app_state.prog_count += 1
             if app_state.pass_count == 2: byte_str += to_hex(line.opnd)
         if line.op_type == ADDR_MODE_EXTENDED:
             # Extended addressing
+            if record_relocation(line, app_state.prog_count, 2) is False: return False
             lsb = line.opnd & 0xFF
             msb = (line.opnd >> 8) & 0xFF
             poke(app_state.prog_count, msb)
@@ -1019,6 +2215,9 @@ def write_code(line_parts, line):
             app_state.prog_count += 2
             if app_state.pass_count == 2: byte_str += (to_hex(msb) + to_hex(lsb))
 
+    # FROM 1.4.0: Emit the line as a JSON record on pass 2, if required
+    if app_state.pass_count == 2 and app_state.json_stream is not None: emit_line_record(line_parts, line, byte_str)
+
     if app_state.pass_count == 2 and app_state.verbose is True:
         # Display the line on pass 2
         # Determine the length of the longest label
@@ -1090,6 +2289,61 @@ def write_code(line_parts, line):
     return True
 
 
+'''
+Emit a source line and the code assembled from it as a JSON record.
+
+Args:
+    line_parts (list):     The program components of the current line (see 'parse_line()').
+    line       (LineData): The decoded line data.
+    byte_str   (str):      The line's machine code as a hex string, if it is an instruction.
+'''
+def emit_line_record(line_parts, line, byte_str):
+    fields = line_parts
+    address = app_state.prog_count
+    if line.comment_start != -1:
+        # Comment-only line: there is only the comment
+        fields = ["", "", "", line_parts[0]]
+        address = None
+    elif byte_str:
+        address = app_state.prog_count - len(byte_str) // 2
+    elif line.pseudo_op_type == 1:
+        address = None
+    elif line.pseudo_op_type == 3:
+        byte_str = line.pseudo_op_value.hex().upper() if line.pseudo_op_value else to_hex(line.opnd & 0xFF)
+    elif line.pseudo_op_type == 4:
+        byte_str = line.pseudo_op_value.hex().upper() if line.pseudo_op_value else to_hex(line.opnd & 0xFFFF, 4)
+    elif line.pseudo_op_type == 8:
+        byte_str = line.pseudo_op_value.encode("latin-1").hex().upper()
+    elif line.pseudo_op_type == 9:
+        byte_str = "00" * line.opnd
+    elif line.pseudo_op_type in (12, 13, 19):
+        start = address - app_state.chunk["address"]
+        byte_str = app_state.chunk["code"][start:start + line.opnd].hex().upper()
+    emit_json({"type": "line", "file": get_source_file(), "line": line.line_number + 1, "address": address,
+               "bytes": byte_str, "label": fields[0], "op": fields[1], "operand": fields[2], "comment": fields[3]})
+
+
+'''
+Write a record to the JSON output stream as a single line of JSON.
+
+Args:
+    record (dict): The record to write.
+'''
+def emit_json(record):
+    if app_state.variant is not None: record["variant"] = app_state.variant
+    app_state.json_stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+'''
+Get the path of the source file being assembled.
+
+Returns:
+    str: The path, or an empty string if the source did not come from a file.
+'''
+def get_source_file():
+    return app_state.source_files[0] if app_state.source_files else ""
+
+
 '''
 Add new byte values to the machine code storage.
 
@@ -1101,10 +2355,10 @@ def poke(address, value):
     chunk = app_state.chunk
     if address - chunk["address"] > len(chunk["code"]) - 1:
         end_address = address - chunk["address"] - len(chunk["code"])
-        if end_address > 1:
+        if end_address > 0:
             # 'address' is well beyond the end of the list, so insert
             # padding values in the form of a 6809 NOP opcode
-            for _ in range(0, end_address - 1): chunk["code"].append(0x12)
+            for _ in range(0, end_address): chunk["code"].append(0x12)
         # Poke the provided value after the padding
         chunk["code"].append(value)
     elif not chunk["code"]:
@@ -1115,6 +2369,23 @@ def poke(address, value):
         chunk["code"][address - chunk["address"]] = value
 
 
+'''
+Add a run of new byte values to the machine code storage in one operation.
+
+Args:
+    address (int):   A 16-bit address in the store.
+    data    (bytes): The 8-bit values to add to the store.
+'''
+def poke_bytes(address, data):
+    chunk = app_state.chunk
+    start = address - chunk["address"]
+    if start > len(chunk["code"]):
+        # 'address' is beyond the end of the list, so insert
+        # padding values in the form of a 6809 NOP opcode
+        chunk["code"].extend(b"\x12" * (start - len(chunk["code"])))
+    chunk["code"][start:start + len(data)] = data
+
+
 '''
 Display an error message.
 
@@ -1123,6 +2394,13 @@ Args:
     err_line (int): The program on which the error occurred.
 '''
 def error_message(err_code, err_line):
+    if app_state.diagnostics is not None:
+        app_state.diagnostics.append({"line": err_line + 1, "code": err_code,
+                                      "message": ERRORS.get(str(err_code), str(err_code))})
+    if app_state.json_stream is not None:
+        # FROM 1.4.0: Report the error as a JSON record
+        emit_json({"type": "diagnostic", "file": get_source_file(), "line": err_line + 1, "severity": "error",
+                   "code": err_code, "message": ERRORS.get(str(err_code), str(err_code))})
     if 0 < err_code < len(ERRORS):
         # Show standard message
         print("Error on line " + str(err_line + 1) + ": " + ERRORS[str(err_code)])
@@ -1168,6 +2446,7 @@ def disassemble_file(file_spec):
         # And we need to deal with chunks in .6809 files
         with open(file_path, "r") as file: file_data = file.read()
         code_data = json.loads(file_data)
+        for chunk in code_data: chunk["code"] = bytearray.fromhex(chunk["code"])
     else:
         # This is a .rom file, ie. just a binary data dump, so open it and
         # convert to a bytearray
@@ -1183,336 +2462,2143 @@ def disassemble_file(file_spec):
         code_data.append(code_chunk)
 
     if code_data is not None:
-        # Disassemble the supplied set of chunks
-        print("Address       Operation              Bytes          Ascii")
-        print("---------------------------------------------------------")
-
+        # FROM 1.4.0: Source output always covers the whole of every chunk
+        out_file = None
+        if app_state.out_file is not None:
+            out_file = app_state.out_file
+            if out_file == "*": out_file = os.path.splitext(file_path)[0] + ".asm"
+            if os.path.splitext(out_file)[1] not in (".asm", ".asm6809"): out_file = None
+
+        # FROM 1.4.0: Decode the supplied set of chunks into a single instruction
+        # stream, gather the branch and jump targets from it, then print it
+        instructions = []
+        if app_state.base_address == 0 and code_data: app_state.base_address = code_data[0]["address"]
+        if app_state.num_bytes == 0:
+            # Disassemble to the end of the last chunk
+            app_state.num_bytes = max((chunk["address"] + len(chunk["code"]) for chunk in code_data),
+                                      default=app_state.base_address) - app_state.base_address
         for chunk in code_data:
-            loaded_code = chunk["code"]
-            code = bytearray()
-            for i in range(0, len(loaded_code), 2):
-                a_char = loaded_code[i:i+2]
-                a_int = int(a_char, 16)
-                code.extend(a_int.to_bytes(1, byteorder='big', signed=False))
-
-            address = chunk["address"]
-            if app_state.base_address == 0: app_state.base_address = address
-            if app_state.num_bytes == 0: app_state.num_bytes = len(code)
-
-            post_op_bytes = 0
-            pre_op_byte = 0
-            opnd = 0
-            special_opnd = 0
-            index_code = 0
-            address_mode = ADDR_MODE_NONE
-            line_str = ""
-            byte_str = ""
-            str_str = ""
-            index_str = ""
-            got_op = False
-
-            # Run through the machine code byte by byte
-            for next_byte in code:
-                # Only proceed if we're in the required address range
-                if address < app_state.base_address or address > app_state.base_address + app_state.num_bytes:
-                    address += 1
-                    continue
+            instructions.extend(decode_chunk(chunk["code"], chunk["address"], out_file is not None))
 
-                # Assemble the byte string
-                byte_str += "{0:02X}".format(next_byte)
-                str_str += (chr(next_byte) if 31 < next_byte < 128 else "_")
-
-                # Combine the current byte with the previous one, if that
-                # was 0x10 or 0x11 (ie. extended ISA)
-                if pre_op_byte != 0:
-                    next_byte = (pre_op_byte << 8) + next_byte
-                    pre_op_byte = 0
-
-                found = False
-                the_op = ""
-                if got_op is False:
-                    # Look for an op
-                    if next_byte in (0x10, 0x11):
-                        # Extended ISA indicator found, so hold for combination
-                        # with the next loaded byte of code
-                        pre_op_byte = next_byte
-                        address += 1
-                        continue
-
-                    # Run through the main ISA to find the op
-                    for i in range(0, len(ISA), 6):
-                        # Run through each op's possible op codes to find a match
-                        for j in range(i + 1, i + 6):
-                            if ISA[j] == next_byte:
-                                found = True
-                                the_op = ISA[i]
-                                address_mode = j - i
-                                break
-                        if found is True: break
-
-                    if found is False:
-                        # Didn't match the byte in the main ISA, so check for a branch op
-                        for i in range(0, len(BSA), 3):
-                            # Run through each op's possible op codes to find a match
-                            for j in range(i + 1, i + 3):
-                                if BSA[j] == next_byte:
-                                    found = True
-                                    the_op = BSA[i]
-                                    # Correct the name of an extended branch op
-                                    # Add 10 to 'address_mode' to indicate branching
-                                    if j - i == 2: the_op = "L" + the_op
-                                    address_mode = j - i + 10
-                                    break
-                            if found is True: break
-
-                    # If we still haven't matched the op, print a warning and bail
-                    if found is False: print("Bad Op: " + "${0:02X}".format(next_byte))
-
-                    # Set the initial part of the output line
-                    line_str = "${0:04X}".format(address) + "         " + the_op
-                    line_str += set_spacer(8, len(the_op))
-
-                    # Gather the operand bytes (if any) according to addressing mode
-                    if address_mode == ADDR_MODE_INHERENT:
-                        # There's no operand with inherent addressing, so just dump the line
-                        print(line_str + set_spacer(37, len(line_str)) + byte_str)
-                        address += 1
-                        byte_str = ""
-                    elif address_mode == ADDR_MODE_IMMEDIATE:
-                        # Immediate addressing
-                        got_op = True
-                        post_op_bytes = 1
-                        address += 1
-
-                        # Does the immediate postbyte have a special value?
-                        # It will for PSH/PUL and TFR/EXG ops
-                        if the_op[:1] == "P":
-                            special_opnd = 1 if the_op[-1:] == "S" else 2
-                        elif the_op in ("TFR", "EXG"):
-                            special_opnd = 3
-                        else:
-                            # Set the number of operand bytes to gather to the byte-size of the
-                            # named register (eg. two bytes for 16-bit registers
-                            if the_op[-1:] in ("X", "Y", "D", "S", "U"): post_op_bytes = 2
-                            if the_op[-2:] == "PC": post_op_bytes = 2
-
-                            # Add the # symbol it indicate addressing type
-                            line_str += "#$"
-                    elif address_mode in (ADDR_MODE_DIRECT, ADDR_MODE_INDEXED, ADDR_MODE_EXTENDED):
-                        # Indexed, Direct and Extended addressing
-                        got_op = True
-                        post_op_bytes = 1
-                        address += 1
-                        if address_mode == ADDR_MODE_EXTENDED: post_op_bytes += 1
-                        if address_mode == ADDR_MODE_DIRECT: line_str += "<"
-                    elif address_mode > 10:
-                        # Handle branch operation offset bytes
-                        got_op = True
-                        post_op_bytes = 2 if address_mode - 10 == BRANCH_MODE_LONG else 1
-                        address += 1
-                else:
-                    # We are handling the operand bytes having found the op
-                    # Check for the branching operations (short then long) first
-                    if address_mode - 10 == BRANCH_MODE_SHORT:
-                        # 'next_byte' is an 8-bit branch offset
-                        target = 0
-                        if next_byte & 0x80 == 0x80:
-                            # Sign bit set
-                            target = address + 1 - (256 - next_byte)
-                        else:
-                            target = address + 1 + next_byte
-                        line_str += "${0:04X}".format(target)
-                    elif address_mode - 10 == BRANCH_MODE_LONG:
-                        # 'next_byte' is part of a 16-bit branch offset
-                        if post_op_bytes > 0: opnd += (next_byte << (8 * (post_op_bytes - 1)))
-                        if post_op_bytes == 1:
-                            target = 0
-                            if opnd & 0x8000 == 0x8000:
-                                # Sign bit set
-                                target = address + 1 - (65535 - opnd)
-                            else:
-                                target = address + 1 + opnd
-                            line_str += "${0:04X}".format(target)
-                    elif address_mode == ADDR_MODE_IMMEDIATE and special_opnd > 0:
-                        # See above for the meanings of 'special_opnd'
-                        if special_opnd == 1:
-                            line_str += get_puls_pshs_regs(next_byte)
-                        elif special_opnd == 2:
-                            line_str += get_pulu_pshu_regs(next_byte)
-                        else:
-                            line_str += get_tfr_exg_regs(next_byte)
-                        special_opnd = 0
-                    elif address_mode == ADDR_MODE_INDEXED:
-                        # 'index_code' is set according to the first post-op byte
-                        if index_code == 0:
-                            # Check for Indirect Indexed addressing
-                            is_indirect = False
-                            if next_byte & 0x10 == 0x10 and next_byte > 0x80: is_indirect = True
-
-                            # Get the named register from the first post-op byte (bits 5 & 6)
-                            reg = get_indexed_reg(next_byte)
-
-                            # Get the operation code from the first post-op byte (bits 0-4)
-                            code = next_byte & 0x0F
-                            if next_byte < 0x80:
-                                # Pull the 5-bit offset out of the post-op byte (bits 0-4)
-                                index_str = "${0:02X}".format(code) + "," + reg
-                            elif next_byte == 0x9F:
-                                # Extended indirect
-                                post_op_bytes = 2
-                                index_code = 3
-                            else:
-                                if code == 0x04: index_str = "," + reg
-                                if code in (0x08, 0x09): # 8-, 16-bit offset from reg
-                                    index_str = "," + reg
-                                    post_op_bytes += (code - 0x07)
-                                    index_code = code - 0x07
-                                if code == 0x06: index_str = "A," + reg
-                                if code == 0x05: index_str = "B," + reg
-                                if code == 0x0B: index_str = "D," + reg
-                                if code == 0x00: index_str = "," + reg + "+"
-                                if code == 0x01: index_str = "," + reg + "++"
-                                if code == 0x02: index_str = ",-" + reg
-                                if code == 0x03: index_str = ",--" + reg
-                                if code in (0x0C, 0x0D): # Constant offset From PC
-                                    index_str = ",PC"
-                                    post_op_bytes += (code - 0x0B)
-                                    index_code = code - 0x0B
-                            # Wrap the operand string in brackets to indicate indirection
-                            if is_indirect is True: index_str = "[" + index_str + "]"
-                        else:
-                            # Collect the extra byte(s) when 'index_code' is 1 or 2
-                            if post_op_bytes > 0: opnd += (next_byte << (8 * (post_op_bytes - 1)))
-                            if post_op_bytes == 1:
-                                if index_code < 3:
-                                    format_str = "${0:0" + str(index_code * 2) + "X}"
-                                    index_str = format_str.format(opnd) + index_str
-                                else:
-                                    index_str = "${0:04X}".format(opnd)
-                                if is_indirect is True: index_str = "[" + index_str + "]"
-                    else:
-                        # Pick up any other mode (including plain immediate addressing) and output a value
-                        if post_op_bytes > 0: opnd += (next_byte << (8 * (post_op_bytes - 1)))
-                        line_str += "{0:02X}".format(next_byte)
-
-                    # Decrement the operand bytes counter,
-                    # and increase the current memory address
-                    post_op_bytes -= 1
-                    address += 1
-
-                    if post_op_bytes == 0:
-                        # We've got all the operand bytes we need, so output the line
-                        # and zero key variables
-                        line_str += index_str
-                        space_str = set_spacer(37, len(line_str))
-                        print_str = line_str + space_str + byte_str
-                        print(print_str + set_spacer(52, len(print_str)) + str_str)
-                        got_op = False
-                        index_code = 0
-                        opnd = 0
-                        byte_str = ""
-                        str_str = ""
-                        index_str = ""
+        # FROM 1.4.0: Write out re-assemblable source instead, if requested
+        if out_file is not None:
+            write_source_file(out_file, instructions)
+            return
+
+        labels = get_target_labels(instructions)
+        if app_state.json_stream is not None:
+            # FROM 1.4.0: Emit each instruction as a JSON record
+            for instruction in instructions:
+                emit_json({"type": "instruction", "file": os.path.abspath(file_path), "address": instruction["address"],
+                           "bytes": instruction["bytes"].hex().upper(), "label": labels.get(instruction["address"], ""),
+                           "op": instruction["op"], "operand": instruction["opnd"], "target": instruction["target"]})
+            app_state.json_stream.flush()
+            return
+
+        print("Address Label    Operation               Bytes          Ascii")
+        print("--------------------------------------------------------------")
+        for instruction in instructions:
+            print(format_instruction(instruction, labels))
 
 
 '''
-Determing the number of spaces to pad a printed line.
+Decode the instructions within the current disassembly range from a chunk of machine code.
+If the disassembly index is in use, the range is aligned to the instruction which contains
+its first byte.
 
 Args:
-    a_max (int): The length of the padded line.
-    a_min (int): The length of the un-padded line.
+    code    (bytearray): The chunk's machine code.
+    address (int):       The 6809 memory address of the chunk's first byte.
+    whole   (bool):      Whether to decode the whole chunk, ignoring the disassembly range.
 
 Returns:
-    str: A string of spaces to pad the line.
+    list: The decoded instructions, in address order.
 '''
-def set_spacer(a_max, a_min=0):
-    spaces = "                                                         "
-    num = a_max - a_min
-    # If the line is too long, just return a couple of spaces
-    if num < 1: return "  "
-    return spaces[:num]
+def decode_chunk(code, address, whole=False):
+    instructions = []
+    end_address = app_state.base_address + app_state.num_bytes
+    offset = app_state.base_address - address if app_state.base_address > address else 0
+    if whole is True:
+        end_address = address + len(code)
+        offset = 0
+    if app_state.use_index is True and 0 < offset < len(code):
+        # FROM 1.4.0: Start at the instruction which contains the base address
+        index = get_disassembly_index(code, address)
+        offset = index[bisect.bisect_right(index, address + offset) - 1] - address
+    while offset < len(code) and address + offset < end_address:
+        instruction = decode_instruction(code, offset, address + offset)
+        instructions.append(instruction)
+        offset += len(instruction["bytes"])
+    return instructions
 
 
 '''
-Convert a post-op byte value into a register name.
+Get the index of instruction start addresses for a chunk of machine code, loading
+it from the on-disk cache if it has been built before, or building and caching it
+if it hasn't.
 
 Args:
-    post_byte_value (int): The post-op byte value.
+    code    (bytearray): The chunk's machine code.
+    address (int):       The 6809 memory address of the chunk's first byte.
 
 Returns:
-    str: The indicated register.
+    array: The address of every instruction in the chunk, in ascending order.
 '''
-def get_indexed_reg(post_byte_value):
-    post_byte_value = (post_byte_value & 0x60) >> 5
-    regs = ("X", "Y", "U", "S")
-    if post_byte_value < 4: return regs[post_byte_value]
-    return "N/A"
+def get_disassembly_index(code, address):
+    # Key the index on the code, its load address and the index format and decoder version
+    key = hashlib.sha256(bytes(code)).hexdigest() + "_" + to_hex(address, 4) + "_" + str(DISASSEMBLY_INDEX_VERSION)
+    cache_dir = os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache")), "spasm")
+    cache_path = os.path.join(cache_dir, key + ".idx")
+
+    if os.path.exists(cache_path):
+        index = array.array("I")
+        try:
+            with open(cache_path, "rb") as file: index.frombytes(file.read())
+        except (OSError, ValueError):
+            index = None
+        # A truncated or corrupt index is rebuilt: a good one starts at the first byte,
+        # rises steadily and ends with the instruction that takes in the last byte
+        if index and index[0] == address and index[-1] < address + len(code) and \
+            all(index[i] < index[i + 1] for i in range(len(index) - 1)) and \
+            index[-1] + len(decode_instruction(code, index[-1] - address, index[-1])["bytes"]) >= address + len(code):
+            return index
+        show_verbose("Disassembly index " + cache_path + " is damaged and will be rebuilt")
+
+    index = build_disassembly_index(code, address)
+    try:
+        # Write to a temporary file first so a reader never sees a partial index
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + ".tmp", "wb") as file: index.tofile(file)
+        os.replace(cache_path + ".tmp", cache_path)
+    except OSError:
+        show_verbose("Could not write disassembly index to " + cache_path)
+    return index
 
 
 '''
-Generic TFR/EXG operand string generator, converting a post-op byte value
-into disassembled output, eg. "A,B".
+Sweep through a chunk of machine code and record the address of each instruction.
 
 Args:
-    post_byte_value (int): The post-op byte value.
+    code    (bytearray): The chunk's machine code.
+    address (int):       The 6809 memory address of the chunk's first byte.
 
 Returns:
-    str: The register string.
+    array: The address of every instruction in the chunk, in ascending order.
 '''
-def get_tfr_exg_regs(post_byte_value):
-    reg_list = ("D", "X", "Y", "U", "S", "PC", "A", "B", "CC", "DP")
-    from_nibble = (post_byte_value & 0xF0) >> 4
-    to_nibble = post_byte_value & 0x0F
-    from_str = reg_list[from_nibble - 2] if from_nibble > 5 else reg_list[from_nibble]
-    to_str = reg_list[to_nibble - 2] if to_nibble > 5 else reg_list[to_nibble]
-    return from_str + "," + to_str
+def build_disassembly_index(code, address):
+    index = array.array("I")
+    offset = 0
+    while offset < len(code):
+        index.append(address + offset)
+        offset += len(decode_instruction(code, offset, address + offset)["bytes"])
+    return index
 
 
 '''
-Pass on the correct register lists for PSHS or PULS.
+Decode the instruction which occupies the specified address.
 
 Args:
-    post_byte_value (int): The post-op byte value.
+    code    (bytearray): The chunk's machine code.
+    address (int):       The 6809 memory address of the chunk's first byte.
+    index   (array):     The chunk's disassembly index (see 'get_disassembly_index()').
+    target  (int):       The address to look up. It need not be the instruction's first byte.
 
 Returns:
-    str: The list of registers referenced in the operand.
+    dict: The decoded instruction, or None if the address is outside the chunk.
 '''
-def get_puls_pshs_regs(post_byte_value):
-    return get_pul_psh_regs(post_byte_value, ("CC", "A", "B", "DP", "X", "Y", "U", "PC"))
+def instruction_at(code, address, index, target):
+    i = bisect.bisect_right(index, target) - 1
+    if i < 0 or target >= address + len(code): return None
+    return decode_instruction(code, index[i] - address, index[i])
 
 
 '''
-Pass on the correct register lists for PSHU or PULU.
+Decode the instruction which precedes the one occupying the specified address.
 
 Args:
-    post_byte_value (int): The post-op byte value..
+    code    (bytearray): The chunk's machine code.
+    address (int):       The 6809 memory address of the chunk's first byte.
+    index   (array):     The chunk's disassembly index (see 'get_disassembly_index()').
+    target  (int):       The address to look up.
 
 Returns:
-    str: The list of registers referenced in the operand.
+    dict: The decoded instruction, or None if there is no previous instruction.
 '''
-def get_pulu_pshu_regs(post_byte_value):
-    return get_pul_psh_regs(post_byte_value, ("CC", "A", "B", "DP", "X", "Y", "S", "PC"))
+def previous_instruction(code, address, index, target):
+    i = bisect.bisect_right(index, target) - 2
+    if i < 0 or target >= address + len(code): return None
+    return decode_instruction(code, index[i] - address, index[i])
 
 
 '''
-Generic PUL/PSH operand string generator.
+Decode the single instruction that starts at 'offset' within a block of machine code.
 
 Args:
-    post_byte_value (int):  The post-op byte value.
-    reg_list        (list): Names of possible registers.
+    code    (bytearray): The machine code.
+    offset  (int):       The index of the instruction's first byte in 'code'.
+    address (int):       The 6809 memory address of the instruction's first byte.
 
 Returns:
-    str: The list of registers referenced in the operand.
+    dict: The instruction's address, bytes, mnemonic, operand and target address (or None).
+          Bytes that can't be decoded are returned as a single-byte FCB.
 '''
-def get_pul_psh_regs(post_byte_value, reg_tuple):
-    output = ""
-    for i in range(0, 8):
-        if post_byte_value & (2 ** i) > 0:
-            # Bit is set, so add the register to the output string
-            output += (reg_tuple[i] + ",")
-    # Remove the final comma and return the output string, eg. "CC,A,X,Y,PC"
-    if output: output = output[0:len(output) - 1]
-    return output
+def decode_instruction(code, offset, address):
+    start = offset
+    op_value = code[offset]
+    offset += 1
+
+    # Combine the op with the following byte if it is 0x10 or 0x11 (ie. extended ISA)
+    if op_value in (0x10, 0x11) and offset < len(code) and ((op_value << 8) + code[offset]) in OPCODE_TABLE:
+        op_value = (op_value << 8) + code[offset]
+        offset += 1
+
+    if op_value not in OPCODE_TABLE: return data_instruction(code, start, address)
+    the_op, address_mode = OPCODE_TABLE[op_value]
+    opnd_str = ""
+    target = None
+
+    # Gather the operand bytes (if any) according to addressing mode
+    post_op_bytes = 0
+    if address_mode in (ADDR_MODE_IMMEDIATE, ADDR_MODE_DIRECT, ADDR_MODE_INDEXED):
+        post_op_bytes = 1
+        # Set the number of operand bytes to gather to the byte-size of the
+        # named register (eg. two bytes for 16-bit registers)
+        if address_mode == ADDR_MODE_IMMEDIATE and the_op[-1:] in ("X", "Y", "D", "S", "U") \
+            and the_op[:1] != "P": post_op_bytes = 2
+    elif address_mode == ADDR_MODE_EXTENDED or address_mode - 10 == BRANCH_MODE_LONG:
+        post_op_bytes = 2
+    elif address_mode - 10 == BRANCH_MODE_SHORT:
+        post_op_bytes = 1
+    if offset + post_op_bytes > len(code): return data_instruction(code, start, address)
+    opnd = int.from_bytes(code[offset:offset + post_op_bytes], byteorder="big")
+    offset += post_op_bytes
+
+    if address_mode == ADDR_MODE_IMMEDIATE:
+        # Does the immediate postbyte have a special value?
+        # It will for PSH/PUL and TFR/EXG ops
+        if the_op[:1] == "P":
+            opnd_str = get_puls_pshs_regs(opnd) if the_op[-1:] == "S" else get_pulu_pshu_regs(opnd)
+        elif the_op in ("TFR", "EXG"):
+            opnd_str = get_tfr_exg_regs(opnd)
+            if not opnd_str: return data_instruction(code, start, address)
+        else:
+            opnd_str = "#$" + to_hex(opnd, post_op_bytes * 2)
+    elif address_mode == ADDR_MODE_DIRECT:
+        opnd_str = "<$" + to_hex(opnd)
+    elif address_mode == ADDR_MODE_EXTENDED:
+        opnd_str = "$" + to_hex(opnd, 4)
+        target = opnd
+    elif address_mode == ADDR_MODE_INDEXED:
+        opnd_str, extra_bytes = decode_index_post_byte(opnd, code[offset:offset + 2])
+        if opnd_str == "" or offset + extra_bytes > len(code): return data_instruction(code, start, address)
+        offset += extra_bytes
+    elif address_mode > 10:
+        # Convert the branch offset to a target address relative to the next op
+        if address_mode - 10 == BRANCH_MODE_SHORT and opnd & 0x80 == 0x80: opnd -= 0x100
+        if address_mode - 10 == BRANCH_MODE_LONG and opnd & 0x8000 == 0x8000: opnd -= 0x10000
+        target = (address + offset - start + opnd) & 0xFFFF
+        opnd_str = "$" + to_hex(target, 4)
+
+    return {"address": address, "bytes": bytes(code[start:offset]), "op": the_op,
+            "opnd": opnd_str, "target": target}
+
+
+'''
+Package a byte that can't be decoded as an instruction as a single FCB data item.
+
+Args:
+    code    (bytearray): The machine code.
+    offset  (int):       The index of the byte in 'code'.
+    address (int):       The 6809 memory address of the byte.
+
+Returns:
+    dict: The data item in the same form as a decoded instruction.
+'''
+def data_instruction(code, offset, address):
+    return {"address": address, "bytes": bytes(code[offset:offset + 1]), "op": "FCB",
+            "opnd": "$" + to_hex(code[offset]), "target": None}
+
+
+'''
+Decode an indexed addressing post-op byte and any offset bytes which follow it.
+
+Args:
+    post_byte    (int):   The post-op byte value.
+    offset_bytes (bytes): Up to two bytes that follow the post-op byte.
+
+Returns:
+    tuple: The operand string (empty if the post-op byte is invalid) and
+           the number of extra offset bytes consumed.
+'''
+def decode_index_post_byte(post_byte, offset_bytes):
+    # Get the named register from the post-op byte (bits 5 & 6)
+    reg = get_indexed_reg(post_byte)
+    if post_byte < 0x80:
+        # Pull the signed 5-bit offset out of the post-op byte (bits 0-4)
+        return (to_signed_hex(post_byte & 0x1F, 5) + "," + reg, 0)
+
+    # Get the operation code from the post-op byte (bits 0-3)
+    code = post_byte & 0x0F
+    is_indirect = post_byte & 0x10 == 0x10
+    extra_bytes = 0
+    index_str = ""
+    if post_byte == 0x9F:
+        # Extended indirect
+        extra_bytes = 2
+        if len(offset_bytes) < 2: return ("", 0)
+        index_str = "$" + to_hex(int.from_bytes(offset_bytes[:2], byteorder="big"), 4)
+    elif code in (0x08, 0x09, 0x0C, 0x0D):
+        # 8- or 16-bit offset from a register or from the PC
+        extra_bytes = 1 if code in (0x08, 0x0C) else 2
+        if len(offset_bytes) < extra_bytes: return ("", 0)
+        value = int.from_bytes(offset_bytes[:extra_bytes], byteorder="big")
+        index_str = to_signed_hex(value, extra_bytes * 8) + "," + (reg if code < 0x0C else "PC")
+    elif code == 0x04: index_str = "," + reg
+    elif code == 0x06: index_str = "A," + reg
+    elif code == 0x05: index_str = "B," + reg
+    elif code == 0x0B: index_str = "D," + reg
+    elif code == 0x00 and not is_indirect: index_str = "," + reg + "+"
+    elif code == 0x01: index_str = "," + reg + "++"
+    elif code == 0x02 and not is_indirect: index_str = ",-" + reg
+    elif code == 0x03: index_str = ",--" + reg
+    else:
+        return ("", 0)
+
+    # Wrap the operand string in brackets to indicate indirection
+    if is_indirect is True: index_str = "[" + index_str + "]"
+    return (index_str, extra_bytes)
+
+
+'''
+Convert an n-bit two's complement value to a signed, '$'-prefixed hex string, eg. '-$10'.
+
+Args:
+    value (int): The raw value.
+    bits  (int): The value's width in bits.
+
+Returns:
+    str: The signed hex representation.
+'''
+def to_signed_hex(value, bits):
+    if value & (1 << (bits - 1)): return "-$" + to_hex((1 << bits) - value)
+    return "$" + to_hex(value)
+
+
+'''
+Determine which decoded instructions are the targets of branches, jumps or
+extended addressing, and generate a label for each of them.
+
+Args:
+    instructions (list): The decoded instruction stream.
+
+Returns:
+    dict: Generated label names keyed by address.
+'''
+def get_target_labels(instructions):
+    targets = set()
+    for instruction in instructions:
+        if instruction["target"] is not None: targets.add(instruction["target"])
+    labels = {}
+    for instruction in instructions:
+        if instruction["address"] in targets:
+            labels[instruction["address"]] = "L_" + to_hex(instruction["address"], 4)
+    return labels
+
+
+'''
+Format a decoded instruction as a line of disassembly output.
+
+Args:
+    instruction (dict): The decoded instruction.
+    labels      (dict): Generated label names keyed by address.
+
+Returns:
+    str: The output line.
+'''
+def format_instruction(instruction, labels):
+    opnd_str = instruction["opnd"]
+    target = instruction["target"]
+    if target in labels: opnd_str = opnd_str.replace("$" + to_hex(target, 4), labels[target])
+
+    line_str = "$" + to_hex(instruction["address"], 4) + "   "
+    label = labels.get(instruction["address"], "")
+    line_str += label + set_spacer(9, len(label))
+    line_str += instruction["op"] + set_spacer(8, len(instruction["op"])) + opnd_str
+    byte_str = ""
+    str_str = ""
+    for a_byte in instruction["bytes"]:
+        byte_str += to_hex(a_byte)
+        str_str += (chr(a_byte) if 31 < a_byte < 128 else "_")
+    print_str = line_str + set_spacer(41, len(line_str)) + byte_str
+    return print_str + set_spacer(56, len(print_str)) + str_str
+
+
+'''
+Write a decoded instruction stream to a file as spasm source code, having first
+verified that the source reassembles to the original machine code. Any instruction
+that does not reassemble to its original bytes is written as data instead.
+
+Args:
+    file_path    (str):  The path of the output file.
+    instructions (list): The decoded instruction stream.
+'''
+def write_source_file(file_path, instructions):
+    while True:
+        labels = get_target_labels(instructions)
+        lines, line_items = build_source(instructions, labels)
+        failed = verify_source(lines, line_items, instructions)
+        if failed is None:
+            print("[ERROR] Source for " + os.path.abspath(file_path) + " could not be reassembled")
+            return
+        if not failed: break
+
+        # Convert the instructions that failed verification to data, and try again
+        show_verbose(str(len(failed)) + " instruction(s) did not reassemble and will be written as data")
+        new_instructions = []
+        for i, instruction in enumerate(instructions):
+            if i in failed:
+                for j in range(0, len(instruction["bytes"])):
+                    new_instructions.append(data_instruction(instruction["bytes"], j, instruction["address"] + j))
+            else:
+                new_instructions.append(instruction)
+        instructions = new_instructions
+
+    with open(file_path, "w") as file: file.writelines(lines)
+    print("File " + os.path.abspath(file_path) + " written and verified")
+
+
+'''
+Convert a decoded instruction stream into lines of spasm source code.
+
+Args:
+    instructions (list): The decoded instruction stream.
+    labels       (dict): Generated label names keyed by address.
+
+Returns:
+    tuple: The lines of source, and for each line a tuple containing the index of the
+           instruction it holds (or -1 for data, -2 for ORG) and its expected address.
+'''
+def build_source(instructions, labels):
+    lines = []
+    line_items = []
+    next_address = -1
+    i = 0
+    while i < len(instructions):
+        instruction = instructions[i]
+        address = instruction["address"]
+        if address != next_address:
+            # Start a new block of code at the instruction's address
+            lines.append(set_spacer(12) + "ORG     $" + to_hex(address, 4) + "\n")
+            line_items.append((-2, address))
+
+        label = labels.get(address, "")
+        if instruction["op"] == "FCB":
+            # Gather the run of data bytes that follows, up to the next label or gap
+            data = bytearray(instruction["bytes"])
+            i += 1
+            while i < len(instructions) and instructions[i]["op"] == "FCB" \
+                and instructions[i]["address"] == address + len(data) and instructions[i]["address"] not in labels:
+                data += instructions[i]["bytes"]
+                i += 1
+            for data_str, data_len in get_data_lines(data):
+                lines.append(label + set_spacer(12, len(label)) + data_str + "\n")
+                line_items.append((-1, address))
+                address += data_len
+                label = ""
+            next_address = address
+        else:
+            opnd_str = instruction["opnd"]
+            target = instruction["target"]
+            if target in labels: opnd_str = opnd_str.replace("$" + to_hex(target, 4), labels[target])
+            lines.append(label + set_spacer(12, len(label)) + instruction["op"]
+                         + set_spacer(8, len(instruction["op"])) + opnd_str + "\n")
+            line_items.append((i, address))
+            next_address = address + len(instruction["bytes"])
+            i += 1
+    return (lines, line_items)
+
+
+'''
+Convert a run of data bytes into FCC (for printable strings) and FCB directives.
+
+Args:
+    data (bytearray): The data bytes.
+
+Returns:
+    list: Tuples containing each directive and the number of bytes it stores.
+'''
+def get_data_lines(data):
+    data_lines = []
+    byte_strs = []
+    i = 0
+    while i < len(data):
+        # Look for a run of at least four printable characters to store as a string
+        j = i
+        while j < len(data) and 31 < data[j] < 127 and chr(data[j]) not in ('"', ";", "*"): j += 1
+        if j - i > 3:
+            if byte_strs: data_lines.append(("FCB     " + ",".join(byte_strs), len(byte_strs)))
+            byte_strs = []
+            data_lines.append(('FCC     "' + data[i:j].decode("ascii") + '"', j - i))
+            i = j
+            continue
+
+        # Otherwise store bytes individually, up to eight per line
+        byte_strs.append("$" + to_hex(data[i]))
+        if len(byte_strs) == 8:
+            data_lines.append(("FCB     " + ",".join(byte_strs), 8))
+            byte_strs = []
+        i += 1
+    if byte_strs: data_lines.append(("FCB     " + ",".join(byte_strs), len(byte_strs)))
+    return data_lines
+
+
+'''
+Reassemble generated source in memory and compare the result with the instructions
+from which the source was generated: first instruction by instruction, then, when every
+instruction matches, the whole image, including data, byte for byte.
+
+Args:
+    lines        (list): The lines of source.
+    line_items   (list): Each line's instruction index and expected address (see 'build_source()').
+    instructions (list): The decoded instruction stream.
+
+Returns:
+    set: The indices of the instructions which did not reassemble to their original bytes,
+         or None if the source could not be reassembled at all, or its data did not match.
+'''
+def verify_source(lines, line_items, instructions):
+    # Assemble silently: errors are reported as failed instructions
+    error_line, state = assemble_source(lines)
+    code = state.code
+    line_addresses = state.line_addresses
+
+    if error_line != -1:
+        item = line_items[error_line][0]
+        return {item} if item >= 0 else None
+
+    # Map the reassembled chunks, and the original instructions, into 64KB images,
+    # marking which addresses each of them fills
+    image = bytearray(0x10000)
+    filled = bytearray(0x10000)
+    for chunk in code:
+        chunk_code = chunk["code"][:0x10000 - chunk["address"]]
+        image[chunk["address"]:chunk["address"] + len(chunk_code)] = chunk_code
+        filled[chunk["address"]:chunk["address"] + len(chunk_code)] = b"\x01" * len(chunk_code)
+    original_image = bytearray(0x10000)
+    original_filled = bytearray(0x10000)
+    for instruction in instructions:
+        original_bytes = instruction["bytes"][:0x10000 - instruction["address"]]
+        original_image[instruction["address"]:instruction["address"] + len(original_bytes)] = original_bytes
+        original_filled[instruction["address"]:instruction["address"] + len(original_bytes)] = b"\x01" * len(original_bytes)
+
+    failed = set()
+    in_step = True
+    for i, (item, address) in enumerate(line_items):
+        if item == -2:
+            in_step = True
+            continue
+        start = line_addresses[i]
+        if start != address:
+            # The previous line reassembled to the wrong size, so lines in this block
+            # can't be checked until it has been fixed
+            in_step = False
+        if in_step is False or item == -1: continue
+        original = instructions[item]["bytes"]
+        if line_addresses[i + 1] - start != len(original) or image[start:start + len(original)] != original:
+            failed.add(item)
+
+    # Once every instruction has been checked, compare the whole image, data included,
+    # with the original. Data that does not match can't be written any other way
+    if not failed and (image != original_image or filled != original_filled): return None
+    return failed
+
+
+'''
+Build a table mapping every machine code value in the ISA and BSA to its mnemonic
+and addressing mode. Where two mnemonics share a value, the first listed is used.
+
+Returns:
+    dict: (mnemonic, addressing mode) tuples keyed by machine code value.
+'''
+def build_opcode_table():
+    table = {}
+    for i in range(0, len(ISA), 6):
+        for j in range(i + 1, i + 6):
+            if ISA[j] != -1 and ISA[j] not in table: table[ISA[j]] = (ISA[i], j - i)
+    for i in range(0, len(BSA), 3):
+        for j in range(i + 1, i + 3):
+            # Add 10 to the addressing mode to indicate branching, and
+            # correct the name of an extended branch op
+            if BSA[j] not in table: table[BSA[j]] = (BSA[i] if j - i == 1 else "L" + BSA[i], j - i + 10)
+    return table
+
+
+OPCODE_TABLE = build_opcode_table()
+
+
+'''
+FROM 1.4.0: 6809 simulation.
+
+Each machine code value maps to a handler which executes the instruction on a
+CPUState and returns the number of cycles it took. The handlers are built once,
+from the ISA and BSA and their cycle tables, so adding an op to those tables is
+all it takes to simulate it.
+'''
+
+'''
+Read a big-endian 16-bit value from memory.
+
+Args:
+    memory  (bytearray): The 64KB memory image.
+    address (int):       The address of the value's high byte.
+
+Returns:
+    int: The value.
+'''
+def sim_read16(memory, address):
+    return (memory[address] << 8) | memory[(address + 1) & 0xFFFF]
+
+
+'''
+Write a big-endian 16-bit value to memory.
+
+Args:
+    memory  (bytearray): The 64KB memory image.
+    address (int):       The address of the value's high byte.
+    value   (int):       The value.
+'''
+def sim_write16(memory, address, value):
+    memory[address] = value >> 8
+    memory[(address + 1) & 0xFFFF] = value & 0xFF
+
+
+'''
+Get or set a register by name, including D, the concatenation of A and B.
+
+Args:
+    cpu   (CPUState): The simulated CPU.
+    name  (str):      The register's name.
+    value (int):      The register's new value.
+
+Returns:
+    int: The register's value.
+'''
+def sim_get_register(cpu, name):
+    if name == "d": return (cpu.a << 8) | cpu.b
+    return getattr(cpu, name)
+
+
+def sim_set_register(cpu, name, value):
+    if name == "d":
+        cpu.a = value >> 8
+        cpu.b = value & 0xFF
+    else:
+        setattr(cpu, name, value)
+
+
+'''
+Push a 16-bit value on to, or pull one from, the hardware (S) stack.
+
+Args:
+    cpu   (CPUState): The simulated CPU.
+    value (int):      The value to push.
+
+Returns:
+    int: The pulled value.
+'''
+def sim_push16(cpu, value):
+    s = (cpu.s - 2) & 0xFFFF
+    sim_write16(cpu.memory, s, value)
+    cpu.s = s
+
+
+def sim_pull16(cpu):
+    s = cpu.s
+    cpu.s = (s + 2) & 0xFFFF
+    return sim_read16(cpu.memory, s)
+
+
+'''
+Fetch an instruction's operand address, advancing the PC past the operand.
+Indexed addressing records the extra cycles taken by its post-byte in the CPU.
+
+Args:
+    cpu (CPUState): The simulated CPU.
+
+Returns:
+    int: The operand's effective address.
+'''
+def sim_direct(cpu):
+    pc = cpu.pc
+    cpu.pc = (pc + 1) & 0xFFFF
+    return (cpu.dp << 8) | cpu.memory[pc]
+
+
+def sim_extended(cpu):
+    pc = cpu.pc
+    cpu.pc = (pc + 2) & 0xFFFF
+    return sim_read16(cpu.memory, pc)
+
+
+def sim_indexed(cpu):
+    memory = cpu.memory
+    pc = cpu.pc
+    post_byte = memory[pc]
+    pc += 1
+    reg = SIM_INDEX_REGS[(post_byte >> 5) & 0x03]
+    if post_byte & 0x80 == 0:
+        # 5-bit signed offset
+        offset = post_byte & 0x1F
+        cpu.pc = pc & 0xFFFF
+        cpu.extra = INDEXED_OFFSET_CYCLES
+        return (getattr(cpu, reg) + (offset - 0x20 if offset & 0x10 else offset)) & 0xFFFF
+    mode = post_byte & 0x0F
+    base = getattr(cpu, reg)
+    if mode == 0x04:
+        address = base
+    elif mode == 0x00 or mode == 0x01:
+        address = base
+        setattr(cpu, reg, (base + mode + 1) & 0xFFFF)
+    elif mode == 0x02 or mode == 0x03:
+        address = (base - mode + 1) & 0xFFFF
+        setattr(cpu, reg, address)
+    elif mode == 0x05:
+        address = base + (cpu.b - 0x100 if cpu.b & 0x80 else cpu.b)
+    elif mode == 0x06:
+        address = base + (cpu.a - 0x100 if cpu.a & 0x80 else cpu.a)
+    elif mode == 0x08 or mode == 0x0C:
+        offset = memory[pc & 0xFFFF]
+        pc += 1
+        address = (pc if mode == 0x0C else base) + (offset - 0x100 if offset & 0x80 else offset)
+    elif mode == 0x09 or mode == 0x0D:
+        offset = sim_read16(memory, pc & 0xFFFF)
+        pc += 2
+        address = (pc if mode == 0x0D else base) + (offset - 0x10000 if offset & 0x8000 else offset)
+    elif mode == 0x0B:
+        address = base + ((cpu.a << 8) | cpu.b)
+    elif mode == 0x0F:
+        address = sim_read16(memory, pc & 0xFFFF)
+        pc += 2
+    else:
+        cpu.stop = "illegal indexed mode"
+        address = base
+    address &= 0xFFFF
+    extra = INDEXED_CYCLES[mode]
+    if post_byte & 0x10:
+        address = sim_read16(memory, address)
+        extra += INDEXED_INDIRECT_CYCLES
+    cpu.pc = pc & 0xFFFF
+    cpu.extra = extra
+    return address
+
+
+SIM_FETCHERS = {2: sim_direct, 3: sim_indexed, 4: sim_extended}
+
+
+'''
+Build the function which applies an accumulator op -- eg. ADDA, CMPX or LDD --
+to a register and an operand value, setting the condition codes.
+
+Args:
+    kind (str): The op without its register, eg. 'ADD'.
+    reg  (str): The register's name.
+
+Returns:
+    function: The op, which takes the CPU and the operand value.
+'''
+def sim_alu_op(kind, reg):
+    if reg in ("a", "b"):
+        # Loads are the commonest ops, so name the accumulator directly, as that is faster than setattr()
+        if kind == "LD" and reg == "a":
+            def op(cpu, value):
+                cpu.a = value
+                cpu.cc = (cpu.cc & 0xF1) | NZ_FLAGS[value]
+        elif kind == "LD":
+            def op(cpu, value):
+                cpu.b = value
+                cpu.cc = (cpu.cc & 0xF1) | NZ_FLAGS[value]
+        elif kind in ("ADD", "ADC"):
+            with_carry = kind == "ADC"
+            def op(cpu, value):
+                r = getattr(cpu, reg)
+                t = r + value + (cpu.cc & 0x01 if with_carry else 0)
+                result = t & 0xFF
+                cpu.cc = (cpu.cc & 0xD0) | (((r ^ value ^ t) & 0x10) << 1) | NZ_FLAGS[result] | \
+                         (((r ^ t) & (value ^ t) & 0x80) >> 6) | (t >> 8)
+                setattr(cpu, reg, result)
+        elif kind in ("SUB", "SBC", "CMP"):
+            with_carry = kind == "SBC"
+            keep = kind != "CMP"
+            def op(cpu, value):
+                r = getattr(cpu, reg)
+                t = r - value - (cpu.cc & 0x01 if with_carry else 0)
+                result = t & 0xFF
+                cpu.cc = (cpu.cc & 0xF0) | NZ_FLAGS[result] | (((r ^ value) & (r ^ t) & 0x80) >> 6) | (1 if t < 0 else 0)
+                if keep: setattr(cpu, reg, result)
+        else:
+            logic = {"AND": int.__and__, "BIT": int.__and__, "OR": int.__or__, "EOR": int.__xor__}[kind]
+            keep = kind != "BIT"
+            def op(cpu, value):
+                result = logic(getattr(cpu, reg), value)
+                cpu.cc = (cpu.cc & 0xF1) | NZ_FLAGS[result]
+                if keep: setattr(cpu, reg, result)
+    else:
+        if kind == "LD":
+            def op(cpu, value):
+                sim_set_register(cpu, reg, value)
+                cpu.cc = (cpu.cc & 0xF1) | ((value >> 12) & 0x08) | (0 if value else 0x04)
+        elif kind == "ADD":
+            def op(cpu, value):
+                r = sim_get_register(cpu, reg)
+                t = r + value
+                result = t & 0xFFFF
+                cpu.cc = (cpu.cc & 0xF0) | ((result >> 12) & 0x08) | (0 if result else 0x04) | \
+                         (((r ^ t) & (value ^ t) & 0x8000) >> 14) | (t >> 16)
+                sim_set_register(cpu, reg, result)
+        else:
+            keep = kind != "CMP"
+            def op(cpu, value):
+                r = sim_get_register(cpu, reg)
+                t = r - value
+                result = t & 0xFFFF
+                cpu.cc = (cpu.cc & 0xF0) | ((result >> 12) & 0x08) | (0 if result else 0x04) | \
+                         (((r ^ value) & (r ^ t) & 0x8000) >> 14) | (1 if t < 0 else 0)
+                if keep: sim_set_register(cpu, reg, result)
+    return op
+
+
+'''
+Build the function which applies a read-modify-write op -- eg. NEG or ROL -- to
+a value, setting the condition codes.
+
+Args:
+    kind (str): The op without any register, eg. 'NEG'.
+
+Returns:
+    function: The op, which takes the CPU and the value, and returns the new value.
+'''
+def sim_modify_op(kind):
+    if kind == "NEG":
+        def op(cpu, value):
+            result = -value & 0xFF
+            cpu.cc = (cpu.cc & 0xF0) | NZ_FLAGS[result] | (0x02 if value == 0x80 else 0) | (1 if value else 0)
+            return result
+    elif kind == "COM":
+        def op(cpu, value):
+            result = value ^ 0xFF
+            cpu.cc = (cpu.cc & 0xF0) | NZ_FLAGS[result] | 0x01
+            return result
+    elif kind in ("LSR", "ROR", "ASR"):
+        def op(cpu, value):
+            if kind == "LSR":
+                result = value >> 1
+            elif kind == "ROR":
+                result = (value >> 1) | ((cpu.cc & 0x01) << 7)
+            else:
+                result = (value >> 1) | (value & 0x80)
+            cpu.cc = (cpu.cc & 0xF2) | NZ_FLAGS[result] | (value & 0x01)
+            return result
+    elif kind in ("ASL", "LSL", "ROL"):
+        with_carry = kind == "ROL"
+        def op(cpu, value):
+            result = ((value << 1) | (cpu.cc & 0x01 if with_carry else 0)) & 0xFF
+            cpu.cc = (cpu.cc & 0xF0) | NZ_FLAGS[result] | (((value ^ (value << 1)) & 0x80) >> 6) | (value >> 7)
+            return result
+    elif kind in ("DEC", "INC"):
+        step, overflow = (-1, 0x80) if kind == "DEC" else (1, 0x7F)
+        def op(cpu, value):
+            result = (value + step) & 0xFF
+            cpu.cc = (cpu.cc & 0xF1) | NZ_FLAGS[result] | (0x02 if value == overflow else 0)
+            return result
+    elif kind == "TST":
+        def op(cpu, value):
+            cpu.cc = (cpu.cc & 0xF1) | NZ_FLAGS[value]
+            return value
+    else:
+        def op(cpu, value):
+            cpu.cc = (cpu.cc & 0xF0) | 0x04
+            return 0
+    return op
+
+
+'''
+Build the handler which executes an op that reads an operand value, with the
+specified addressing mode.
+
+Args:
+    op     (function): The op, which takes the CPU and the operand value.
+    mode   (int):      The addressing mode, as an index into an ISA record.
+    cycles (int):      The op's base cycle count.
+    wide   (bool):     Whether the operand is a 16-bit value.
+
+Returns:
+    function: The handler.
+'''
+def sim_read_handler(op, mode, cycles, wide):
+    read = sim_read16 if wide else bytearray.__getitem__
+    if mode == 1 and not wide:
+        def execute(cpu):
+            pc = cpu.pc
+            cpu.pc = (pc + 1) & 0xFFFF
+            op(cpu, cpu.memory[pc])
+            return cycles
+    elif mode == 1:
+        def execute(cpu):
+            pc = cpu.pc
+            cpu.pc = (pc + 2) & 0xFFFF
+            op(cpu, sim_read16(cpu.memory, pc))
+            return cycles
+    elif mode == 3:
+        def execute(cpu):
+            address = sim_indexed(cpu)
+            op(cpu, read(cpu.memory, address))
+            return cycles + cpu.extra
+    else:
+        fetch = SIM_FETCHERS[mode]
+        def execute(cpu):
+            op(cpu, read(cpu.memory, fetch(cpu)))
+            return cycles
+    return execute
+
+
+'''
+Build the handler which executes a store op, eg. STA or STX.
+
+Args:
+    reg    (str): The stored register's name.
+    mode   (int): The addressing mode, as an index into an ISA record.
+    cycles (int): The op's base cycle count.
+
+Returns:
+    function: The handler.
+'''
+def sim_store_handler(reg, mode, cycles):
+    fetch = SIM_FETCHERS[mode]
+    extra = mode == 3
+    if reg in ("a", "b"):
+        def execute(cpu):
+            address = fetch(cpu)
+            value = getattr(cpu, reg)
+            cpu.memory[address] = value
+            cpu.cc = (cpu.cc & 0xF1) | NZ_FLAGS[value]
+            return cycles + cpu.extra if extra else cycles
+    else:
+        def execute(cpu):
+            address = fetch(cpu)
+            value = sim_get_register(cpu, reg)
+            sim_write16(cpu.memory, address, value)
+            cpu.cc = (cpu.cc & 0xF1) | ((value >> 12) & 0x08) | (0 if value else 0x04)
+            return cycles + cpu.extra if extra else cycles
+    return execute
+
+
+'''
+Build the handler which executes a read-modify-write op, on memory or, with
+inherent addressing, on an accumulator.
+
+Args:
+    op     (function): The op, which takes the CPU and a value and returns the new value.
+    mode   (int):      The addressing mode, as an index into an ISA record.
+    cycles (int):      The op's base cycle count.
+    reg    (str):      The accumulator's name, for inherent addressing.
+
+Returns:
+    function: The handler.
+'''
+def sim_modify_handler(op, mode, cycles, reg=None):
+    if mode == 5:
+        # Name the accumulator directly, as that is faster than getattr() and setattr()
+        if reg == "a":
+            def execute(cpu):
+                cpu.a = op(cpu, cpu.a)
+                return cycles
+        else:
+            def execute(cpu):
+                cpu.b = op(cpu, cpu.b)
+                return cycles
+    else:
+        fetch = SIM_FETCHERS[mode]
+        extra = mode == 3
+        def execute(cpu):
+            address = fetch(cpu)
+            cpu.memory[address] = op(cpu, cpu.memory[address])
+            return cycles + cpu.extra if extra else cycles
+    return execute
+
+
+'''
+Build the handler which executes an op that uses its operand's address rather
+than its value: JMP, JSR or LEA.
+
+Args:
+    op     (function): The op, which takes the CPU and the address.
+    mode   (int):      The addressing mode, as an index into an ISA record.
+    cycles (int):      The op's base cycle count.
+
+Returns:
+    function: The handler.
+'''
+def sim_address_handler(op, mode, cycles):
+    fetch = SIM_FETCHERS[mode]
+    extra = mode == 3
+    def execute(cpu):
+        op(cpu, fetch(cpu))
+        return cycles + cpu.extra if extra else cycles
+    return execute
+
+
+def sim_jmp(cpu, address):
+    cpu.pc = address
+
+
+def sim_jsr(cpu, address):
+    sim_push16(cpu, cpu.pc)
+    cpu.depth += 1
+    cpu.pc = address
+
+
+def sim_lea_op(reg):
+    def op(cpu, address):
+        setattr(cpu, reg, address)
+        if reg in ("x", "y"): cpu.cc = (cpu.cc & 0xFB) | (0 if address else 0x04)
+    return op
+
+
+'''
+Build the handler which executes an op that takes a post-byte -- eg. TFR or
+PSHS -- or no operand at all.
+
+Args:
+    op     (function): The op, which takes the CPU and any post-byte, and returns
+                       any extra cycles it took.
+    cycles (int):      The op's base cycle count.
+
+Returns:
+    function: The handler.
+'''
+def sim_post_byte_handler(op, cycles):
+    def execute(cpu):
+        pc = cpu.pc
+        cpu.pc = (pc + 1) & 0xFFFF
+        return cycles + op(cpu, cpu.memory[pc])
+    return execute
+
+
+def sim_inherent_handler(op, cycles):
+    def execute(cpu):
+        return cycles + op(cpu)
+    return execute
+
+
+'''
+The ops which take a post-byte. Each returns the number of extra cycles it took.
+'''
+def sim_andcc(cpu, post_byte):
+    cpu.cc &= post_byte
+    return 0
+
+
+def sim_orcc(cpu, post_byte):
+    cpu.cc |= post_byte
+    return 0
+
+
+def sim_cwai(cpu, post_byte):
+    cpu.cc = (cpu.cc & post_byte) | 0x80
+    cpu.stop = "CWAI"
+    return 0
+
+
+def sim_get_tfr_register(cpu, code):
+    name = SIM_TFR_REGS[code]
+    if name is None: return 0xFFFF
+    # 8-bit registers read as 16-bit values have a high byte of 0xFF
+    return getattr(cpu, name) | 0xFF00 if code > 7 else sim_get_register(cpu, name)
+
+
+def sim_set_tfr_register(cpu, code, value):
+    name = SIM_TFR_REGS[code]
+    if name is None: return
+    if code > 7:
+        setattr(cpu, name, value & 0xFF)
+    else:
+        sim_set_register(cpu, name, value)
+
+
+def sim_tfr(cpu, post_byte):
+    sim_set_tfr_register(cpu, post_byte & 0x0F, sim_get_tfr_register(cpu, post_byte >> 4))
+    return 0
+
+
+def sim_exg(cpu, post_byte):
+    first = sim_get_tfr_register(cpu, post_byte >> 4)
+    second = sim_get_tfr_register(cpu, post_byte & 0x0F)
+    sim_set_tfr_register(cpu, post_byte >> 4, second)
+    sim_set_tfr_register(cpu, post_byte & 0x0F, first)
+    return 0
+
+
+def sim_push_op(stack):
+    other = "u" if stack == "s" else "s"
+    def op(cpu, post_byte):
+        memory = cpu.memory
+        sp = getattr(cpu, stack)
+        count = 0
+        for bit, name, size in SIM_PUSH_ORDER:
+            if post_byte & bit:
+                value = getattr(cpu, name or other)
+                sp = (sp - 1) & 0xFFFF
+                memory[sp] = value & 0xFF
+                if size == 2:
+                    sp = (sp - 1) & 0xFFFF
+                    memory[sp] = value >> 8
+                count += size
+        setattr(cpu, stack, sp)
+        return count
+    return op
+
+
+def sim_pull_op(stack):
+    other = "u" if stack == "s" else "s"
+    def op(cpu, post_byte):
+        memory = cpu.memory
+        sp = getattr(cpu, stack)
+        count = 0
+        for bit, name, size in reversed(SIM_PUSH_ORDER):
+            if post_byte & bit:
+                if name == "pc" and stack == "s":
+                    # PULS PC returns from a subroutine, or ends the run
+                    if cpu.depth == 0:
+                        cpu.stop = "PULS PC"
+                        break
+                    cpu.depth -= 1
+                if size == 2:
+                    value = sim_read16(memory, sp)
+                    sp = (sp + 2) & 0xFFFF
+                else:
+                    value = memory[sp]
+                    sp = (sp + 1) & 0xFFFF
+                setattr(cpu, name or other, value)
+                count += size
+        setattr(cpu, stack, sp)
+        return count
+    return op
+
+
+'''
+The ops which take no operand. Each returns the number of extra cycles it took.
+'''
+def sim_abx(cpu):
+    cpu.x = (cpu.x + cpu.b) & 0xFFFF
+    return 0
+
+
+def sim_daa(cpu):
+    a = cpu.a
+    cc = cpu.cc
+    correction = 0
+    if cc & 0x20 or a & 0x0F > 9: correction = 0x06
+    if cc & 0x01 or a > 0x99 or (a > 0x8F and a & 0x0F > 9): correction |= 0x60
+    t = a + correction
+    cpu.a = t & 0xFF
+    cpu.cc = (cc & 0xF1) | NZ_FLAGS[cpu.a] | (1 if t > 0xFF else 0)
+    return 0
+
+
+def sim_mul(cpu):
+    value = cpu.a * cpu.b
+    cpu.a = value >> 8
+    cpu.b = value & 0xFF
+    cpu.cc = (cpu.cc & 0xFA) | (0 if value else 0x04) | ((value >> 7) & 0x01)
+    return 0
+
+
+def sim_nop(cpu):
+    return 0
+
+
+def sim_sex(cpu):
+    cpu.a = 0xFF if cpu.b & 0x80 else 0
+    cpu.cc = (cpu.cc & 0xF3) | NZ_FLAGS[cpu.b]
+    return 0
+
+
+def sim_rts(cpu):
+    # A return from the routine the run started with ends the run
+    if cpu.depth == 0:
+        cpu.stop = "RTS"
+    else:
+        cpu.depth -= 1
+        cpu.pc = sim_pull16(cpu)
+    return 0
+
+
+def sim_rti(cpu):
+    memory = cpu.memory
+    cpu.cc = memory[cpu.s]
+    cpu.s = (cpu.s + 1) & 0xFFFF
+    extra = 0
+    if cpu.cc & 0x80:
+        # The entire state was stacked
+        for name in ("a", "b", "dp"):
+            setattr(cpu, name, memory[cpu.s])
+            cpu.s = (cpu.s + 1) & 0xFFFF
+        for name in ("x", "y", "u"):
+            setattr(cpu, name, sim_pull16(cpu))
+        extra = 9
+    cpu.pc = sim_pull16(cpu)
+    return extra
+
+
+def sim_stop_op(reason):
+    def op(cpu):
+        cpu.stop = reason
+        return 0
+    return op
+
+
+def sim_illegal(cpu):
+    cpu.stop = "illegal opcode"
+    return 0
+
+
+'''
+Build the handler which executes a branch.
+
+Args:
+    name   (str): The branch's mnemonic, without any long-branch 'L' prefix.
+    long   (bool): Whether the branch takes a 16-bit offset.
+    cycles (int): The branch's base cycle count.
+
+Returns:
+    function: The handler.
+'''
+def sim_branch_handler(name, long, cycles):
+    condition = SIM_BRANCH_CONDITIONS.get(name)
+    is_call = name == "BSR"
+    # A long conditional branch takes an extra cycle when the branch is taken
+    taken_cycles = cycles + (LONG_BRANCH_TAKEN_CYCLES if long and condition is not None else 0)
+    if not long and condition is not None:
+        # The most common branch, so it has a handler of its own
+        def execute(cpu):
+            pc = cpu.pc
+            offset = cpu.memory[pc]
+            pc = (pc + 1) & 0xFFFF
+            cpu.pc = (pc + offset - ((offset & 0x80) << 1)) & 0xFFFF if condition(cpu.cc) else pc
+            return cycles
+        return execute
+    def execute(cpu):
+        pc = cpu.pc
+        if long:
+            offset = sim_read16(cpu.memory, pc)
+            pc += 2
+            offset = offset - 0x10000 if offset & 0x8000 else offset
+        else:
+            offset = cpu.memory[pc]
+            pc += 1
+            offset = offset - 0x100 if offset & 0x80 else offset
+        pc &= 0xFFFF
+        if condition is not None and not condition(cpu.cc):
+            cpu.pc = pc
+            return cycles
+        if is_call:
+            sim_push16(cpu, pc)
+            cpu.depth += 1
+        cpu.pc = (pc + offset) & 0xFFFF
+        return taken_cycles
+    return execute
+
+
+# Branch conditions, keyed by mnemonic: BRA and BSR always branch
+SIM_BRANCH_CONDITIONS = {
+    "BHI": lambda cc: cc & 0x05 == 0,
+    "BLS": lambda cc: cc & 0x05 != 0,
+    "BCC": lambda cc: cc & 0x01 == 0,
+    "BHS": lambda cc: cc & 0x01 == 0,
+    "BLO": lambda cc: cc & 0x01 != 0,
+    "BCS": lambda cc: cc & 0x01 != 0,
+    "BNE": lambda cc: cc & 0x04 == 0,
+    "BEQ": lambda cc: cc & 0x04 != 0,
+    "BVC": lambda cc: cc & 0x02 == 0,
+    "BVS": lambda cc: cc & 0x02 != 0,
+    "BPL": lambda cc: cc & 0x08 == 0,
+    "BMI": lambda cc: cc & 0x08 != 0,
+    "BGE": lambda cc: ((cc >> 3) ^ (cc >> 1)) & 0x01 == 0,
+    "BLT": lambda cc: ((cc >> 3) ^ (cc >> 1)) & 0x01 != 0,
+    "BGT": lambda cc: cc & 0x04 == 0 and ((cc >> 3) ^ (cc >> 1)) & 0x01 == 0,
+    "BLE": lambda cc: cc & 0x04 != 0 or ((cc >> 3) ^ (cc >> 1)) & 0x01 != 0
+}
+
+SIM_MODIFY_OPS = ("NEG", "COM", "LSR", "ROR", "ASR", "ASL", "LSL", "ROL", "DEC", "INC", "TST", "CLR")
+SIM_ALU_OPS = ("ADC", "ADD", "AND", "BIT", "CMP", "EOR", "LD", "OR", "SBC", "SUB")
+SIM_POST_BYTE_OPS = {"ANDCC": sim_andcc, "ORCC": sim_orcc, "CWAIT": sim_cwai, "TFR": sim_tfr, "EXG": sim_exg,
+                     "PSHS": sim_push_op("s"), "PSHU": sim_push_op("u"),
+                     "PULS": sim_pull_op("s"), "PULU": sim_pull_op("u")}
+SIM_INHERENT_OPS = {"ABX": sim_abx, "DAA": sim_daa, "MUL": sim_mul, "NOP": sim_nop, "SEX": sim_sex,
+                    "RTS": sim_rts, "RTI": sim_rti, "SYNC": sim_stop_op("SYNC"),
+                    "SWI": sim_stop_op("SWI"), "SWI2": sim_stop_op("SWI2"), "SWI3": sim_stop_op("SWI3")}
+
+
+'''
+Build the handler for an op in the ISA or BSA.
+
+Args:
+    name (str): The op's mnemonic.
+    mode (int): The op's addressing mode, as set by build_opcode_table().
+
+Returns:
+    function: The handler, or None if the op can't be simulated.
+'''
+def get_sim_handler(name, mode):
+    if mode > 10:
+        # A branch -- remove the long-branch prefix to get the BSA's name
+        long = mode == 12
+        if long: name = name[1:]
+        return sim_branch_handler(name, long, BRANCH_CYCLE_RECORDS[name][mode - 10])
+
+    cycles = CYCLE_RECORDS[name][mode]
+    kind, reg = name[:-1], name[-1].lower()
+    if name in SIM_INHERENT_OPS: return sim_inherent_handler(SIM_INHERENT_OPS[name], cycles)
+    if name in SIM_POST_BYTE_OPS: return sim_post_byte_handler(SIM_POST_BYTE_OPS[name], cycles)
+    if name == "JMP": return sim_address_handler(sim_jmp, mode, cycles)
+    if name == "JSR": return sim_address_handler(sim_jsr, mode, cycles)
+    if kind == "LEA": return sim_address_handler(sim_lea_op(reg), mode, cycles)
+    if name in SIM_MODIFY_OPS: return sim_modify_handler(sim_modify_op(name), mode, cycles)
+    if kind in SIM_MODIFY_OPS: return sim_modify_handler(sim_modify_op(kind), mode, cycles, reg)
+    if kind == "ST": return sim_store_handler(reg, mode, cycles)
+    if kind in SIM_ALU_OPS: return sim_read_handler(sim_alu_op(kind, reg), mode, cycles, reg not in ("a", "b"))
+    return None
+
+
+'''
+Build the simulator's dispatch table: a handler for every first byte of an
+instruction. The 0x10 and 0x11 page prefixes dispatch to second-level tables.
+
+Returns:
+    list: The handlers, indexed by machine code value.
+'''
+def build_sim_table():
+    pages = {0x00: [sim_illegal] * 256, 0x10: [sim_illegal] * 256, 0x11: [sim_illegal] * 256}
+    for opcode, (name, mode) in OPCODE_TABLE.items():
+        handler = get_sim_handler(name, mode)
+        if handler is not None: pages[opcode >> 8][opcode & 0xFF] = handler
+    table = pages[0x00]
+    for prefix in (0x10, 0x11):
+        table[prefix] = sim_page_handler(pages[prefix])
+    return table
+
+
+'''
+Build the handler for a page prefix, 0x10 or 0x11, which executes the op given
+by the byte after the prefix.
+
+Args:
+    page (list): The page's handlers, indexed by the op's second byte.
+
+Returns:
+    function: The handler.
+'''
+def sim_page_handler(page):
+    def execute(cpu):
+        pc = cpu.pc
+        cpu.pc = (pc + 1) & 0xFFFF
+        return page[cpu.memory[pc]](cpu)
+    return execute
+
+
+SIM_TABLE = build_sim_table()
+
+
+'''
+Run a program on the simulated 6809, counting cycles. The run ends when the
+program executes SWI, SWI2, SWI3, SYNC or CWAI, returns from the routine at the
+entry point (RTS or PULS PC), hits an illegal opcode, or uses up its cycle budget.
+The instruction which ends the run is counted.
+
+Counting the times each address is executed slows the run, so it is only done
+when a profile is requested.
+
+Args:
+    memory     (bytearray): The 64KB memory image holding the program. The run may change it.
+    entry      (int):       The address at which to start the run.
+    max_cycles (int):       The cycle budget.
+    cpu        (CPUState):  A CPU with preset registers, if required.
+    profile    (bool):      Whether to count the times each address and op is executed.
+
+Returns:
+    dict: The run's report: why and where it stopped, its cycle and instruction
+          counts, the final registers and, for a profile, the number of times each
+          address and each op was executed.
+'''
+def run_program(memory, entry, max_cycles=SIM_MAX_CYCLES, cpu=None, profile=True):
+    if cpu is None: cpu = CPUState(memory)
+    cpu.memory = memory
+    cpu.pc = entry
+    cpu.stop = None
+    table = SIM_TABLE
+    hits = [0] * 0x10000 if profile else None
+    cycles = 0
+    count = 0
+    pc = entry
+    # A 'for' loop counts the instructions faster than adding to a count
+    if max_cycles > 0 and profile:
+        for count in range(1, SIM_MAX_STEPS):
+            pc = cpu.pc
+            hits[pc] += 1
+            cpu.pc = (pc + 1) & 0xFFFF
+            cycles += table[memory[pc]](cpu)
+            if cpu.stop is not None or cycles >= max_cycles: break
+    elif max_cycles > 0:
+        for count in range(1, SIM_MAX_STEPS):
+            pc = cpu.pc
+            cpu.pc = (pc + 1) & 0xFFFF
+            cycles += table[memory[pc]](cpu)
+            if cpu.stop is not None or cycles >= max_cycles: break
+    if cpu.stop is None:
+        cpu.stop = "cycle budget"
+    else:
+        # Report the address of the instruction which stopped the run
+        cpu.pc = pc
+
+    report = {"entry": entry, "stop": cpu.stop, "address": cpu.pc, "cycles": cycles, "instructions": count,
+              "registers": {"a": cpu.a, "b": cpu.b, "x": cpu.x, "y": cpu.y, "u": cpu.u,
+                            "s": cpu.s, "dp": cpu.dp, "cc": cpu.cc}}
+    if profile:
+        address_hits = {address: times for address, times in enumerate(hits) if times}
+        op_counts = {}
+        for address, times in address_hits.items():
+            opcode = memory[address]
+            if opcode in (0x10, 0x11): opcode = (opcode << 8) | memory[(address + 1) & 0xFFFF]
+            name = OPCODE_TABLE.get(opcode, ("???", 0))[0]
+            op_counts[name] = op_counts.get(name, 0) + times
+        report["hits"] = address_hits
+        report["ops"] = op_counts
+    return report
+
+
+'''
+Get the address specified on the command line as a label or a value.
+
+Args:
+    text (str): The label or value.
+
+Returns:
+    int: The address, or None if the text is neither a label nor a value.
+'''
+def get_address_of(text):
+    address = str_to_int(text)
+    if address is not False: return address
+    index = index_of_label(text)
+    if index == -1 or app_state.labels[index]["addr"] == "!!!!": return None
+    return app_state.labels[index]["addr"]
+
+
+'''
+Get a 64KB memory image holding the assembled code.
+
+Returns:
+    bytearray: The memory image.
+'''
+def get_memory_image():
+    memory = bytearray(0x10000)
+    for chunk in app_state.code:
+        address = chunk["address"]
+        code_bytes = chunk["code"][:0x10000 - address]
+        memory[address:address + len(code_bytes)] = code_bytes
+    return memory
+
+
+'''
+Run the assembled program on the simulated 6809, from the entry point set by
+--run, and output the run's report.
+'''
+def run_assembled_code():
+    entry = get_address_of(app_state.run_entry)
+    if entry is None:
+        print("[ERROR] --run entry point " + app_state.run_entry + " is not a label or an address")
+        return
+
+    report = run_program(get_memory_image(), entry, app_state.run_cycles or SIM_MAX_CYCLES,
+                         profile=app_state.run_profile)
+
+    if app_state.json_stream is not None:
+        record = dict(report)
+        record["type"] = "run"
+        record["file"] = get_source_file()
+        if "hits" in report:
+            record["hits"] = [{"address": address, "count": count} for address, count in sorted(report["hits"].items())]
+        emit_json(record)
+        return
+
+    # Name the hit addresses which have labels
+    names = {}
+    for label in app_state.labels:
+        if isinstance(label["addr"], int) and label.get("kind", SYMBOL_KIND_ADDRESS) == SYMBOL_KIND_ADDRESS:
+            names.setdefault(label["addr"], label["name"])
+    registers = report["registers"]
+    print("\nSimulation from 0x{0:04X}".format(entry))
+    print("----------------------------------------")
+    print("Stopped by " + report["stop"] + " at 0x{0:04X}".format(report["address"]))
+    print("Cycles:       " + str(report["cycles"]))
+    print("Instructions: " + str(report["instructions"]))
+    print("Registers:    A=0x{0:02X} B=0x{1:02X} X=0x{2:04X} Y=0x{3:04X} U=0x{4:04X} S=0x{5:04X} DP=0x{6:02X} CC=0x{7:02X}".format(
+          registers["a"], registers["b"], registers["x"], registers["y"], registers["u"], registers["s"],
+          registers["dp"], registers["cc"]))
+    if "hits" not in report: return
+    print("\nOp        Count")
+    for name, count in sorted(report["ops"].items(), key=lambda item: (-item[1], item[0])):
+        print(name + set_spacer(10, len(name)) + str(count))
+    print("\nAddress   Count")
+    for address, count in sorted(report["hits"].items()):
+        count_str = str(count)
+        print(("0x{0:04X}    ".format(address) + count_str + set_spacer(10, len(count_str)) + names.get(address, "")).rstrip())
+
+
+'''
+FROM 1.4.0: Static analysis of the assembled code's routines.
+
+Each routine's instructions are split into basic blocks, which form a control-flow
+graph. Each block's edges carry the cycles taken by the block when it is left by
+that edge. Loops are found from the graph's back edges and are collapsed, innermost
+first, into single nodes whose cycle counts are scaled by the loops' bounds. The
+worst-case cycle count is then the longest path through what remains. Each block
+is collapsed into a loop node once, and flow into another routine takes that routine's
+results rather than walking its code again, so the work is linear in the size of the code.
+'''
+
+'''
+Decode the instruction at the specified address for analysis.
+
+Args:
+    memory  (bytearray): The 64KB memory image.
+    address (int):       The instruction's address.
+
+Returns:
+    dict: The instruction's size, cycles, any extra cycles taken when it branches,
+          control-flow kind, any target address, and its effect on the S stack.
+'''
+def get_op_info(memory, address):
+    opcode = memory[address]
+    size = 1
+    if opcode in (0x10, 0x11):
+        opcode = (opcode << 8) | memory[(address + 1) & 0xFFFF]
+        size = 2
+    if opcode not in OPCODE_TABLE:
+        return {"name": "???", "size": size, "cycles": 0, "taken": 0, "kind": "illegal", "target": None,
+                "stack": 0, "sets_s": False}
+    name, mode = OPCODE_TABLE[opcode]
+    info = {"name": name, "size": size, "taken": 0, "kind": "step", "target": None, "stack": 0, "sets_s": False}
+    operand = (address + size) & 0xFFFF
+
+    if mode > 10:
+        # A branch: get its target from its signed offset
+        long = mode == 12
+        branch = name[1:] if long else name
+        info["cycles"] = BRANCH_CYCLE_RECORDS[branch][mode - 10]
+        if long:
+            offset = sim_read16(memory, operand)
+            info["size"] += 2
+            offset = offset - 0x10000 if offset & 0x8000 else offset
+        else:
+            offset = memory[operand]
+            info["size"] += 1
+            offset = offset - 0x100 if offset & 0x80 else offset
+        info["target"] = (address + info["size"] + offset) & 0xFFFF
+        if branch == "BSR":
+            info["kind"] = "call"
+        elif branch == "BRA":
+            info["kind"] = "jump"
+        else:
+            info["kind"] = "branch"
+            if long: info["taken"] = LONG_BRANCH_TAKEN_CYCLES
+        return info
+
+    info["cycles"] = CYCLE_RECORDS[name][mode]
+    post_byte = memory[operand]
+    if mode == 1:
+        # Ops with 16-bit immediate operands end in the name of a 16-bit register,
+        # unlike the post-byte ops PSHS and PULS
+        info["size"] += 2 if name[-1] in ("D", "X", "Y", "S", "U") and name[0] != "P" else 1
+        if name[:3] in ("PSH", "PUL"):
+            count = sum(size for bit, _, size in SIM_PUSH_ORDER if post_byte & bit)
+            info["cycles"] += count
+            if name[-1] == "S":
+                info["stack"] = count if name[:3] == "PSH" else -count
+                if name == "PULS" and post_byte & 0x80: info["kind"] = "return"
+            elif name == "PULU":
+                if post_byte & 0x80: info["kind"] = "indirect"
+                if post_byte & 0x40: info["sets_s"] = True
+        elif name in ("TFR", "EXG"):
+            # Code 4 is S and code 5 is PC
+            codes = (post_byte & 0x0F,) if name == "TFR" else (post_byte >> 4, post_byte & 0x0F)
+            if 4 in codes: info["sets_s"] = True
+            if 5 in codes: info["kind"] = "indirect"
+        elif name == "CWAIT":
+            info["kind"] = "stop"
+    elif mode == 2:
+        info["size"] += 1
+    elif mode == 4:
+        info["size"] += 2
+        info["target"] = sim_read16(memory, operand)
+    elif mode == 3:
+        info["size"] += 1
+        offset = None
+        if post_byte & 0x80 == 0:
+            info["cycles"] += INDEXED_OFFSET_CYCLES
+            offset = post_byte & 0x1F
+            offset = offset - 0x20 if offset & 0x10 else offset
+        else:
+            index_mode = post_byte & 0x0F
+            info["cycles"] += max(INDEXED_CYCLES[index_mode], 0)
+            if post_byte & 0x10: info["cycles"] += INDEXED_INDIRECT_CYCLES
+            extra_size = {0x08: 1, 0x0C: 1, 0x09: 2, 0x0D: 2, 0x0F: 2}.get(index_mode, 0)
+            if post_byte & 0x10 == 0:
+                if index_mode == 0x04:
+                    offset = 0
+                elif index_mode == 0x08:
+                    offset = memory[(operand + 1) & 0xFFFF]
+                    offset = offset - 0x100 if offset & 0x80 else offset
+                elif index_mode == 0x09:
+                    offset = sim_read16(memory, (operand + 1) & 0xFFFF)
+                    offset = offset - 0x10000 if offset & 0x8000 else offset
+            info["size"] += extra_size
+        if name == "LEAS":
+            # Track S when it is moved by a constant amount
+            if offset is not None and (post_byte >> 5) & 0x03 == 3:
+                info["stack"] = -offset
+            else:
+                info["sets_s"] = True
+    elif name == "RTI":
+        # The worst case: the entire state was stacked
+        info["cycles"] += 9
+
+    if name == "LDS": info["sets_s"] = True
+    if name == "JMP":
+        info["kind"] = "jump" if mode == 4 else "indirect"
+    elif name == "JSR":
+        info["kind"] = "call" if mode == 4 else "indirect call"
+    elif name in ("RTS", "RTI"):
+        info["kind"] = "return"
+    elif name in ("SWI", "SWI2", "SWI3", "SYNC"):
+        info["kind"] = "stop"
+    return info
+
+
+'''
+Get the addresses to which control may pass within a routine after an instruction:
+the next instruction and any branch or jump target, but not any called routine.
+
+Args:
+    address (int):  The instruction's address.
+    ops     (dict): The decoded instructions, keyed by address (see 'get_op_info()').
+
+Returns:
+    list: The addresses.
+'''
+def get_op_successors(address, ops):
+    info = ops[address]
+    successors = [info["target"]] if info["kind"] in ("branch", "jump") else []
+    if info["kind"] in OP_KINDS_FALLING: successors.append((address + info["size"]) & 0xFFFF)
+    return successors
+
+
+OP_KINDS_FALLING = ("step", "call", "indirect call", "branch")
+
+
+'''
+Analyse every routine in the assembled code. A routine starts at each code label
+which is neither the target of a branch or jump nor fallen into from the code above,
+and at each address which is called with JSR, BSR or LBSR. Any other code label which
+none of those routines reach also starts a routine.
+
+Args:
+    memory       (bytearray): The 64KB memory image.
+    op_addresses (list):      The address of every instruction, as recorded by the assembler.
+    names        (dict):      Label names, keyed by address.
+    bounds       (dict):      The maximum number of times each loop's head is executed on
+                              each entry to the loop, keyed by the head's address.
+
+Returns:
+    list: The results, one dict per routine, in address order (see 'analyse_routine()').
+'''
+def analyse_routines(memory, op_addresses, names, bounds):
+    ops = {}
+    for address in op_addresses:
+        if address not in ops: ops[address] = get_op_info(memory, address)
+    branch_targets = set()
+    call_targets = set()
+    fall_targets = set()
+    for address, info in ops.items():
+        if info["kind"] in ("branch", "jump"): branch_targets.add(info["target"])
+        if info["kind"] == "call": call_targets.add(info["target"])
+        if info["kind"] in OP_KINDS_FALLING: fall_targets.add((address + info["size"]) & 0xFFFF)
+    # A label which the code falls into is part of the routine above it, so that each
+    # instruction is walked by as few routines as possible
+    entries = {address for address in names if address in ops and address not in branch_targets
+               and address not in fall_targets}
+    entries |= {address for address in call_targets if address in ops}
+
+    # Any other label which the routines so far don't reach starts a routine of its own
+    reached = set()
+
+    def reach(start):
+        reached.add(start)
+        work = [start]
+        while work:
+            for successor in get_op_successors(work.pop(), ops):
+                if successor in ops and successor not in reached:
+                    reached.add(successor)
+                    work.append(successor)
+
+    for entry in list(entries): reach(entry)
+    for address in sorted(names):
+        if address in ops and address not in reached:
+            entries.add(address)
+            reach(address)
+
+    # Analyse the routines in an order which puts each called routine, and each routine which
+    # another continues into, before the routines which use it, unless they are recursive
+    order = []
+    visited = set()
+    for root in sorted(entries):
+        if root in visited: continue
+        visited.add(root)
+        stack = [(root, iter(get_routine_callees(root, ops, entries)))]
+        while stack:
+            routine, callees = stack[-1]
+            for callee in callees:
+                if callee in ops and callee not in visited:
+                    visited.add(callee)
+                    stack.append((callee, iter(get_routine_callees(callee, ops, entries))))
+                    break
+            else:
+                stack.pop()
+                order.append(routine)
+
+    results = {}
+    for entry in order: results[entry] = analyse_routine(entry, ops, names, bounds, results)
+    return [results[entry] for entry in sorted(entries)]
+
+
+'''
+Get the addresses called by a routine with JSR, BSR or LBSR, and the other routines
+into which it branches, jumps or falls. The search stops at those routines.
+
+Args:
+    entry   (int):  The routine's address.
+    ops     (dict): The decoded instructions, keyed by address (see 'get_op_info()').
+    entries (set):  The address of every routine.
+
+Returns:
+    list: The addresses.
+'''
+def get_routine_callees(entry, ops, entries):
+    callees = []
+    seen = {entry}
+    work = [entry]
+    while work:
+        address = work.pop()
+        if ops[address]["kind"] == "call": callees.append(ops[address]["target"])
+        for successor in get_op_successors(address, ops):
+            if successor in entries and successor not in seen:
+                seen.add(successor)
+                callees.append(successor)
+            elif successor in ops and successor not in seen:
+                seen.add(successor)
+                work.append(successor)
+    return callees
+
+
+'''
+Analyse a single routine. The routines it calls must already have been analysed,
+unless the calls are recursive.
+
+Args:
+    entry   (int):  The routine's address.
+    ops     (dict): The decoded instructions, keyed by address (see 'get_op_info()').
+    names   (dict): Label names, keyed by address.
+    bounds  (dict): Loop bounds, keyed by loop head address.
+    results (dict): The results so far, keyed by routine address.
+
+Returns:
+    dict: The routine's name and address; its worst-case cycle count, which includes the
+          cycles of the instruction that returns, and whether that count is a true bound;
+          the maximum number of bytes it and the routines it calls push on the S stack
+          (excluding its own return address), and whether that is a true bound; the maximum depth of nested calls it makes;
+          and notes on anything which limited the analysis.
+'''
+def analyse_routine(entry, ops, names, bounds, results):
+    result = {"name": names.get(entry, "${0:04X}".format(entry)), "address": entry, "cycles": 0,
+              "bounded": True, "stack": 0, "stack_bounded": True, "calls": 0, "notes": [], "loops": []}
+    notes = result["notes"]
+
+    def add_note(text):
+        if text not in notes: notes.append(text)
+
+    def get_name(address):
+        return names.get(address, "${0:04X}".format(address))
+
+    # Find the routine's instructions and the leaders of its basic blocks. Flow which passes
+    # to a routine that has already been analysed is treated as a tail call to it, so the
+    # code of a routine is walked just once
+    leaders = {entry}
+    seen = {entry}
+    work = [entry]
+    while work:
+        address = work.pop()
+        info = ops[address]
+        successors = get_op_successors(address, ops)
+        if info["kind"] in ("branch", "jump"): leaders.update(successors)
+        for successor in successors:
+            if successor not in ops:
+                add_note("flow reaches non-code address " + get_name(successor))
+                result["bounded"] = False
+            elif successor != entry and successor in results:
+                leaders.add(successor)
+            elif successor not in seen:
+                seen.add(successor)
+                work.append(successor)
+
+    # Build the blocks: each block's edges are (successor, cycles) pairs, where the successor
+    # is None for an edge that leaves the routine
+    edges = {}
+    block_stack = {}
+    for leader in leaders:
+        if leader not in ops or (leader != entry and leader in results): continue
+        address = leader
+        cycles = 0
+        depth = 0
+        peak = 0
+        block_edges = []
+        while True:
+            info = ops[address]
+            kind = info["kind"]
+            cycles += info["cycles"]
+            if kind in ("call", "indirect call"):
+                callee = None
+                if kind == "indirect call":
+                    add_note("indirect call at " + get_name(address))
+                elif info["target"] not in ops:
+                    add_note("call to non-code address " + get_name(info["target"]))
+                else:
+                    callee = results.get(info["target"])
+                    if callee is None: add_note("recursive call to " + get_name(info["target"]))
+                if callee is None:
+                    result["bounded"] = False
+                    result["stack_bounded"] = False
+                else:
+                    cycles += callee["cycles"]
+                    if callee["bounded"] is False:
+                        add_note("calls unbounded routine " + callee["name"])
+                        result["bounded"] = False
+                    if callee["stack_bounded"] is False: result["stack_bounded"] = False
+                    peak = max(peak, depth + 2 + callee["stack"])
+                    result["calls"] = max(result["calls"], callee["calls"] + 1)
+                if kind == "indirect call": result["calls"] = max(result["calls"], 1)
+            if info["sets_s"]:
+                add_note("S is set at " + get_name(address))
+                result["stack_bounded"] = False
+            depth += info["stack"]
+            peak = max(peak, depth)
+            next_address = (address + info["size"]) & 0xFFFF
+            if kind == "branch":
+                block_edges.append((next_address, cycles))
+                block_edges.append((info["target"], cycles + info["taken"]))
+                break
+            if kind == "jump":
+                block_edges.append((info["target"], cycles))
+                break
+            if kind in ("return", "stop"):
+                block_edges.append((None, cycles))
+                break
+            if kind in ("indirect", "illegal"):
+                add_note(("indirect jump at " if kind == "indirect" else "illegal opcode at ") + get_name(address))
+                result["bounded"] = False
+                block_edges.append((None, cycles))
+                break
+            if next_address not in ops:
+                # Already noted while finding the instructions
+                block_edges.append((None, cycles))
+                break
+            if next_address in leaders:
+                block_edges.append((next_address, cycles))
+                break
+            address = next_address
+        edges[leader] = []
+        for target, cost in block_edges:
+            if target is not None and target != entry and target in results:
+                # Add the cycles and stack of the routine which the flow continues into
+                tail = results[target]
+                cost += tail["cycles"]
+                peak = max(peak, depth + tail["stack"])
+                result["calls"] = max(result["calls"], tail["calls"])
+                if tail["bounded"] is False:
+                    add_note("continues into unbounded routine " + tail["name"])
+                    result["bounded"] = False
+                if tail["stack_bounded"] is False: result["stack_bounded"] = False
+                target = None
+            if target is None or target in ops: edges[leader].append((target, cost))
+        block_stack[leader] = (depth, peak)
+
+    # Find the maximum stack depth by passing each block's entry depth on to its successors
+    depths = {entry: 0}
+    work = [entry]
+    while work:
+        block = work.pop()
+        depth, peak = block_stack[block]
+        result["stack"] = max(result["stack"], depths[block] + peak)
+        for target, _ in edges[block]:
+            if target is None: continue
+            if target not in depths:
+                depths[target] = depths[block] + depth
+                work.append(target)
+            elif depths[target] != depths[block] + depth:
+                add_note("stack depth varies at " + get_name(target))
+                result["stack_bounded"] = False
+
+    # Number the blocks in depth-first pre-order, and record each block's last descendant
+    # and reverse post-order position
+    preorder = {}
+    last = {}
+    postorder = []
+    stack = [(entry, iter(edges[entry]))]
+    preorder[entry] = 0
+    while stack:
+        block, successors = stack[-1]
+        for target, _ in successors:
+            if target is not None and target not in preorder:
+                preorder[target] = len(preorder)
+                stack.append((target, iter(edges[target])))
+                break
+        else:
+            stack.pop()
+            last[block] = len(preorder) - 1
+            postorder.append(block)
+    rpo = {block: len(postorder) - i for i, block in enumerate(postorder)}
+    predecessors = {block: [] for block in preorder}
+    for block in preorder:
+        for target, _ in edges[block]:
+            if target is not None: predecessors[target].append(block)
+
+    def is_ancestor(block, other):
+        return preorder[block] <= preorder[other] <= last[block]
+
+    # Collapse loops, innermost first. 'parent' maps each collapsed block to the head of
+    # the loop which contains it
+    parent = {}
+
+    def find(block):
+        root = block
+        while root in parent: root = parent[root]
+        while block in parent and parent[block] != root:
+            parent[block], block = root, parent[block]
+        return root
+
+    for head in sorted(preorder, key=preorder.get, reverse=True):
+        back = [block for block in predecessors[head] if is_ancestor(head, block)]
+        if not back: continue
+        body = {head}
+        work = []
+        for block in back:
+            block = find(block)
+            if block not in body:
+                body.add(block)
+                work.append(block)
+        while work:
+            block = work.pop()
+            for predecessor in predecessors[block]:
+                predecessor = find(predecessor)
+                if predecessor in body: continue
+                if not is_ancestor(head, predecessor):
+                    # The loop has a second entry, so its bound can't be applied
+                    add_note("loop at " + get_name(head) + " has more than one entry")
+                    result["bounded"] = False
+                    continue
+                body.add(predecessor)
+                work.append(predecessor)
+
+        # Find the longest paths through one pass of the loop
+        dist = {head: 0}
+        iteration = 0
+        exits = []
+        for block in sorted(body, key=rpo.get):
+            if block not in dist: continue
+            for target, cost in edges[block]:
+                root = find(target) if target is not None else None
+                if root == head:
+                    iteration = max(iteration, dist[block] + cost)
+                elif root in body:
+                    dist[root] = max(dist.get(root, 0), dist[block] + cost)
+                else:
+                    exits.append((target, dist[block] + cost))
+
+        bound = bounds.get(head)
+        if bound is None:
+            add_note("loop at " + get_name(head) + " has no bound")
+            result["bounded"] = False
+            bound = 1
+        result["loops"].append(head)
+        for block in body:
+            if block != head: parent[block] = head
+        edges[head] = [(target, (bound - 1) * iteration + cost) for target, cost in exits]
+
+    # Find the longest path through the routine
+    dist = {entry: 0}
+    for block in sorted(preorder, key=rpo.get):
+        if block in parent or block not in dist: continue
+        for target, cost in edges[block]:
+            if target is None:
+                result["cycles"] = max(result["cycles"], dist[block] + cost)
+            else:
+                root = find(target)
+                dist[root] = max(dist.get(root, 0), dist[block] + cost)
+
+    return result
+
+
+'''
+Analyse the routines of the assembled program and output the results.
+'''
+def analyse_assembled_code():
+    bounds = {}
+    for name, bound in app_state.loop_bounds.items():
+        address = get_address_of(name)
+        if address is None:
+            print("[ERROR] --bound loop head " + name + " is not a label or an address")
+            return
+        bounds[address] = bound
+
+    names = {}
+    for label in app_state.labels:
+        if isinstance(label["addr"], int) and label.get("kind", SYMBOL_KIND_ADDRESS) == SYMBOL_KIND_ADDRESS:
+            names.setdefault(label["addr"], label["name"])
+    routines = analyse_routines(get_memory_image(), app_state.op_addresses, names, bounds)
+
+    # Warn about any bound which was not applied to a loop
+    heads = set()
+    for routine in routines: heads.update(routine.pop("loops"))
+    for name in app_state.loop_bounds:
+        if get_address_of(name) not in heads: print("[WARNING] --bound " + name + " is not the head of a loop")
+
+    if app_state.json_stream is not None:
+        for routine in routines:
+            record = {"type": "routine", "file": get_source_file()}
+            record.update(routine)
+            emit_json(record)
+        return
+
+    print("\nRoutine Analysis")
+    print("----------------------------------------")
+    print("Routine             Address   Cycles      Stack       Calls")
+    for routine in routines:
+        name = routine["name"]
+        cycles = str(routine["cycles"]) if routine["bounded"] else "unbounded"
+        stack = str(routine["stack"]) if routine["stack_bounded"] else "unbounded"
+        print(name + set_spacer(20, len(name)) + "0x{0:04X}    ".format(routine["address"]) + cycles
+              + set_spacer(12, len(cycles)) + stack + set_spacer(12, len(stack)) + str(routine["calls"]))
+        for note in routine["notes"]:
+            print("    NOTE " + note)
+
+
+'''
+Determing the number of spaces to pad a printed line.
+
+Args:
+    a_max (int): The length of the padded line.
+    a_min (int): The length of the un-padded line.
+
+Returns:
+    str: A string of spaces to pad the line.
+'''
+def set_spacer(a_max, a_min=0):
+    spaces = "                                                         "
+    num = a_max - a_min
+    # If the line is too long, just return a couple of spaces
+    if num < 1: return "  "
+    return spaces[:num]
+
+
+'''
+Convert a post-op byte value into a register name.
+
+Args:
+    post_byte_value (int): The post-op byte value.
+
+Returns:
+    str: The indicated register.
+'''
+def get_indexed_reg(post_byte_value):
+    post_byte_value = (post_byte_value & 0x60) >> 5
+    regs = ("X", "Y", "U", "S")
+    if post_byte_value < 4: return regs[post_byte_value]
+    return "N/A"
+
+
+'''
+Generic TFR/EXG operand string generator, converting a post-op byte value
+into disassembled output, eg. "A,B".
+
+Args:
+    post_byte_value (int): The post-op byte value.
+
+Returns:
+    str: The register string, or an empty string if either register is invalid.
+'''
+def get_tfr_exg_regs(post_byte_value):
+    reg_list = ("D", "X", "Y", "U", "S", "PC", "A", "B", "CC", "DP")
+    from_nibble = (post_byte_value & 0xF0) >> 4
+    to_nibble = post_byte_value & 0x0F
+    if from_nibble in (6, 7) or from_nibble > 11 or to_nibble in (6, 7) or to_nibble > 11: return ""
+    from_str = reg_list[from_nibble - 2] if from_nibble > 5 else reg_list[from_nibble]
+    to_str = reg_list[to_nibble - 2] if to_nibble > 5 else reg_list[to_nibble]
+    return from_str + "," + to_str
+
+
+'''
+Pass on the correct register lists for PSHS or PULS.
+
+Args:
+    post_byte_value (int): The post-op byte value.
+
+Returns:
+    str: The list of registers referenced in the operand.
+'''
+def get_puls_pshs_regs(post_byte_value):
+    return get_pul_psh_regs(post_byte_value, ("CC", "A", "B", "DP", "X", "Y", "U", "PC"))
+
+
+'''
+Pass on the correct register lists for PSHU or PULU.
+
+Args:
+    post_byte_value (int): The post-op byte value..
+
+Returns:
+    str: The list of registers referenced in the operand.
+'''
+def get_pulu_pshu_regs(post_byte_value):
+    return get_pul_psh_regs(post_byte_value, ("CC", "A", "B", "DP", "X", "Y", "S", "PC"))
+
+
+'''
+Generic PUL/PSH operand string generator.
+
+Args:
+    post_byte_value (int):  The post-op byte value.
+    reg_list        (list): Names of possible registers.
+
+Returns:
+    str: The list of registers referenced in the operand.
+'''
+def get_pul_psh_regs(post_byte_value, reg_tuple):
+    output = ""
+    for i in range(0, 8):
+        if post_byte_value & (2 ** i) > 0:
+            # Bit is set, so add the register to the output string
+            output += (reg_tuple[i] + ",")
+    # Remove the final comma and return the output string, eg. "CC,A,X,Y,PC"
+    if output: output = output[0:len(output) - 1]
+    return output
 
 
 '''
@@ -1526,28 +4612,213 @@ def write_file(file_path=None):
     if file_path:
         op_data = []
         _, ext = os.path.splitext(file_path)
+        # FROM 1.4.0: Standard output takes the format set by --format
+        if file_path == "-": ext = "." + app_state.out_format
         if ext == ".rom":
-            byte_arr = bytearray()
-            for chunk in app_state.code:
-                for a_byte in chunk["code"]: byte_arr += (a_byte.to_bytes(length=1, byteorder='big'))
-            with open(file_path, "wb") as file: file.write(byte_arr)
-            print("File " + os.path.abspath(file_path) + " written")
+            byte_arr = b"".join(chunk["code"] for chunk in app_state.code)
         else:
             for chunk in app_state.code:
-                # Build the output data string
-                byte_str = ""
-                for a_byte in chunk["code"]: byte_str += ("%02X" % a_byte)
-
                 # Build the dictionary and add to the data array
-                op_part = {"address": chunk["address"], "code": byte_str}
+                op_part = {"address": chunk["address"], "code": chunk["code"].hex().upper()}
                 op_data.append(op_part)
-            json_op = json.dumps(op_data, ensure_ascii=False)
+            byte_arr = json.dumps(op_data, ensure_ascii=False).encode("utf-8")
 
-            # Write out the file
-            with open(file_path, "w") as file: file.write(json_op)
+        # Write out the file in one go
+        if file_path == "-":
+            app_state.image_stream.write(byte_arr)
+            app_state.image_stream.flush()
+        else:
+            with open(file_path, "wb") as file: file.write(byte_arr)
             print("File " + os.path.abspath(file_path) + " written")
 
 
+'''
+Write the program's symbols, sorted by value, to a .sym.json file and to a compact
+binary .sym file. Each symbol has a name, a value, a kind (address or EQU constant)
+and the number of the source line which defined it.
+
+The .sym file comprises a header (see SYMBOL_FILE_HEADER), fixed-size records
+(see SYMBOL_FILE_RECORD) and then the symbol names. Records are in value order,
+so readers can bisect them to find the nearest symbol to any address.
+
+Args:
+    file_root (str): The path of the output files, minus the file extension.
+'''
+def write_symbol_files(file_root):
+    symbols = get_symbols(app_state.labels)
+
+    # Write out the JSON version
+    with open(file_root + ".sym.json", "w") as file: json.dump(symbols, file, ensure_ascii=False)
+
+    # Write out the binary version
+    names = bytearray()
+    records = bytearray()
+    for symbol in symbols:
+        name = symbol["name"].encode("utf-8")
+        kind = 1 if symbol["kind"] == SYMBOL_KIND_EQU else 0
+        records += struct.pack(SYMBOL_FILE_RECORD, symbol["value"] & 0xFFFF, kind, symbol["line"], len(names), len(name))
+        names += name
+    with open(file_root + ".sym", "wb") as file:
+        file.write(struct.pack(SYMBOL_FILE_HEADER, SYMBOL_FILE_MAGIC, 1, len(symbols)))
+        file.write(records)
+        file.write(names)
+    show_verbose("Symbol files " + os.path.abspath(file_root) + ".sym(.json) written")
+
+
+'''
+Gather resolved labels as a list of symbol records, sorted by value then name.
+
+Args:
+    labels (list): The labels.
+
+Returns:
+    list: Dictionaries holding each symbol's name, value, kind and defining line.
+'''
+def get_symbols(labels):
+    symbols = []
+    for label in labels:
+        if label["addr"] == "!!!!" or label["kind"] == SYMBOL_KIND_EXTERN: continue
+        symbols.append({"name": label["name"], "value": label["addr"],
+                        "kind": label.get("kind", SYMBOL_KIND_ADDRESS), "line": label.get("line", 0)})
+    symbols.sort(key=lambda symbol: (symbol["value"], symbol["name"]))
+    return symbols
+
+
+'''
+Write the program's source map, which maps address ranges to the source file
+and line that generated them, to a compact binary .map file.
+
+The file comprises a header (see SOURCE_MAP_HEADER), the source file table
+(a 16-bit length then the UTF-8 path for each file) and fixed-size range
+records (see SOURCE_MAP_RECORD) in address order, so readers can bisect them.
+
+Args:
+    file_path (str): The path of the output file.
+'''
+def write_source_map_file(file_path):
+    # Gather the recorded ranges and sort them by address. Like the symbol files, the map
+    # holds 16-bit addresses, so code assembled past 0xFFFF wraps, and counts are clamped
+    source_map = app_state.source_map
+    ranges = sorted(range(0, len(source_map), 4), key=lambda i: (source_map[i] & 0xFFFF, i))
+
+    with open(file_path, "wb") as file:
+        file.write(struct.pack(SOURCE_MAP_HEADER, SOURCE_MAP_MAGIC, 1, len(app_state.source_files), len(ranges)))
+        for source_file in app_state.source_files:
+            path = source_file.encode("utf-8")
+            file.write(struct.pack(">H", len(path)) + path)
+        records = bytearray()
+        for i in ranges:
+            records += struct.pack(SOURCE_MAP_RECORD, source_map[i] & 0xFFFF, min(source_map[i + 1], 0xFFFF),
+                                   source_map[i + 2], source_map[i + 3])
+        file.write(records)
+    show_verbose("Source map " + os.path.abspath(file_path) + " written")
+
+
+'''
+Write the assembled program as a relocatable object file, for later linking with
+other object files. The file is JSON, holding the program's code chunks ('sections'),
+which are relocatable unless they were placed by ORG, the symbols it exports with
+PUBLIC and imports with EXTERN, and the locations of the values that must be
+adjusted when the sections are placed ('relocations').
+
+Args:
+    file_path (str): The path of the .obj file.
+'''
+def write_object_file(file_path):
+    sections = []
+    for chunk in app_state.code:
+        sections.append({"address": chunk["address"], "relocatable": chunk.get("relocatable", False),
+                         "code": chunk["code"].hex().upper()})
+    public = []
+    for name in app_state.public_symbols:
+        label = app_state.labels[index_of_label(name)]
+        public.append({"name": name, "value": label["addr"], "section": label.get("section") if label["kind"] == SYMBOL_KIND_ADDRESS else None})
+    extern = [label["name"] for label in app_state.labels if label["kind"] == SYMBOL_KIND_EXTERN]
+    object_data = {"format": OBJECT_FILE_FORMAT, "version": OBJECT_FILE_VERSION, "source": get_source_file(),
+                   "sections": sections, "public": public, "extern": extern, "relocations": app_state.relocations}
+    with open(file_path, "w") as file: json.dump(object_data, file, ensure_ascii=False)
+    print("File " + os.path.abspath(file_path) + " written")
+
+
+'''
+Link object files: place their relocatable sections one after the other from the
+start address, resolve the symbols they import from each other, and write the
+program to a .rom or .6809 file, with its symbol files.
+
+Args:
+    file_paths (list): The paths of the .obj files.
+'''
+def link_files(file_paths):
+    modules = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, "r") as file: object_data = json.load(file)
+        except (OSError, ValueError):
+            print("[ERROR] Could not read object file " + file_path)
+            return
+        if object_data.get("format") != OBJECT_FILE_FORMAT or object_data.get("version") != OBJECT_FILE_VERSION:
+            print("[ERROR] " + file_path + " is not a SPASM object file")
+            return
+        modules.append((file_path, object_data))
+
+    # Place the sections: relocatable ones follow each other from the start address
+    address = app_state.start_address
+    for _, object_data in modules:
+        for section in object_data["sections"]:
+            section["code"] = bytearray.fromhex(section["code"])
+            if section["relocatable"] is True:
+                section["address"] = address
+                address += len(section["code"])
+
+    # Gather the exported symbols
+    symbols = {}
+    for file_path, object_data in modules:
+        for symbol in object_data["public"]:
+            if symbol["name"] in symbols:
+                print("[ERROR] Symbol " + symbol["name"] + " is exported by " + symbols[symbol["name"]][1] + " and " + file_path)
+                return
+            value = symbol["value"]
+            if symbol["section"] is not None: value += object_data["sections"][symbol["section"]]["address"]
+            symbols[symbol["name"]] = (value & 0xFFFF, file_path)
+
+    # Apply the relocations
+    for file_path, object_data in modules:
+        sections = object_data["sections"]
+        for relocation in object_data["relocations"]:
+            section = sections[relocation["section"]]
+            offset = relocation["offset"]
+            value = int.from_bytes(section["code"][offset:offset + 2], "big")
+            if "symbol" in relocation:
+                if relocation["symbol"] not in symbols:
+                    print("[ERROR] Symbol " + relocation["symbol"] + " used by " + file_path + " is not exported by any file")
+                    return
+                target = symbols[relocation["symbol"]][0]
+                value = target if relocation["type"] == "abs16" else target - (section["address"] + offset + 2)
+            elif "address" in relocation:
+                # FROM 1.4.0: A branch from a relocatable section to a fixed address
+                value = relocation["address"] - (section["address"] + offset + 2)
+            else:
+                value += sections[relocation["target"]]["address"]
+            section["code"][offset:offset + 2] = (value & 0xFFFF).to_bytes(2, "big")
+
+    # Check that no sections overlap, then output the program
+    app_state.code = sorted(({"address": section["address"], "code": section["code"]}
+                             for _, object_data in modules for section in object_data["sections"] if section["code"]),
+                            key=lambda chunk: chunk["address"])
+    for previous, chunk in zip(app_state.code, app_state.code[1:]):
+        if previous["address"] + len(previous["code"]) > chunk["address"]:
+            print("[ERROR] Code at 0x" + to_hex(previous["address"], 4) + " overlaps code at 0x" + to_hex(chunk["address"], 4))
+            return
+    show_verbose("Linked " + str(len(modules)) + " object files: 0x" + to_hex(app_state.start_address, 4) +
+                 "-0x" + to_hex(address, 4) + " holds the relocatable code")
+
+    app_state.labels = [{"name": name, "addr": value, "kind": SYMBOL_KIND_ADDRESS, "line": 0} for name, (value, _) in symbols.items()]
+    out_file = app_state.out_file
+    if out_file is None or out_file == "*": out_file = os.path.splitext(file_paths[0])[0] + ".rom"
+    write_file(out_file)
+    if out_file != "-": write_symbol_files(os.path.splitext(out_file)[0])
+
+
 '''
 Determine all the '.asm' and '.6809' files in the script's directory.
 '''
@@ -1585,6 +4856,83 @@ def get_files():
     handle_files(dis_files)
 
 
+'''
+Load the symbols from a symbol file written by spasm, either the JSON '.sym.json'
+form or the binary '.sym' form, for use as predefined symbols.
+
+Args:
+    file_path (str): The path to the symbol file.
+
+Returns:
+    list: The symbols as (name, value) tuples, or None if the file could not be read.
+'''
+def load_symbol_file(file_path):
+    try:
+        if file_path.endswith(".json"):
+            with open(file_path, "r") as file: records = json.load(file)
+            return [(record["name"], record["value"] & 0xFFFF) for record in records]
+
+        with open(file_path, "rb") as file: data = file.read()
+        magic, _, count = struct.unpack_from(SYMBOL_FILE_HEADER, data)
+        if magic != SYMBOL_FILE_MAGIC: return None
+        records_start = struct.calcsize(SYMBOL_FILE_HEADER)
+        names_start = records_start + count * struct.calcsize(SYMBOL_FILE_RECORD)
+        symbols = []
+        for value, _, _, offset, length in struct.iter_unpack(SYMBOL_FILE_RECORD, data[records_start:names_start]):
+            symbols.append((data[names_start + offset:names_start + offset + length].decode("utf-8"), value))
+        return symbols
+    except (OSError, ValueError, KeyError, TypeError, struct.error, UnicodeDecodeError):
+        return None
+
+
+'''
+Add symbols loaded from a symbol file to the predefined symbols, checking that
+no symbol is given a different value by another file.
+
+Args:
+    file_path (str): The path to the symbol file.
+
+Returns:
+    bool: True if the symbols were added, otherwise False.
+'''
+def add_symbol_file(file_path):
+    symbols = load_symbol_file(file_path)
+    if symbols is None:
+        print("[ERROR] Could not read symbol file " + file_path)
+        return False
+    known = dict(app_state.predefined_symbols)
+    for name, value in symbols:
+        if name not in known:
+            known[name] = value
+            app_state.predefined_symbols.append((name, value))
+        elif known[name] != value:
+            print("[ERROR] Symbol " + name + " in " + file_path + " conflicts with an earlier definition")
+            return False
+    show_verbose(str(len(symbols)) + " symbols loaded from " + os.path.abspath(file_path))
+    return True
+
+
+'''
+FROM 1.4.0: Parse a --bound specification: a comma-separated list of loop head labels
+or addresses, each with the maximum number of times the head is executed on each entry
+to the loop, eg. 'loop=10,inner=200'.
+
+Args:
+    spec (str): The specification.
+
+Returns:
+    dict: The bounds, keyed by label or address, or None if the specification is invalid.
+'''
+def get_loop_bounds(spec):
+    bounds = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        value = str_to_int(value) if value else False
+        if not name or value is False or value < 1: return None
+        bounds[name] = value
+    return bounds
+
+
 '''
 Pass on all supplied '.asm' files on for assembly, '.6809' or '.rom' files for disassembly.
 
@@ -1595,9 +4943,37 @@ def handle_files(the_files=None):
     if the_files:
         for one_file in the_files:
             _, file_ext = os.path.splitext(one_file)
-            print(file_ext)
-            if file_ext in (".asm", ".asm6809"): assemble_file(one_file)
-            if file_ext in (".6809", ".rom"): disassemble_file((one_file, True))
+            if file_ext in (".asm", ".asm6809") or one_file == "-": assemble_file(one_file)
+            if file_ext in (".6809", ".rom"): disassemble_file((one_file, file_ext == ".6809"))
+            if file_ext == ".obj" and app_state.link is False: print("[ERROR] Use --link to link " + one_file)
+        # FROM 1.4.0: Link any object files
+        if app_state.link is True:
+            object_files = [one_file for one_file in the_files if os.path.splitext(one_file)[1] == ".obj"]
+            if object_files: link_files(object_files)
+
+
+'''
+Convert a --variant specification, eg. 'rev2,start=$8000,IO_BASE=$FF00', into a variant.
+
+Args:
+    spec (str): The variant's name, then any comma-separated start address and symbol values.
+
+Returns:
+    dict: The variant's name, start address (if set) and symbols, or None if the spec is invalid.
+'''
+def get_variant(spec):
+    parts = spec.split(",")
+    if not parts[0] or "=" in parts[0]: return None
+    variant = {"name": parts[0], "symbols": []}
+    for part in parts[1:]:
+        name, _, value = part.partition("=")
+        value = str_to_int(value) if value else False
+        if not name or value is False: return None
+        if name == "start":
+            variant["start"] = value
+        else:
+            variant["symbols"].append((name, value))
+    return variant
 
 
 '''
@@ -1619,6 +4995,238 @@ def str_to_int(num_str):
         return False
 
 
+'''
+Assemble a program held in memory without disturbing the application's state.
+Nothing is displayed: errors are recorded in the returned state's diagnostics.
+
+Args:
+    lines         (list): The lines of source code.
+    start_address (int):  The start address of the assembled code.
+    symbols       (list): Predefined symbols as (name, value) tuples.
+
+Returns:
+    tuple: -1 if the program assembled, otherwise the index of the line which halted assembly,
+           and the AppState which holds the assembled code, labels and diagnostics.
+'''
+def assemble_source(lines, start_address=0, symbols=()):
+    global app_state
+    saved_state = app_state
+    app_state = AppState()
+    app_state.verbose = False
+    app_state.start_address = start_address
+    app_state.predefined_symbols = list(symbols)
+    app_state.diagnostics = []
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            error_line = assemble_lines(lines)
+        return (error_line, app_state)
+    finally:
+        app_state = saved_state
+
+
+'''
+Assemble a single line of code at the specified address. Results are cached, so
+repeated requests for the same line, address and symbols are fast.
+
+Args:
+    text    (str):  The line of code, eg. 'LDA 5,X'. It may include a label.
+    address (int):  The address at which the code will be placed.
+    symbols (dict): Predefined symbol values, keyed by name.
+
+Returns:
+    bytes: The machine code, or None if the line could not be assembled or generates
+           no code, eg. a bare label or a directive such as EQU.
+'''
+def assemble_instruction(text, address=0, symbols=None):
+    symbol_items = tuple(sorted(symbols.items())) if symbols else ()
+    return assemble_instruction_cached(text, address, symbol_items)
+
+
+'''
+Assemble a single line of code for 'assemble_instruction()', which caches the results.
+A bare word is taken as a label definition, so it yields no code rather than an error.
+
+Args:
+    text         (str):   The line of code.
+    address      (int):   The address at which the code will be placed.
+    symbol_items (tuple): Predefined symbol values, as sorted (name, value) pairs.
+
+Returns:
+    bytes: The machine code, or None if the line could not be assembled or generates no code.
+'''
+@functools.lru_cache(maxsize=LRU_CACHE_SIZE)
+def assemble_instruction_cached(text, address, symbol_items):
+    error_line, state = assemble_source([" " + text + "\n"], address, symbol_items)
+    if error_line != -1: return None
+    code = bytes(state.code[0]["code"])
+    return code if len(code) > 0 else None
+
+
+'''
+Decode the instruction at the start of a block of machine code. Results are cached,
+so repeated requests for the same bytes and address are fast.
+
+Args:
+    data    (bytes): The machine code. Bytes beyond the instruction are ignored.
+    address (int):   The address of the instruction's first byte.
+
+Returns:
+    dict: The decoded instruction (see 'decode_instruction()').
+'''
+def disassemble_instruction(data, address=0):
+    # No 6809 instruction is more than five bytes long
+    return dict(disassemble_instruction_cached(bytes(data[:5]), address))
+
+
+@functools.lru_cache(maxsize=LRU_CACHE_SIZE)
+def disassemble_instruction_cached(data, address):
+    return decode_instruction(data, 0, address)
+
+
+'''
+Process a single server request.
+
+Args:
+    request (dict): The request. Its 'op' is 'assemble', with the program in 'source', or
+                    'disassemble', with hex-encoded machine code in 'code' and its load
+                    address in 'address'. Assembly options go in 'options'.
+
+Returns:
+    dict: The response, with the request's 'id', an 'ok' flag and the results.
+'''
+def handle_request(request):
+    response = {"id": request.get("id"), "ok": False}
+    try:
+        if request.get("op") == "assemble":
+            options = request.get("options", {})
+            error_line, state = assemble_source(request["source"].splitlines(True), options.get("start_address", 0))
+            response["ok"] = error_line == -1
+            response["diagnostics"] = state.diagnostics
+            if error_line == -1:
+                response["chunks"] = [{"address": chunk["address"], "code": chunk["code"].hex().upper()} for chunk in state.code]
+                response["symbols"] = get_symbols(state.labels)
+        elif request.get("op") == "disassemble":
+            code = bytearray.fromhex(request["code"])
+            address = request.get("address", 0)
+            instructions = []
+            offset = 0
+            while offset < len(code):
+                instruction = decode_instruction(code, offset, address + offset)
+                offset += len(instruction["bytes"])
+                instruction["bytes"] = instruction["bytes"].hex().upper()
+                instructions.append(instruction)
+            response["ok"] = True
+            response["instructions"] = instructions
+        else:
+            response["error"] = "Unknown op"
+    except (KeyError, TypeError, ValueError) as err:
+        response["error"] = "Bad request: " + str(err)
+    return response
+
+
+'''
+Serve requests, one JSON object per line, from an input stream, writing each response
+to an output stream as a JSON object on a single line. Requests are processed by a
+pool of worker processes, so responses may be sent out of order: use the requests'
+'id' fields to match them up.
+
+Args:
+    in_stream  (file):                The request stream.
+    out_stream (file):                The response stream.
+    pool       (ProcessPoolExecutor): The worker pool.
+'''
+def serve_stream(in_stream, out_stream, pool):
+    lock = threading.Lock()
+    # Bound the number of requests in flight
+    slots = threading.BoundedSemaphore(app_state.workers * 2)
+    for request_line in in_stream:
+        if not request_line.strip(): continue
+        try:
+            request = json.loads(request_line)
+        except ValueError:
+            send_response(out_stream, lock, None, None, {"id": None, "ok": False, "error": "Bad request: not JSON"})
+            continue
+        slots.acquire()
+        future = pool.submit(handle_request, request)
+        future.add_done_callback(functools.partial(send_response, out_stream, lock, slots, request.get("id")))
+
+    # Wait for outstanding requests before returning
+    for _ in range(0, app_state.workers * 2): slots.acquire()
+
+
+'''
+Write a server response, or the result of a pooled request, to the response stream.
+
+Args:
+    out_stream (file):           The response stream.
+    lock       (Lock):           Serializes writes to the stream.
+    slots      (Semaphore):      The in-flight request counter to release, or None.
+    request_id (any):            The id of the request.
+    result     (dict or Future): The response, or the future which will supply it.
+'''
+def send_response(out_stream, lock, slots, request_id, result):
+    if isinstance(result, concurrent.futures.Future):
+        try:
+            result = result.result()
+        except Exception as err:
+            result = {"id": request_id, "ok": False, "error": "Worker failed: " + str(err)}
+    with lock:
+        out_stream.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out_stream.flush()
+    if slots is not None: slots.release()
+
+
+'''
+Handle a client connection to the server socket: read requests, one JSON object
+per line, and reply to each in turn.
+'''
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for request_line in self.rfile:
+            if not request_line.strip(): continue
+            try:
+                request = json.loads(request_line)
+                response = self.server.pool.submit(handle_request, request).result()
+            except ValueError:
+                response = {"id": None, "ok": False, "error": "Bad request: not JSON"}
+            except Exception as err:
+                response = {"id": None, "ok": False, "error": "Worker failed: " + str(err)}
+            self.wfile.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+'''
+Run spasm as a server, keeping warm assemblers in a pool of worker processes. Requests
+are read from stdin, and responses written to stdout, unless a socket path is set, in
+which case clients connect to a Unix socket at that path.
+'''
+def run_server():
+    if app_state.workers == 0: app_state.workers = os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=app_state.workers) as pool:
+        if app_state.socket_path is None:
+            print("SPASM server ready on stdin/stdout", file=sys.stderr)
+            serve_stream(sys.stdin, sys.stdout, pool)
+            return
+
+        # Only replace a stale socket, never any other kind of file
+        if os.path.exists(app_state.socket_path):
+            if not stat.S_ISSOCK(os.stat(app_state.socket_path).st_mode):
+                print("[ERROR] " + app_state.socket_path + " exists and is not a socket")
+                return
+            os.unlink(app_state.socket_path)
+
+        server = socketserver.ThreadingUnixStreamServer(app_state.socket_path, RequestHandler)
+        server.daemon_threads = True
+        server.pool = pool
+        print("SPASM server listening on " + app_state.socket_path, file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(app_state.socket_path)
+
+
 '''
 Display Spasm's help information.
 '''
@@ -1642,8 +5250,38 @@ def show_help():
     print(" -b / --baseaddress  - Set the base address of disassembled code,")
     print("                       specified as a hex or decimal value.")
     print(" -n / --numbytes     - The number of bytes to disassemble.")
+    print(" -i / --index        - Align disassembly to the instruction containing the base address,")
+    print("                       using a cached index of the code's instruction addresses.")
     print(" -o / --output       - Save assembled code to a file. The name is optional; if no name")
     print("                       is specified, the input file name is used with a suitable extension")
+    print("                       When disassembling, pass a .asm file name to write the code as source.")
+    print("                       Pass - as the name to write the code to stdout, and - as an input")
+    print("                       file to assemble source read from stdin.")
+    print(" --format            - The format of code written to stdout: rom (the default) or 6809.")
+    print(" --variant           - Build a variant of the code, eg. rev2,start=$8000,IO_BASE=$FF00:")
+    print("                       a name, then any start address and symbol values. Use more than")
+    print("                       once to build several variants from a single reading of the source.")
+    print(" --symbols           - Load predefined symbols from a .sym or .sym.json symbol file.")
+    print("                       Use more than once to load several files.")
+    print(" --run               - Run the assembled code on a simulated 6809, from the specified label")
+    print("                       or address, and report its cycle and instruction counts.")
+    print(" --cycles            - The cycle budget of a --run simulation. Default: 10000000.")
+    print(" --profile           - Count how many times each op and address is executed in a --run simulation.")
+    print(" --analyse           - Report the worst-case cycle count and stack depth of each routine.")
+    print(" --bound             - Set the maximum number of times loops' heads run per entry, for")
+    print("                       --analyse, eg. loop=10,inner=200. Use more than once if required.")
+    print(" --parallel          - Encode the lines of large source files on several processes.")
+    print("                       Use --workers to set the number of processes.")
+    print(" --lowmem            - Read source files on each pass rather than hold them in memory.")
+    print(" --link              - Link .obj object files into a program placed at the start address.")
+    print("                       Write object files by passing a .obj file name to -o.")
+    print(" -j / --json         - Output listings, diagnostics and code as JSON records, one per line.")
+    print(" -x / --xref         - Build a cross-reference index of symbol references. It is written")
+    print("                       alongside the output file, or displayed if there is no output file.")
+    print(" --server            - Run as a server, taking JSON requests on stdin and writing")
+    print("                       JSON responses to stdout.")
+    print(" --socket            - Run as a server listening on the Unix socket at the specified path.")
+    print(" --workers           - The number of server or --parallel worker processes. Default: one per CPU.")
     print(" -l / --lower        - Display opcodes in lowercase.")
     print(" -u / --upper        - Display opcodes in uppercase.")
     print("                       NOTE the above two switches will overwrite each other")
@@ -1660,10 +5298,29 @@ def show_version():
     print("SPASM copyright (c) 2021 Tony Smith (@smittytone)")
 
 
+app_state = AppState()
+
+
 if __name__ == '__main__':
     # Do we have any arguments?
     if len(sys.argv) > 1:
-        app_state = AppState()
+        if "-j" in sys.argv or "--json" in sys.argv:
+            # FROM 1.4.0: Keep stdout for JSON records and send all other output to stderr
+            app_state.json_stream = sys.stdout
+            app_state.verbose = False
+            sys.stdout = sys.stderr
+        for index, item in enumerate(sys.argv):
+            if item not in ("-o", "--outfile"): continue
+            next_item = sys.argv[index + 1] if index + 1 < len(sys.argv) else None
+            # A bare -o also writes the machine code to stdout when the source is read from stdin
+            bare_stdin = (next_item is None or next_item[0] == "-") and "-" in sys.argv[1:] and "--variant" not in sys.argv
+            if next_item == "-" or bare_stdin:
+                # FROM 1.4.0: Keep stdout for the machine code and send all other output to stderr
+                if app_state.json_stream is not None:
+                    print("[ERROR] -j / --json cannot be used with output to stdout")
+                    sys.exit(1)
+                app_state.image_stream = sys.stdout.buffer
+                sys.stdout = sys.stderr
         files_flag = False
         arg_flag = False
         arg_files = []
@@ -1674,6 +5331,80 @@ if __name__ == '__main__':
                 show_version()
             elif item in ("-q", "--quiet"):
                 app_state.verbose = False
+            elif item in ("-j", "--json"):
+                # Handled above
+                pass
+            elif item == "--server":
+                app_state.server = True
+            elif item == "--socket":
+                if index + 1 >= len(sys.argv):
+                    print("[ERROR] --socket must be followed by a path")
+                    sys.exit(1)
+                app_state.server = True
+                app_state.socket_path = sys.argv[index + 1]
+                arg_flag = True
+            elif item == "--workers":
+                number = str_to_int(sys.argv[index + 1]) if index + 1 < len(sys.argv) else False
+                if number is False or number < 1:
+                    print("[ERROR] --workers must be followed by a positive integer value")
+                    sys.exit(1)
+                app_state.workers = number
+                arg_flag = True
+            elif item == "--format":
+                if index + 1 >= len(sys.argv) or sys.argv[index + 1] not in ("rom", "6809"):
+                    print("[ERROR] --format must be followed by rom or 6809")
+                    sys.exit(1)
+                app_state.out_format = sys.argv[index + 1]
+                arg_flag = True
+            elif item == "--link":
+                app_state.link = True
+            elif item == "--variant":
+                variant = get_variant(sys.argv[index + 1]) if index + 1 < len(sys.argv) else None
+                if variant is None:
+                    print("[ERROR] --variant must be followed by a name, then any start address and symbols,")
+                    print("        eg. rev2,start=$8000,IO_BASE=$FF00")
+                    sys.exit(1)
+                app_state.variants.append(variant)
+                arg_flag = True
+            elif item == "--symbols":
+                if index + 1 >= len(sys.argv):
+                    print("[ERROR] --symbols must be followed by a .sym or .sym.json file")
+                    sys.exit(1)
+                if add_symbol_file(sys.argv[index + 1]) is False: sys.exit(1)
+                arg_flag = True
+            elif item == "--run":
+                if index + 1 >= len(sys.argv):
+                    print("[ERROR] --run must be followed by an entry point label or address")
+                    sys.exit(1)
+                app_state.run_entry = sys.argv[index + 1]
+                arg_flag = True
+            elif item == "--analyse":
+                app_state.analyse = True
+            elif item == "--bound":
+                bounds = get_loop_bounds(sys.argv[index + 1]) if index + 1 < len(sys.argv) else None
+                if bounds is None:
+                    print("[ERROR] --bound must be followed by loop head labels or addresses and their bounds,")
+                    print("        eg. loop=10,inner=200")
+                    sys.exit(1)
+                app_state.loop_bounds.update(bounds)
+                arg_flag = True
+            elif item == "--profile":
+                app_state.run_profile = True
+            elif item == "--cycles":
+                number = str_to_int(sys.argv[index + 1]) if index + 1 < len(sys.argv) else False
+                if number is False or number < 1:
+                    print("[ERROR] --cycles must be followed by a positive integer value")
+                    sys.exit(1)
+                app_state.run_cycles = number
+                arg_flag = True
+            elif item == "--parallel":
+                app_state.parallel = True
+            elif item == "--lowmem":
+                app_state.low_memory = True
+            elif item in ("-x", "--xref"):
+                app_state.xref = {}
+            elif item in ("-i", "--index"):
+                app_state.use_index = True
             elif item in ("-u", "--upper"):
                 app_state.show_upper = 1
             elif item in ("-l", "--lower"):
@@ -1693,14 +5424,18 @@ if __name__ == '__main__':
                 show_verbose("Code start address set to 0x{0:04X}".format(an_address))
                 arg_flag = True
             elif item in ("-o", "--outfile"):
-                if index + 1 >= len(sys.argv) or sys.argv[index + 1][0] == "-":
+                if index + 1 < len(sys.argv) and sys.argv[index + 1] == "-":
+                    app_state.out_file = "-"
+                    arg_flag = True
+                elif index + 1 >= len(sys.argv) or sys.argv[index + 1][0] == "-":
                     app_state.out_file = "*"
                 else:
                     app_state.out_file = sys.argv[index + 1]
                     _, out_file_ext = os.path.splitext(app_state.out_file)
-                    if out_file_ext not in (".6809", ".rom"):
-                        print("[ERROR] -o / --outfile must specify a .6809 or .rom file")
+                    if out_file_ext not in (".6809", ".rom", ".asm", ".asm6809", ".obj"):
+                        print("[ERROR] -o / --outfile must specify a .6809, .rom, .asm or .obj file")
                         sys.exit(1)
+                    app_state.object_mode = out_file_ext == ".obj"
                     # Make sure 'outfile' is a .6809 file
                     parts = app_state.out_file.split(".")
                     if parts == 1: app_state.out_file += ".6809"
@@ -1728,6 +5463,9 @@ if __name__ == '__main__':
                 app_state.base_address = an_address
                 show_verbose("Disassembly start address set to 0x{0:04X}".format(an_address))
                 arg_flag = True
+            elif item == "-":
+                # FROM 1.4.0: Assemble source read from standard input
+                arg_files.append(item)
             else:
                 if item[0] == "-":
                     print("[ERROR] unknown option: " + item)
@@ -1735,10 +5473,19 @@ if __name__ == '__main__':
                 elif index != 0 and arg_flag is False:
                     # Handle any included .asm, .6809 or .rom files
                     _, arg_file_ext = os.path.splitext(item)
-                    if arg_file_ext in (".asm", ".asm6809", ".6809", ".rom"):
+                    if arg_file_ext in (".asm", ".asm6809", ".6809", ".rom", ".obj"):
                         arg_files.append(item)
                     else:
-                        print("[ERROR] File " + item + " is not a .asm, .6809 or .rom file")
+                        print("[ERROR] File " + item + " is not a .asm, .6809, .rom or .obj file")
+        if len(app_state.variants) > 1 and app_state.out_file == "-":
+            print("[ERROR] Only one variant can be written to stdout")
+            sys.exit(1)
+
+        # FROM 1.4.0: Run as a server, if requested
+        if app_state.server is True:
+            run_server()
+            sys.exit(0)
+
         # Process any named files
         if arg_files: handle_files(arg_files)
     else: